@@ -0,0 +1,236 @@
+"""
+Batch conversion: many Markdown documents in, one ZIP of DOCX files out.
+
+Documents are converted concurrently on the conversion pool and added to the
+ZIP as soon as each one finishes, so the response streams while the rest of the
+batch is still converting. Failures are reported per document in manifest.json
+instead of failing the whole batch.
+"""
+
+import asyncio
+import io
+import json
+import logging
+import os
+import re
+import subprocess
+import uuid
+import zipfile
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, List, Optional
+
+from . import metrics
+from .config import settings
+from .converter import run_conversion, run_conversion_in_memory, conversion_cache_key
+from .result_cache import result_cache
+from .storage import output_path
+from .worker_pool import conversion_pool
+
+logger = logging.getLogger(__name__)
+
+_UNSAFE_NAME_RE = re.compile(r'[^\w\-. ]+')
+
+# Files taken from an uploaded ZIP archive
+MARKDOWN_EXTENSIONS = (".md", ".markdown", ".txt")
+
+
+class BatchRequestError(ValueError):
+    """Raised for a batch request that cannot be processed at all"""
+
+
+@dataclass
+class BatchDocument:
+    """One document of a batch request"""
+    index: int
+    name: str
+    text: str
+
+
+def safe_document_name(name: Optional[str], index: int) -> str:
+    """File name (without extension) for a batch entry"""
+    name = os.path.splitext(os.path.basename(name or ""))[0]
+    name = _UNSAFE_NAME_RE.sub("_", name).strip(" .")
+    return name[:100] or f"document_{index + 1:03d}"
+
+
+def build_batch(entries: List[Dict[str, Optional[str]]]) -> List[BatchDocument]:
+    """
+    Validate the raw entries ({"name": ..., "text": ...}) of a batch request and
+    give every document a unique file name.
+
+    Raises:
+        BatchRequestError: If the batch is empty or has too many documents
+    """
+    if not entries:
+        raise BatchRequestError("The batch contains no documents")
+    if len(entries) > settings.BATCH_MAX_DOCUMENTS:
+        raise BatchRequestError(f"A batch may contain at most {settings.BATCH_MAX_DOCUMENTS} documents")
+
+    documents = []
+    used = set()
+    for index, entry in enumerate(entries):
+        name = safe_document_name(entry.get("name"), index)
+        unique, suffix = name, 2
+        while unique.lower() in used:
+            unique, suffix = f"{name}_{suffix}", suffix + 1
+        used.add(unique.lower())
+        documents.append(BatchDocument(index=index, name=unique, text=entry.get("text") or ""))
+    return documents
+
+
+def read_markdown_zip(data: bytes) -> List[Dict[str, Optional[str]]]:
+    """
+    Entries for the Markdown files in an uploaded ZIP archive, ordered by path
+
+    Raises:
+        BatchRequestError: If the archive is invalid or holds too much data
+    """
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(data))
+    except zipfile.BadZipFile:
+        raise BatchRequestError("The uploaded archive is not a valid ZIP file")
+    with archive:
+        members = sorted(
+            (info for info in archive.infolist()
+             if not info.is_dir() and info.filename.lower().endswith(MARKDOWN_EXTENSIONS)
+             and not os.path.basename(info.filename).startswith(".") and "__MACOSX/" not in info.filename),
+            key=lambda info: info.filename,
+        )
+        if len(members) > settings.BATCH_MAX_DOCUMENTS:
+            raise BatchRequestError(f"A batch may contain at most {settings.BATCH_MAX_DOCUMENTS} documents")
+        entries = []
+        for info in members:
+            # Checked before decompressing, so a ZIP bomb is never inflated
+            if info.file_size > settings.MAX_INPUT_SIZE:
+                raise BatchRequestError(f"'{info.filename}' is too large")
+            try:
+                text = archive.read(info).decode("utf-8-sig")
+            except UnicodeDecodeError:
+                raise BatchRequestError(f"'{info.filename}' is not valid UTF-8 text")
+            entries.append({"name": info.filename, "text": text})
+    return entries
+
+
+def _convert_on_disk(text: str, fmt: str) -> bytes:
+    """File-based conversion job for batches; removes its temporary files"""
+    uid = uuid.uuid4().hex
+    md_file = output_path(uid, "md")
+    out_file = output_path(uid, fmt)
+    try:
+        run_conversion(text, md_file, out_file, fmt)
+        with open(out_file, "rb") as f:
+            return f.read()
+    finally:
+        for path in (md_file, out_file):
+            if os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    logger.warning(f"Could not clean up {path} after batch conversion.")
+
+
+async def convert_document(document: BatchDocument, fmt: str) -> bytes:
+    """
+    Convert one batch document, going through the result cache.
+
+    Raises:
+        ValueError: If the document is empty or too large
+    """
+    if not document.text.strip():
+        raise ValueError("Document is empty")
+    if len(document.text.encode("utf-8")) > settings.MAX_INPUT_SIZE:
+        raise ValueError("Input text too large")
+
+    cache_key = conversion_cache_key(document.text, fmt) if settings.RESULT_CACHE_ENABLED else None
+    if cache_key:
+        data = await asyncio.to_thread(result_cache.get, cache_key, fmt)
+        if data is not None:
+            return data
+
+    # Wait for a pool slot instead of rejecting: the batch is already accepted
+    if settings.IN_MEMORY_CONVERSION:
+        data = await conversion_pool.run(run_conversion_in_memory, document.text, fmt, wait=True)
+    else:
+        data = await conversion_pool.run(_convert_on_disk, document.text, fmt, wait=True)
+
+    if cache_key:
+        await asyncio.to_thread(result_cache.put, cache_key, fmt, data)
+    return data
+
+
+class _ZipStream:
+    """Write-only file object whose contents are drained piece by piece"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _error_message(error: BaseException) -> str:
+    if isinstance(error, ValueError):
+        return str(error)
+    if isinstance(error, (subprocess.CalledProcessError, subprocess.TimeoutExpired)):
+        return "Conversion failed due to an internal processing error."
+    return "An unexpected error occurred during conversion."
+
+
+async def stream_batch_zip(documents: List[BatchDocument], fmt: str) -> AsyncIterator[bytes]:
+    """
+    Convert `documents` concurrently and yield a ZIP archive of the results as
+    they finish, followed by manifest.json with the status of every document.
+    """
+    # Leave room on the shared pool for regular /api/convert requests
+    slots = asyncio.Semaphore(max(1, min(settings.BATCH_CONCURRENCY, conversion_pool.workers)))
+
+    async def convert(document: BatchDocument):
+        async with slots:
+            try:
+                return document, await convert_document(document, fmt), None
+            except Exception as e:
+                if not isinstance(e, ValueError):
+                    logger.error(f"Batch conversion of '{document.name}' failed: {e}", exc_info=True)
+                return document, None, e
+
+    tasks = [asyncio.create_task(convert(document)) for document in documents]
+    manifest: List[Optional[dict]] = [None] * len(documents)
+    stream = _ZipStream()
+    try:
+        # DOCX files are ZIP archives already, so they are stored without recompression
+        with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_STORED) as archive:
+            for finished in asyncio.as_completed(tasks):
+                document, data, error = await finished
+                if error is None:
+                    file_name = f"{document.name}.{fmt}"
+                    await asyncio.to_thread(archive.writestr, file_name, data)
+                    manifest[document.index] = {"name": document.name, "file": file_name, "status": "ok"}
+                    metrics.increment("batch.documents_converted")
+                else:
+                    manifest[document.index] = {"name": document.name, "status": "error", "error": _error_message(error)}
+                    metrics.increment("batch.documents_failed")
+                chunk = stream.drain()
+                if chunk:
+                    yield chunk
+            summary = {
+                "format": fmt,
+                "total": len(documents),
+                "succeeded": sum(1 for entry in manifest if entry["status"] == "ok"),
+                "documents": manifest,
+            }
+            summary["failed"] = summary["total"] - summary["succeeded"]
+            archive.writestr("manifest.json", json.dumps(summary, ensure_ascii=False, indent=2))
+        yield stream.drain()
+    finally:
+        # Client went away or something broke: stop converting the rest
+        for task in tasks:
+            task.cancel()
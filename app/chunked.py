@@ -0,0 +1,164 @@
+"""
+Chunked conversion for large documents: the Markdown is split at top-level
+heading boundaries, the pieces are preprocessed and converted in parallel on a
+process pool, and the resulting packages are merged with merge_docx.
+
+Splitting tracks code fences and tables the same way
+enhance_markdown_structure does, so a piece never starts inside one of them.
+Documents whose pieces would not convert independently (reference-style link
+definitions, footnotes) are not split.
+"""
+
+import atexit
+import logging
+import re
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Callable, List, Optional
+
+from . import metrics
+from .config import settings
+from .docx_merge import merge_docx, DocxMergeError
+
+logger = logging.getLogger(__name__)
+
+_HEADING_RE = re.compile(r"^(#{1,6})[ \t]+\S")
+# Link reference / footnote definitions and inline footnotes refer across sections
+_CROSS_REFERENCE_RE = re.compile(r"^ {0,3}\[[^\]]+\]:|\^\[", re.MULTILINE)
+
+
+def _front_matter_end(lines: List[str]) -> int:
+    """Index of the first line after the YAML front matter (0 without one)"""
+    first = next((i for i, line in enumerate(lines) if line.strip()), None)
+    if first is None or lines[first].strip() != "---":
+        return 0
+    for i in range(first + 1, len(lines)):
+        if lines[i].strip() in ("---", "..."):
+            return i + 1
+    return 0
+
+
+def _section_starts(lines: List[str], start: int, all_levels: bool = False) -> List[int]:
+    """Lines starting a section at the shallowest heading level of the document (or at any heading)"""
+    state = {"in_code_block": False, "in_table": False}
+    headings = []
+    previous_blank = True
+    for i in range(start, len(lines)):
+        line = lines[i]
+        stripped = line.strip()
+        if stripped.startswith("```"):
+            state["in_code_block"] = not state["in_code_block"]
+        elif not state["in_code_block"]:
+            if "|" in line and not stripped.startswith("#"):
+                state["in_table"] = True
+            elif state["in_table"] and not stripped:
+                state["in_table"] = False
+            heading = _HEADING_RE.match(line)
+            # Pandoc only reads a heading after a blank line
+            if heading and previous_blank and not state["in_table"]:
+                headings.append((i, len(heading.group(1))))
+        previous_blank = not stripped
+    if not headings:
+        return []
+    if all_levels:
+        return [i for i, _ in headings]
+    top_level = min(level for _, level in headings)
+    return [i for i, level in headings if level == top_level]
+
+
+def split_markdown(text: str, target_bytes: int, all_levels: bool = False) -> Optional[List[str]]:
+    """
+    Split `text` into pieces of about `target_bytes` that start at top-level
+    headings (at any heading with `all_levels`).
+
+    Returns:
+        The pieces, or None when the document cannot be split safely
+    """
+    if _CROSS_REFERENCE_RE.search(text):
+        return None
+    lines = text.split("\n")
+    # Front matter and anything before the first section stay with the first section
+    starts = _section_starts(lines, _front_matter_end(lines), all_levels)[1:]
+    if not starts:
+        return None
+
+    pieces: List[str] = []
+    piece_start = 0
+    size = 0
+    boundaries = set(starts)
+    for i, line in enumerate(lines):
+        if i in boundaries and size >= target_bytes:
+            pieces.append("\n".join(lines[piece_start:i]))
+            piece_start, size = i, 0
+        size += len(line.encode("utf-8")) + 1
+    pieces.append("\n".join(lines[piece_start:]))
+    return pieces if len(pieces) > 1 else None
+
+
+class ChunkPool:
+    """Process pool shared by chunked conversions, started on first use"""
+
+    def __init__(self, workers: int):
+        self.workers = max(1, workers)
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                logger.info(f"Started chunk conversion pool with {self.workers} processes")
+            return self._executor
+
+    def map(self, fn: Callable, pieces: List[str], *args) -> List[bytes]:
+        """`fn(index, piece, *args)` for every piece, in parallel; results in piece order"""
+        executor = self._get_executor()
+        futures = [executor.submit(fn, index, piece, *args) for index, piece in enumerate(pieces)]
+        try:
+            return [future.result() for future in futures]
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def stats(self) -> dict:
+        return {"workers": self.workers, "started": self._executor is not None}
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+chunk_pool = ChunkPool(settings.CHUNK_WORKERS)
+atexit.register(chunk_pool.shutdown)
+
+
+def convert_in_chunks(text: str, convert_piece: Callable, *args) -> Optional[bytes]:
+    """
+    Convert `text` piece by piece with `convert_piece(index, piece, *args)` on
+    the chunk pool and merge the results. `convert_piece` must be picklable.
+
+    Returns:
+        The merged document, or None when `text` is too small or cannot be
+        converted in pieces
+    """
+    if settings.CHUNKED_CONVERSION_MIN_BYTES <= 0 or len(text.encode("utf-8")) < settings.CHUNKED_CONVERSION_MIN_BYTES:
+        return None
+    pieces = split_markdown(text, settings.CHUNK_TARGET_BYTES)
+    if pieces is None:
+        metrics.increment("chunked.unsplittable")
+        return None
+
+    logger.info(f"Converting {len(text)} chars in {len(pieces)} chunks")
+    with metrics.timed("conversion.chunked"):
+        parts = chunk_pool.map(convert_piece, pieces, *args)
+        try:
+            with metrics.timed("conversion.chunk_merge"):
+                data = merge_docx(parts)
+        except DocxMergeError as e:
+            logger.info(f"Chunked conversion results cannot be merged ({e}), converting in one piece")
+            metrics.increment("chunked.unmergeable")
+            return None
+    metrics.increment("chunked.documents")
+    return data
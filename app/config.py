@@ -22,13 +22,103 @@ class Settings(BaseSettings):
 
     # Maximum file age in hours before cleanup
     MAX_FILE_AGE_HOURS: int = int(os.getenv("MAX_FILE_AGE_HOURS", "24"))
+    # Seconds between runs of the background sweeper that deletes expired files
+    CLEANUP_INTERVAL_SECONDS: int = int(os.getenv("CLEANUP_INTERVAL_SECONDS", "600"))
 
     # Rate limiting: max requests per minute per IP
     RATE_LIMIT: int = int(os.getenv("RATE_LIMIT", "30"))
+    # Length of the sliding window in seconds, and where the counters live: "memory"
+    # (per worker process), "sqlite" (shared by the workers of one host) or "redis"
+    RATE_LIMIT_WINDOW: int = int(os.getenv("RATE_LIMIT_WINDOW", "60"))
+    RATE_LIMIT_BACKEND: str = os.getenv("RATE_LIMIT_BACKEND", "memory")
+    RATE_LIMIT_SQLITE_PATH: str = os.getenv("RATE_LIMIT_SQLITE_PATH", "")
+    RATE_LIMIT_REDIS_URL: str = os.getenv("RATE_LIMIT_REDIS_URL", os.getenv("JOB_REDIS_URL", "redis://localhost:6379/0"))
 
     # Maximum size of markdown input in bytes (1MB default)
     MAX_INPUT_SIZE: int = int(os.getenv("MAX_INPUT_SIZE", "1048576"))
 
+    # Conversion worker pool: "thread" or "process" executor, number of workers and
+    # how many extra conversions may wait for a worker before requests get a 503
+    CONVERT_EXECUTOR: str = os.getenv("CONVERT_EXECUTOR", "thread")
+    CONVERT_WORKERS: int = int(os.getenv("CONVERT_WORKERS", "4"))
+    CONVERT_QUEUE_LIMIT: int = int(os.getenv("CONVERT_QUEUE_LIMIT", "16"))
+    # Seconds advertised in the Retry-After header when the pool is saturated
+    CONVERT_RETRY_AFTER: int = int(os.getenv("CONVERT_RETRY_AFTER", "5"))
+
+    # Seconds a Pandoc run may take for a request, and for a job submitted to /api/jobs
+    PANDOC_TIMEOUT: int = int(os.getenv("PANDOC_TIMEOUT", "120"))
+    JOB_PANDOC_TIMEOUT: int = int(os.getenv("JOB_PANDOC_TIMEOUT", "600"))
+
+    # Asynchronous jobs: where job records live ("memory", "sqlite" or "redis"), the
+    # SQLite file or Redis URL, and how many jobs convert at the same time
+    JOB_BACKEND: str = os.getenv("JOB_BACKEND", "memory")
+    JOB_SQLITE_PATH: str = os.getenv("JOB_SQLITE_PATH", os.path.join(os.getenv("OUT_DIR", str(BASE_DIR / "outputs")), "jobs", "jobs.sqlite3"))
+    JOB_REDIS_URL: str = os.getenv("JOB_REDIS_URL", "redis://localhost:6379/0")
+    JOB_CONCURRENCY: int = int(os.getenv("JOB_CONCURRENCY", "2"))
+
+    # Convert entirely in memory (Pandoc via stdin/stdout, no temp files). Outputs
+    # are written to OUT_DIR only when a request asks for persistence.
+    IN_MEMORY_CONVERSION: bool = os.getenv("IN_MEMORY_CONVERSION", "true").lower() in ("true", "1", "yes")
+
+    # /api/convert/batch: maximum documents per request and how many of them
+    # convert at the same time (capped by CONVERT_WORKERS)
+    BATCH_MAX_DOCUMENTS: int = int(os.getenv("BATCH_MAX_DOCUMENTS", "50"))
+    BATCH_CONCURRENCY: int = int(os.getenv("BATCH_CONCURRENCY", os.getenv("CONVERT_WORKERS", "4")))
+    # Combined size of the documents merged by /api/convert/merge (8MB default)
+    MERGE_MAX_INPUT_SIZE: int = int(os.getenv("MERGE_MAX_INPUT_SIZE", str(8 * 1024 * 1024)))
+
+    # Content-addressed cache of finished conversions in OUT_DIR/cache: disk budget,
+    # optional in-memory tier (0 disables it) and entry lifetime
+    RESULT_CACHE_ENABLED: bool = os.getenv("RESULT_CACHE_ENABLED", "true").lower() in ("true", "1", "yes")
+    RESULT_CACHE_MAX_BYTES: int = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+    RESULT_CACHE_MEMORY_BYTES: int = int(os.getenv("RESULT_CACHE_MEMORY_BYTES", "0"))
+    RESULT_CACHE_TTL_HOURS: int = int(os.getenv("RESULT_CACHE_TTL_HOURS", os.getenv("MAX_FILE_AGE_HOURS", "24")))
+
+    # Inputs of at least CHUNKED_CONVERSION_MIN_BYTES (0 disables it) are split at top-level
+    # headings into pieces of about CHUNK_TARGET_BYTES, converted on CHUNK_WORKERS processes
+    CHUNKED_CONVERSION_MIN_BYTES: int = int(os.getenv("CHUNKED_CONVERSION_MIN_BYTES", str(256 * 1024)))
+    CHUNK_TARGET_BYTES: int = int(os.getenv("CHUNK_TARGET_BYTES", str(64 * 1024)))
+    CHUNK_WORKERS: int = int(os.getenv("CHUNK_WORKERS", str(os.cpu_count() or 2)))
+
+    # Sessions of /api/convert/incremental (idle ones expire after the TTL) and the
+    # memory budget (bytes) of the converted blocks they share
+    INCREMENTAL_MAX_SESSIONS: int = int(os.getenv("INCREMENTAL_MAX_SESSIONS", "100"))
+    INCREMENTAL_SESSION_TTL_SECONDS: int = int(os.getenv("INCREMENTAL_SESSION_TTL_SECONDS", "3600"))
+    INCREMENTAL_CACHE_BYTES: int = int(os.getenv("INCREMENTAL_CACHE_BYTES", str(64 * 1024 * 1024)))
+
+    # Live preview (/api/preview): memory budget (bytes) for the HTML of rendered blocks, Pandoc
+    # processes used for previews at once, seconds one render may take, and the window (ms) in
+    # which edits sent over /api/preview/ws are coalesced into one render
+    PREVIEW_CACHE_BYTES: int = int(os.getenv("PREVIEW_CACHE_BYTES", str(16 * 1024 * 1024)))
+    PREVIEW_CONCURRENCY: int = int(os.getenv("PREVIEW_CONCURRENCY", "4"))
+    PREVIEW_TIMEOUT: int = int(os.getenv("PREVIEW_TIMEOUT", "15"))
+    PREVIEW_DEBOUNCE_MS: int = int(os.getenv("PREVIEW_DEBOUNCE_MS", "150"))
+
+    # Memory budget (bytes) for memoized preprocessing results; 0 disables it
+    PREPROCESS_MEMO_BYTES: int = int(os.getenv("PREPROCESS_MEMO_BYTES", str(32 * 1024 * 1024)))
+
+    # Extra comma-separated words/phrases kept LTR in addition to the built-in technical terms
+    LTR_EXTRA_TERMS: str = os.getenv("LTR_EXTRA_TERMS", "")
+
+    # zlib level (0-9) for the rewritten word/document.xml; other DOCX parts are
+    # copied with their original compression
+    DOCX_COMPRESSION_LEVEL: int = int(os.getenv("DOCX_COMPRESSION_LEVEL", "6"))
+
+    # Persistent `pandoc server` pool (falls back to one pandoc process per request)
+    PANDOC_SERVER_ENABLED: bool = os.getenv("PANDOC_SERVER_ENABLED", "false").lower() in ("true", "1", "yes")
+    PANDOC_SERVER_POOL_SIZE: int = int(os.getenv("PANDOC_SERVER_POOL_SIZE", "2"))
+    # Recycle a server process after this many conversions (0 disables recycling)
+    PANDOC_SERVER_MAX_JOBS: int = int(os.getenv("PANDOC_SERVER_MAX_JOBS", "500"))
+    PANDOC_SERVER_TIMEOUT: int = int(os.getenv("PANDOC_SERVER_TIMEOUT", "120"))
+
+    # In-process DOCX writer for plain documents (headings, paragraphs, lists,
+    # bold/italic, pipe tables); anything else is still rendered by Pandoc
+    NATIVE_DOCX_ENABLED: bool = os.getenv("NATIVE_DOCX_ENABLED", "true").lower() in ("true", "1", "yes")
+    # How Pandoc's DOCX output gets its RTL and pagination properties: "filter" (Lua
+    # filter plus reference document styles, during the conversion) or "postprocess"
+    # (rewrite word/document.xml afterwards)
+    RTL_MODE: str = os.getenv("RTL_MODE", "filter").lower()
+
     # Enable debug mode
     DEBUG: bool = os.getenv("DEBUG", "").lower() in ("true", "1", "yes")
 
@@ -39,6 +129,23 @@ class Settings(BaseSettings):
     # Google Analytics 4 Measurement Protocol
     GA_MEASUREMENT_ID: str | None = os.getenv("GA_MEASUREMENT_ID")
     GA_API_SECRET: str | None = os.getenv("GA_API_SECRET")
+    # Measurement Protocol URL (point it at /api/analytics/stub/collect to test locally)
+    GA_ENDPOINT: str = os.getenv("GA_ENDPOINT", "https://www.google-analytics.com/mp/collect")
+    # Background analytics sender: queued events, events per request (max 25), seconds to
+    # wait for a batch to fill up, and size of the overflow file (0 drops overflowing events)
+    ANALYTICS_QUEUE_SIZE: int = int(os.getenv("ANALYTICS_QUEUE_SIZE", "1000"))
+    ANALYTICS_BATCH_SIZE: int = int(os.getenv("ANALYTICS_BATCH_SIZE", "25"))
+    ANALYTICS_FLUSH_SECONDS: float = float(os.getenv("ANALYTICS_FLUSH_SECONDS", "2"))
+    ANALYTICS_SPILL_MAX_BYTES: int = int(os.getenv("ANALYTICS_SPILL_MAX_BYTES", str(10 * 1024 * 1024)))
+    # Accept Measurement Protocol requests at /api/analytics/stub/collect (for tests)
+    ANALYTICS_STUB_ENABLED: bool = os.getenv("ANALYTICS_STUB_ENABLED", "false").lower() in ("true", "1", "yes")
+
+    @validator("RTL_MODE")
+    def check_rtl_mode(cls, v):
+        """Only the two RTL strategies are supported"""
+        if v not in ("filter", "postprocess"):
+            raise ValueError(f"Unsupported RTL_MODE: '{v}'. Use 'filter' or 'postprocess'.")
+        return v
 
     @validator("OUT_DIR")
     def create_out_dir(cls, v):
@@ -61,6 +168,18 @@ MAX_FILE_AGE_HOURS = settings.MAX_FILE_AGE_HOURS
 RATE_LIMIT = settings.RATE_LIMIT
 MAX_INPUT_SIZE = settings.MAX_INPUT_SIZE
 DEBUG = settings.DEBUG
+CONVERT_EXECUTOR = settings.CONVERT_EXECUTOR
+CONVERT_WORKERS = settings.CONVERT_WORKERS
+CONVERT_QUEUE_LIMIT = settings.CONVERT_QUEUE_LIMIT
+CONVERT_RETRY_AFTER = settings.CONVERT_RETRY_AFTER
+PANDOC_SERVER_ENABLED = settings.PANDOC_SERVER_ENABLED
+NATIVE_DOCX_ENABLED = settings.NATIVE_DOCX_ENABLED
+RTL_MODE = settings.RTL_MODE
+IN_MEMORY_CONVERSION = settings.IN_MEMORY_CONVERSION
+PANDOC_TIMEOUT = settings.PANDOC_TIMEOUT
+DOCX_COMPRESSION_LEVEL = settings.DOCX_COMPRESSION_LEVEL
+RESULT_CACHE_ENABLED = settings.RESULT_CACHE_ENABLED
+BATCH_MAX_DOCUMENTS = settings.BATCH_MAX_DOCUMENTS
 
 # Firebase Settings
 FIREBASE_SERVICE_ACCOUNT_KEY_PATH = settings.FIREBASE_SERVICE_ACCOUNT_KEY_PATH
@@ -2,24 +2,166 @@ import subprocess
 import os
 import logging
 from datetime import datetime, timedelta
+import functools
 import glob
+import hashlib
+import json
+import tempfile
+import threading
 from pathlib import Path
+from typing import List, Optional
 import zipfile
 import xml.etree.ElementTree as ET
 from io import BytesIO
 # Ensure these are correctly imported from your config module
 # and that the config module itself is correctly set up.
-from .config import OUT_DIR, ALLOWED, MAX_FILE_AGE_HOURS
+from .config import (
+    OUT_DIR, ALLOWED, MAX_FILE_AGE_HOURS, PANDOC_SERVER_ENABLED, DOCX_COMPRESSION_LEVEL, PANDOC_TIMEOUT,
+    NATIVE_DOCX_ENABLED, RTL_MODE, settings,
+)
+from . import metrics
+from .ooxml import RtlXmlRewriter, UnsupportedDocumentXml, CHUNK_SIZE, copy_zip_member_raw
+from .pandoc_server import pandoc_server_pool, PandocServerError
+from .docx_writer import render_docx, UnsupportedMarkdown, NATIVE_DOCX_VERSION
+from .chunked import convert_in_chunks
+from .utils.text_processor import preprocess_farsi_text, enhanced_processor
+from .storage import drop_expired_shards
 
 # Setup logging
 logger = logging.getLogger(__name__)
 
+# Style configuration baked into the RTL reference document. Any change here
+# (or to REFERENCE_DOC_VERSION / the python-docx version) yields a new cache key,
+# so the reference document is rebuilt exactly once per configuration.
+REFERENCE_DOC_STYLE = {
+    "font": "DejaVu Sans",          # Available font with Unicode support
+    "font_size": 12,
+    "heading_sizes": {1: 18, 2: 16, 3: 14, 4: 13, 5: 12, 6: 11},
+    "page_width": 595,              # A4 width in points
+    "page_height": 842,             # A4 height in points
+    "margin": 72,                   # 1 inch
+    "space_after": 6,
+    "heading_space_before": 12,
+}
 
-def create_reference_docx():
+# Bump when the builder code in create_reference_docx changes its output
+REFERENCE_DOC_VERSION = 2
+
+_reference_lock = threading.Lock()
+_reference_path: Optional[Path] = None
+
+
+def _python_docx_version() -> str:
+    try:
+        from importlib.metadata import version
+        return version("python-docx")
+    except Exception:
+        return "unknown"
+
+
+def reference_docx_key() -> str:
+    """
+    Hash of everything that influences the reference document's content
+    """
+    payload = json.dumps(
+        {
+            "style": REFERENCE_DOC_STYLE,
+            "builder_version": REFERENCE_DOC_VERSION,
+            "python_docx": _python_docx_version(),
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def reference_docx_path() -> Path:
+    """Location of the reference document for the current style configuration"""
+    return Path(OUT_DIR) / f"reference_farsi-{reference_docx_key()}.docx"
+
+
+# Bump when preprocessing or post-processing changes the documents produced for
+# the same input; part of the result cache key
+CONVERTER_VERSION = 2
+
+
+@functools.lru_cache(maxsize=1)
+def pandoc_version() -> str:
+    try:
+        result = subprocess.run(["pandoc", "--version"], capture_output=True, text=True, timeout=10)
+        return result.stdout.split("\n", 1)[0].strip() or "unknown"
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+
+
+def conversion_options() -> dict:
+    """Settings that change the converted document for a given input"""
+    return {
+        "converter_version": CONVERTER_VERSION,
+        "pandoc": pandoc_version(),
+        "reference_doc": reference_docx_key(),
+        "ltr_terms": enhanced_processor.ltr_terms,
+        "compression_level": DOCX_COMPRESSION_LEVEL,
+        "native_docx": NATIVE_DOCX_VERSION if NATIVE_DOCX_ENABLED else None,
+        "rtl_mode": RTL_MODE,
+        "rtl_filter": rtl_filter_version() if RTL_MODE == "filter" else None,
+        "chunked": [settings.CHUNKED_CONVERSION_MIN_BYTES, settings.CHUNK_TARGET_BYTES]
+                   if settings.CHUNKED_CONVERSION_MIN_BYTES > 0 else None,
+    }
+
+
+def conversion_cache_key(text: str, fmt: str, **options) -> str:
+    """
+    Content address of a conversion result: hash of the input text, the
+    format, conversion_options() and any per-request `options`
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(
+        {"format": fmt, "options": conversion_options(), "request": options},
+        sort_keys=True,
+    ).encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def get_reference_docx() -> Optional[Path]:
     """
-    Create a proper RTL reference document for better Farsi rendering
+    Return the cached RTL reference document, building it only when no document
+    exists yet for the current style configuration.
+
+    The document is written atomically, so concurrent workers either see the
+    complete file or build their own copy and atomically replace it.
+    """
+    global _reference_path
+
+    path = _reference_path
+    if path is not None and path.exists():
+        metrics.increment("reference_doc.hits")
+        return path
+
+    with _reference_lock:
+        path = reference_docx_path()
+        if path.exists():
+            # Built earlier by this process, another worker or a previous run
+            metrics.increment("reference_doc.hits")
+        else:
+            path = create_reference_docx(path)
+            if path is None:
+                return None
+            metrics.increment("reference_doc.rebuilds")
+        _reference_path = path
+        return path
+
+
+def create_reference_docx(reference_path: Optional[Path] = None):
     """
-    reference_path = Path(OUT_DIR) / "reference_farsi.docx"
+    Create a proper RTL reference document for better Farsi rendering.
+
+    Prefer get_reference_docx(), which caches the result; this always rebuilds.
+    """
+    if reference_path is None:
+        reference_path = reference_docx_path()
+    style = REFERENCE_DOC_STYLE
 
     try:
         from docx import Document
@@ -36,12 +178,12 @@ def create_reference_docx():
 
         # Configure document defaults for RTL
         section = doc.sections[0]
-        section.page_height = Pt(842)  # A4 height
-        section.page_width = Pt(595)   # A4 width
-        section.left_margin = Pt(72)   # 1 inch
-        section.right_margin = Pt(72)  # 1 inch
-        section.top_margin = Pt(72)    # 1 inch
-        section.bottom_margin = Pt(72) # 1 inch
+        section.page_height = Pt(style["page_height"])
+        section.page_width = Pt(style["page_width"])
+        section.left_margin = Pt(style["margin"])
+        section.right_margin = Pt(style["margin"])
+        section.top_margin = Pt(style["margin"])
+        section.bottom_margin = Pt(style["margin"])
 
         # Get styles object
         styles = doc.styles
@@ -49,15 +191,17 @@ def create_reference_docx():
         # Configure Normal style for RTL
         normal_style = styles['Normal']
         normal_font = normal_style.font
-        normal_font.name = 'DejaVu Sans'  # Available font with Unicode support
-        normal_font.size = Pt(12)
+        normal_font.name = style["font"]
+        normal_font.size = Pt(style["font_size"])
         normal_font.complex_script = True  # Enable complex script support
 
         # Set RTL alignment
         normal_para = normal_style.paragraph_format
         normal_para.alignment = WD_PARAGRAPH_ALIGNMENT.RIGHT
         normal_para.line_spacing_rule = WD_LINE_SPACING.SINGLE
-        normal_para.space_after = Pt(6)
+        normal_para.space_after = Pt(style["space_after"])
+        # Keep all lines of a paragraph together (inherited by the styles based on Normal)
+        normal_para.keep_together = True
 
         # Add RTL properties to normal style
         normal_style_element = normal_style._element
@@ -76,19 +220,20 @@ def create_reference_docx():
         for i in range(1, 7):
             heading_style = styles[f'Heading {i}']
             heading_font = heading_style.font
-            heading_font.name = 'DejaVu Sans'
+            heading_font.name = style["font"]
             heading_font.complex_script = True
             heading_font.bold = True
 
             # Set appropriate sizes
-            sizes = {1: 18, 2: 16, 3: 14, 4: 13, 5: 12, 6: 11}
-            heading_font.size = Pt(sizes[i])
+            heading_font.size = Pt(style["heading_sizes"][i])
 
             # Set RTL alignment for headings
             heading_para = heading_style.paragraph_format
             heading_para.alignment = WD_PARAGRAPH_ALIGNMENT.RIGHT
-            heading_para.space_before = Pt(12)
-            heading_para.space_after = Pt(6)
+            heading_para.space_before = Pt(style["heading_space_before"])
+            heading_para.space_after = Pt(style["space_after"])
+            # Keep headings with the paragraph that follows them
+            heading_para.keep_with_next = True
 
             # Add RTL properties to heading style
             heading_style_element = heading_style._element
@@ -112,7 +257,7 @@ def create_reference_docx():
 
         strong_font = strong_style.font
         strong_font.bold = True
-        strong_font.name = 'DejaVu Sans'
+        strong_font.name = style["font"]
         strong_font.complex_script = True
 
         # Add complex script bold property
@@ -145,7 +290,7 @@ def create_reference_docx():
 
         emphasis_font = emphasis_style.font
         emphasis_font.italic = True
-        emphasis_font.name = 'DejaVu Sans'
+        emphasis_font.name = style["font"]
         emphasis_font.complex_script = True
 
         # Add complex script italic property
@@ -187,6 +332,43 @@ def create_reference_docx():
         except KeyError:
             logger.warning("Table Grid style not found")
 
+        # Styles Pandoc assigns to body text, code blocks and tables, defined here so
+        # the Lua filter mode (RTL_MODE=filter) gets the pagination controls the
+        # post-processing pass would otherwise add to every paragraph and row
+        for name, based_on in (('Body Text', 'Normal'), ('First Paragraph', 'Body Text'),
+                               ('Compact', 'Body Text'), ('Source Code', 'Normal')):
+            try:
+                para_style = styles[name]
+            except KeyError:
+                para_style = styles.add_style(name, WD_STYLE_TYPE.PARAGRAPH)
+                para_style.base_style = styles[based_on]
+            para_style.paragraph_format.keep_together = True
+        styles['Source Code'].paragraph_format.keep_with_next = True
+        styles['Source Code'].font.name = "DejaVu Sans Mono"
+
+        try:
+            pandoc_table_style = styles['Table']
+        except KeyError:
+            pandoc_table_style = styles.add_style('Table', WD_STYLE_TYPE.TABLE)
+            try:
+                pandoc_table_style.base_style = styles['Table Grid']
+            except KeyError:
+                pass
+        # Rows of tables using this style never split across pages
+        table_style_element = pandoc_table_style._element
+        trPr = table_style_element.find(qn('w:trPr'))
+        if trPr is None:
+            trPr = OxmlElement('w:trPr')
+            # trPr goes after pPr/rPr/tblPr and before tcPr/tblStylePr
+            following = [table_style_element.find(qn(tag)) for tag in ('w:tcPr', 'w:tblStylePr')]
+            following = [element for element in following if element is not None]
+            if following:
+                following[0].addprevious(trPr)
+            else:
+                table_style_element.append(trPr)
+        if trPr.find(qn('w:cantSplit')) is None:
+            trPr.append(OxmlElement('w:cantSplit'))
+
         # Add sample content to establish proper formatting
         doc.add_heading('نمونه سند فارسی', 0)
 
@@ -227,8 +409,17 @@ def create_reference_docx():
                 cell.text = cells[row_idx][cell_idx]
                 cell.paragraphs[0].alignment = WD_PARAGRAPH_ALIGNMENT.RIGHT
 
-        # Save the reference document
-        doc.save(str(reference_path))
+        # Save the reference document atomically: write to a temp file in the
+        # same directory, then rename over the final path
+        fd, temp_path = tempfile.mkstemp(dir=str(reference_path.parent), suffix=".docx.tmp")
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                doc.save(temp_file)
+            os.replace(temp_path, reference_path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
         logger.info(f"RTL reference document created successfully: {reference_path}")
         return reference_path
 
@@ -239,7 +430,69 @@ def create_reference_docx():
         logger.error(f"Failed to create reference document: {e}")
         return None
 
-def render_markdown(md_path: str, out_path: str, fmt: str):
+# Pandoc options for DOCX output, shared by the subprocess and pandoc server paths
+PANDOC_DOCX_METADATA = {
+    # Language and direction settings - CRITICAL for RTL
+    "lang": "fa",                   # Persian language
+    "dir": "rtl",                   # Right-to-left direction
+    "documentclass": "article",
+}
+PANDOC_DOCX_VARIABLES = {
+    # Font configuration using available fonts
+    "mainfont": "DejaVu Sans",      # Available font with Unicode support
+    "sansfont": "DejaVu Sans",
+    "monofont": "DejaVu Sans Mono",
+
+    # Document formatting
+    "fontsize": "12pt",
+    "linestretch": "1.5",
+    "geometry": "margin=2.54cm",    # Standard Word margins
+
+    # RTL-specific options - CRITICAL
+    "rtl": "true",
+
+    # Better list formatting
+    "indent": "true",
+
+    # Image handling
+    "graphics": "true",
+}
+# Table of contents depth (if needed)
+PANDOC_DOCX_TOC_DEPTH = 3
+# Preserve line wrapping
+PANDOC_DOCX_WRAP = "preserve"
+# Heading of the generated table of contents
+PANDOC_DOCX_TOC_TITLE = "فهرست مطالب"
+# Raw OOXML page break placed between merged documents
+PANDOC_DOCX_PAGE_BREAK = '```{=openxml}\n<w:p><w:r><w:br w:type="page"/></w:r></w:p>\n```'
+# Lua filter used when RTL_MODE is "filter"
+RTL_FILTER_PATH = Path(__file__).parent / "filters" / "rtl.lua"
+
+
+@functools.lru_cache(maxsize=1)
+def rtl_filter_version() -> str:
+    """Hash of the RTL Lua filter, part of the result cache key in filter mode"""
+    try:
+        return hashlib.sha256(RTL_FILTER_PATH.read_bytes()).hexdigest()[:16]
+    except OSError:
+        return "missing"
+
+
+def use_rtl_filter(reference_path: Optional[Path]) -> bool:
+    """
+    Whether Pandoc emits the RTL and pagination properties itself (RTL_MODE=filter).
+    The filter relies on the reference document styles, so without them the
+    conversion falls back to post-processing.
+    """
+    if RTL_MODE != "filter":
+        return False
+    if not RTL_FILTER_PATH.exists():
+        logger.warning(f"RTL Lua filter not found at '{RTL_FILTER_PATH}', using RTL post-processing")
+        return False
+    return reference_path is not None and reference_path.exists()
+
+
+def render_markdown(md_path: str, out_path: str, fmt: str, timeout: int = PANDOC_TIMEOUT, toc: bool = False):
     """
     Convert Markdown to the specified format using Pandoc.
     Currently focused on DOCX with RTL text justification and custom main font.
@@ -248,6 +501,8 @@ def render_markdown(md_path: str, out_path: str, fmt: str):
         md_path: Path to source markdown file
         out_path: Path where output should be saved
         fmt: Output format (should be "docx" based on current ALLOWED config)
+        timeout: Seconds Pandoc may run before the conversion is aborted
+        toc: Generate a table of contents at the start of the document
 
     Raises:
         ValueError: If format is not supported based on ALLOWED formats.
@@ -262,82 +517,57 @@ def render_markdown(md_path: str, out_path: str, fmt: str):
 
     logger.info(f"Attempting to convert '{md_path}' to '{fmt}', outputting to '{out_path}'")
 
+    if fmt == "docx" and NATIVE_DOCX_ENABLED and not toc:
+        with open(md_path, encoding="utf-8") as f:
+            data = _render_native_docx(f.read())
+        if data is not None:
+            with open(out_path, "wb") as f:
+                f.write(data)
+            logger.info(f"Successfully converted '{md_path}' to '{out_path}' with the native DOCX writer")
+            return out_path
+
     cmd = ["pandoc", md_path, "-o", out_path]
 
+    reference_path = None
+    rtl_filter = False
     if fmt == "docx":
-        # Create enhanced reference document
-        reference_path = create_reference_docx()
-
-        # Enhanced RTL configuration
-        cmd.extend([
-            # Language and direction settings - CRITICAL for RTL
-            "--metadata=lang:fa",           # Persian language
-            "--metadata=dir:rtl",           # Right-to-left direction
-            "--metadata=documentclass:article",
-
-            # Font configuration using available fonts
-            "--variable=mainfont:DejaVu Sans",      # Available font with Unicode support
-            "--variable=sansfont:DejaVu Sans",
-            "--variable=monofont:DejaVu Sans Mono",
-
-            # Document formatting
-            "--variable=fontsize:12pt",
-            "--variable=linestretch:1.5",
-            "--variable=geometry:margin=2.54cm",    # Standard Word margins
-
-            # RTL-specific options - CRITICAL
-            "--variable=rtl:true",
-
-            # Table of contents (if needed)
-            "--toc-depth=3",
-
-            # Better list formatting
-            "--variable=indent:true",
-
-            # Image handling
-            "--variable=graphics:true",
-        ])
-
-        # Use enhanced reference document if available
-        if reference_path and reference_path.exists():
-            cmd.append(f"--reference-doc={reference_path}")
-            logger.info(f"Using enhanced RTL reference document: {reference_path}")
-        else:
-            logger.warning("Enhanced reference document not available, using Pandoc defaults")
+        # Reuse the cached reference document (built once per style configuration)
+        reference_path = get_reference_docx()
+        rtl_filter = use_rtl_filter(reference_path)
+        cmd.extend(_docx_pandoc_args(reference_path, toc, rtl_filter))
 
-        # Additional filters for better RTL handling
-        cmd.extend([
-            "--wrap=preserve",           # Preserve line wrapping
-        ])
-
-        logger.info(f"Enhanced DOCX configuration with comprehensive RTL support.")
+    if fmt == "docx" and PANDOC_SERVER_ENABLED and pandoc_server_pool.available():
+        try:
+            with metrics.timed("conversion.pandoc"):
+                _render_with_pandoc_server(md_path, out_path, reference_path, toc)
+            logger.info(f"Successfully converted '{md_path}' to '{out_path}' with pandoc server")
+            # pandoc server does not run filters, so its output is always post-processed
+            _postprocess_docx(out_path)
+            return out_path
+        except PandocServerError as e:
+            logger.warning(f"pandoc server conversion failed, falling back to a pandoc subprocess: {e}")
+            metrics.increment("pandoc_server.fallbacks")
 
     logger.debug(f"Executing Pandoc command: \"{' '.join(cmd)}\"")
 
     try:
-        result = subprocess.run(
-            cmd,
-            check=True,
-            timeout=120,  # Increased timeout for complex RTL documents
-            capture_output=True,
-            text=True,
-            encoding='utf-8'
-        )
+        with metrics.timed("conversion.pandoc"):
+            result = subprocess.run(
+                cmd,
+                check=True,
+                timeout=timeout,
+                capture_output=True,
+                text=True,
+                encoding='utf-8'
+            )
         if result.stdout and result.stdout.strip():
             logger.debug(f"Pandoc STDOUT:\n{result.stdout.strip()}")
         if result.stderr and result.stderr.strip():
             logger.warning(f"Pandoc STDERR (may contain warnings/info):\n{result.stderr.strip()}")
         logger.info(f"Successfully converted '{md_path}' to '{out_path}'")
 
-        # Post-process DOCX to ensure all paragraphs have RTL BiDi property
-        if fmt == "docx" and os.path.exists(out_path):
-            try:
-                apply_rtl_to_docx(out_path)
-                logger.info("RTL post-processing completed successfully")
-            except Exception as e:
-                logger.error(f"Failed to apply RTL post-processing: {e}")
-                # Don't fail the entire conversion if post-processing fails
-                # The file should still be usable even without this enhancement
+        if fmt == "docx" and not rtl_filter:
+            _postprocess_docx(out_path)
 
         return out_path
     except subprocess.CalledProcessError as e:
@@ -365,6 +595,282 @@ def render_markdown(md_path: str, out_path: str, fmt: str):
             except OSError as re: logger.warning(f"Failed to remove '{out_path}' after error: {re}")
         raise
 
+def _docx_pandoc_args(reference_path: Optional[Path], toc: bool = False, rtl_filter: bool = False) -> list:
+    """Pandoc command-line options for RTL DOCX output"""
+    # Enhanced RTL configuration
+    args = [f"--metadata={key}:{value}" for key, value in PANDOC_DOCX_METADATA.items()]
+    args.extend(f"--variable={key}:{value}" for key, value in PANDOC_DOCX_VARIABLES.items())
+    if toc:
+        args.append("--toc")
+        args.append(f"--metadata=toc-title:{PANDOC_DOCX_TOC_TITLE}")
+    args.append(f"--toc-depth={PANDOC_DOCX_TOC_DEPTH}")
+
+    # Use enhanced reference document if available
+    if reference_path and reference_path.exists():
+        args.append(f"--reference-doc={reference_path}")
+        logger.info(f"Using enhanced RTL reference document: {reference_path}")
+    else:
+        logger.warning("Enhanced reference document not available, using Pandoc defaults")
+
+    # Additional filters for better RTL handling
+    args.append(f"--wrap={PANDOC_DOCX_WRAP}")
+    if rtl_filter:
+        args.append(f"--lua-filter={RTL_FILTER_PATH}")
+
+    logger.info(f"Enhanced DOCX configuration with comprehensive RTL support.")
+    return args
+
+def render_markdown_bytes(markdown_text: str, fmt: str, timeout: int = PANDOC_TIMEOUT, toc: bool = False) -> bytes:
+    """
+    In-memory variant of render_markdown: the markdown is fed to Pandoc on
+    stdin, the DOCX is read from stdout and RTL post-processing happens on the
+    buffer, so no temporary files touch the disk.
+
+    Args:
+        markdown_text: Preprocessed markdown source
+        fmt: Output format (should be "docx" based on current ALLOWED config)
+        timeout: Seconds Pandoc may run before the conversion is aborted
+        toc: Generate a table of contents at the start of the document
+
+    Returns:
+        The converted document
+
+    Raises:
+        Same exceptions as render_markdown.
+    """
+    if fmt not in ALLOWED:
+        logger.error(f"Unsupported format requested: '{fmt}'. Allowed formats are: {ALLOWED}")
+        raise ValueError(f"Unsupported format: '{fmt}'. Only formats in {list(ALLOWED)} are supported.")
+
+    logger.info(f"Attempting in-memory conversion of {len(markdown_text)} chars to '{fmt}'")
+
+    if fmt == "docx" and NATIVE_DOCX_ENABLED and not toc:
+        data = _render_native_docx(markdown_text)
+        if data is not None:
+            return data
+
+    reference_path = get_reference_docx()
+
+    if PANDOC_SERVER_ENABLED and pandoc_server_pool.available():
+        try:
+            with metrics.timed("conversion.pandoc"):
+                output = pandoc_server_pool.convert(_pandoc_server_payload(markdown_text, reference_path, toc))
+            logger.info(f"Successfully converted {len(markdown_text)} chars in memory with pandoc server")
+            # pandoc server does not run filters, so its output is always post-processed
+            return _postprocess_docx_bytes(output)
+        except PandocServerError as e:
+            logger.warning(f"pandoc server conversion failed, falling back to a pandoc subprocess: {e}")
+            metrics.increment("pandoc_server.fallbacks")
+
+    rtl_filter = use_rtl_filter(reference_path)
+    cmd = ["pandoc", "--from=markdown", f"--to={fmt}", "--output=-"]
+    cmd.extend(_docx_pandoc_args(reference_path, toc, rtl_filter))
+    logger.debug(f"Executing Pandoc command: \"{' '.join(cmd)}\"")
+
+    try:
+        with metrics.timed("conversion.pandoc"):
+            result = subprocess.run(
+                cmd,
+                input=markdown_text.encode("utf-8"),
+                check=True,
+                timeout=timeout,
+                capture_output=True,
+            )
+        stderr = result.stderr.decode("utf-8", errors="replace").strip()
+        if stderr:
+            logger.warning(f"Pandoc STDERR (may contain warnings/info):\n{stderr}")
+        logger.info(f"Successfully converted {len(markdown_text)} chars in memory ({len(result.stdout)} bytes)")
+        if rtl_filter:
+            return result.stdout
+        return _postprocess_docx_bytes(result.stdout)
+    except subprocess.CalledProcessError as e:
+        stderr = e.stderr.decode("utf-8", errors="replace").strip() if e.stderr else ""
+        logger.error(f"Pandoc command failed with exit code {e.returncode} during in-memory conversion to '{fmt}'.")
+        logger.error(f"Pandoc command executed: \"{' '.join(e.cmd)}\"")
+        logger.error(f"Pandoc STDERR (on error): {stderr or '<empty>'}")
+        raise
+    except subprocess.TimeoutExpired as e:
+        logger.error(f"Pandoc command timed out after {e.timeout}s for in-memory conversion to '{fmt}'. Cmd: \"{' '.join(e.cmd)}\"")
+        raise
+    except FileNotFoundError:
+        logger.critical(f"Pandoc executable ('{cmd[0]}') not found. Ensure Pandoc is installed and in PATH.")
+        raise
+
+def _render_native_docx(markdown_text: str) -> Optional[bytes]:
+    """
+    Render with the in-process DOCX writer, which emits the RTL and pagination
+    properties itself. Returns None when the document needs Pandoc.
+    """
+    reference_path = get_reference_docx()
+    if reference_path is None:
+        return None
+    try:
+        with metrics.timed("conversion.native"):
+            data = render_docx(markdown_text, str(reference_path))
+    except UnsupportedMarkdown as e:
+        logger.info(f"Native DOCX writer not applicable ({e}), rendering with Pandoc")
+        metrics.increment("native_docx.fallbacks")
+        return None
+    except Exception as e:
+        logger.error(f"Native DOCX writer failed, rendering with Pandoc: {e}", exc_info=True)
+        metrics.increment("native_docx.errors")
+        return None
+    metrics.increment("native_docx.rendered")
+    return data
+
+def _postprocess_docx_bytes(data: bytes) -> bytes:
+    """In-memory counterpart of _postprocess_docx; returns the input on failure"""
+    try:
+        with metrics.timed("conversion.postprocess"):
+            data = apply_rtl_to_docx_bytes(data)
+        logger.info("RTL post-processing completed successfully")
+    except Exception as e:
+        logger.error(f"Failed to apply RTL post-processing: {e}")
+        # Don't fail the entire conversion if post-processing fails
+    return data
+
+def _postprocess_docx(out_path: str):
+    """Post-process DOCX to ensure all paragraphs have RTL BiDi property"""
+    if not os.path.exists(out_path):
+        return
+    try:
+        with metrics.timed("conversion.postprocess"):
+            apply_rtl_to_docx(out_path)
+        logger.info("RTL post-processing completed successfully")
+    except Exception as e:
+        logger.error(f"Failed to apply RTL post-processing: {e}")
+        # Don't fail the entire conversion if post-processing fails
+        # The file should still be usable even without this enhancement
+
+def _pandoc_server_payload(markdown_text: str, reference_path: Optional[Path], toc: bool = False) -> dict:
+    """JSON request for the pandoc server, using the same options as the subprocess path"""
+    payload = {
+        "text": markdown_text,
+        "from": "markdown",
+        "to": "docx",
+        "standalone": True,
+        "metadata": dict(PANDOC_DOCX_METADATA),
+        "variables": dict(PANDOC_DOCX_VARIABLES),
+        "toc-depth": PANDOC_DOCX_TOC_DEPTH,
+        "wrap": PANDOC_DOCX_WRAP,
+    }
+    if toc:
+        payload["table-of-contents"] = True
+        payload["metadata"]["toc-title"] = PANDOC_DOCX_TOC_TITLE
+    if reference_path and reference_path.exists():
+        # The server is stateless, so the reference document travels with each
+        # request; it is read and base64-encoded only once per process
+        payload["reference-doc"] = reference_path.name
+        payload["files"] = {reference_path.name: pandoc_server_pool.encoded_file(str(reference_path))}
+    return payload
+
+def _render_with_pandoc_server(md_path: str, out_path: str, reference_path: Optional[Path], toc: bool = False):
+    """
+    Convert `md_path` to DOCX through the pandoc server pool.
+
+    Raises:
+        PandocServerError: If the server pool cannot perform the conversion
+    """
+    with open(md_path, encoding="utf-8") as f:
+        markdown_text = f.read()
+
+    output = pandoc_server_pool.convert(_pandoc_server_payload(markdown_text, reference_path, toc))
+    with open(out_path, "wb") as f:
+        f.write(output)
+
+def run_conversion(text: str, md_path: str, out_path: str, fmt: str, timeout: int = PANDOC_TIMEOUT,
+                   toc: bool = False) -> str:
+    """
+    Full blocking conversion job: preprocess the Farsi text, write it to
+    `md_path` and render it to `out_path`. Meant to run on the conversion pool,
+    so it must stay a picklable module-level function.
+
+    Returns:
+        The output path produced by render_markdown
+    """
+    data = convert_in_chunks(text, convert_chunk, fmt, timeout, toc) if fmt == "docx" else None
+    if data is not None:
+        write_result_file(out_path, data)
+        return out_path
+
+    with metrics.timed("conversion.preprocess"):
+        processed_text = preprocess_farsi_text(text)
+    logger.info(f"Text preprocessing completed. Original: {len(text)}, Processed: {len(processed_text)} chars")
+
+    with open(md_path, "w", encoding="utf-8") as f:
+        f.write(processed_text)
+
+    with metrics.timed("conversion.render"):
+        return render_markdown(md_path, out_path, fmt, timeout, toc)
+
+def run_conversion_in_memory(text: str, fmt: str, persist_path: Optional[str] = None,
+                             timeout: int = PANDOC_TIMEOUT, toc: bool = False) -> bytes:
+    """
+    Blocking in-memory conversion job: preprocess, convert and post-process
+    without temporary files. The result is written to `persist_path` only when
+    the caller explicitly asks for it.
+
+    Returns:
+        The converted document
+    """
+    data = convert_in_chunks(text, convert_chunk, fmt, timeout, toc) if fmt == "docx" else None
+    if data is None:
+        with metrics.timed("conversion.preprocess"):
+            processed_text = preprocess_farsi_text(text)
+        logger.info(f"Text preprocessing completed. Original: {len(text)}, Processed: {len(processed_text)} chars")
+
+        with metrics.timed("conversion.render"):
+            data = render_markdown_bytes(processed_text, fmt, timeout, toc)
+
+    if persist_path:
+        write_result_file(persist_path, data)
+    return data
+
+def convert_chunk(index: int, text: str, fmt: str, timeout: int = PANDOC_TIMEOUT, toc: bool = False) -> bytes:
+    """
+    Chunk pool job converting one piece of a large document; only the first
+    piece carries the table of contents (Word fills it in for the whole document)
+    """
+    processed_text = preprocess_farsi_text(text, memoize=False)
+    return render_markdown_bytes(processed_text, fmt, timeout, toc and index == 0)
+
+def merge_markdown_sources(sources: List[str], page_breaks: bool = True) -> str:
+    """
+    Preprocess each source on its own and join them, in order, into one
+    Markdown document, optionally starting every source on a new page
+    """
+    parts = [preprocess_farsi_text(source).strip("\n") for source in sources]
+    separator = f"\n\n{PANDOC_DOCX_PAGE_BREAK}\n\n" if page_breaks else "\n\n"
+    return separator.join(parts) + "\n"
+
+def run_merge_conversion(sources: List[str], fmt: str, toc: bool = False, page_breaks: bool = True,
+                         persist_path: Optional[str] = None, timeout: int = PANDOC_TIMEOUT) -> bytes:
+    """
+    Blocking job merging several Markdown sources into one document with a
+    single Pandoc run and a single RTL post-processing pass.
+
+    Returns:
+        The converted document
+    """
+    with metrics.timed("conversion.preprocess"):
+        merged_text = merge_markdown_sources(sources, page_breaks)
+    logger.info(f"Merged {len(sources)} sources into {len(merged_text)} chars")
+
+    with metrics.timed("conversion.render"):
+        data = render_markdown_bytes(merged_text, fmt, timeout, toc)
+
+    if persist_path:
+        write_result_file(persist_path, data)
+    return data
+
+def write_result_file(path: str, data: bytes):
+    """Atomically write a conversion result to `path`"""
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+    logger.info(f"Persisted conversion result to '{path}'")
+
 def apply_rtl_to_docx(docx_path: str):
     """
     Post-process a DOCX file to ensure all paragraphs have the RTL BiDi property
@@ -390,130 +896,21 @@ def apply_rtl_to_docx(docx_path: str):
 
     logger.info(f"Applying RTL BiDi properties and pagination controls to: {docx_path}")
 
+    # We need to read all files from the original DOCX and write them to a new one
+    temp_docx_path = docx_path + '.tmp'
     try:
-        # Define XML namespaces used in DOCX files
-        namespaces = {
-            'w': 'http://schemas.openxmlformats.org/wordprocessingml/2006/main',
-            'r': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships',
-            'wp': 'http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing'
-        }
-
-        # Register namespaces to preserve prefixes
-        for prefix, uri in namespaces.items():
-            ET.register_namespace(prefix, uri)
-
-        # Open the DOCX file as a ZIP archive
-        with zipfile.ZipFile(docx_path, 'r') as docx_zip:
-            # Read the main document XML
-            document_xml = docx_zip.read('word/document.xml')
-
-        # Parse the XML
-        tree = ET.ElementTree(ET.fromstring(document_xml))
-        root = tree.getroot()
-
-        # Counters for modifications
-        modified_paragraph_count = 0
-        modified_table_count = 0
-
-        # Find all paragraph elements (<w:p>)
-        for paragraph in root.findall('.//w:p', namespaces):
-            # Check if paragraph properties (<w:pPr>) exist
-            pPr = paragraph.find('w:pPr', namespaces)
-
-            if pPr is None:
-                # Create <w:pPr> if it doesn't exist
-                pPr = ET.Element('{' + namespaces['w'] + '}pPr')
-                # Insert at the beginning of the paragraph
-                paragraph.insert(0, pPr)
-
-            # Check if <w:bidi/> already exists
-            bidi = pPr.find('w:bidi', namespaces)
-            if bidi is None:
-                # Create and add <w:bidi/> element
-                bidi = ET.Element('{' + namespaces['w'] + '}bidi')
-                pPr.append(bidi)
-
-            # Add pagination controls to prevent splitting
-            # Check if <w:keepLines/> already exists
-            keep_lines = pPr.find('w:keepLines', namespaces)
-            if keep_lines is None:
-                # Keep all lines of paragraph together
-                keep_lines = ET.Element('{' + namespaces['w'] + '}keepLines')
-                pPr.append(keep_lines)
-
-            # Check if this is a heading or code block by examining the style
-            pStyle = pPr.find('w:pStyle', namespaces)
-            is_heading_or_code = False
-
-            if pStyle is not None:
-                style_val = pStyle.get('{' + namespaces['w'] + '}val', '')
-                # Check if it's a heading or code-related style
-                if (style_val.startswith('Heading') or
-                    'Code' in style_val or
-                    'Source' in style_val or
-                    'Verbatim' in style_val):
-                    is_heading_or_code = True
-
-            # For headings and code blocks, keep with next paragraph
-            if is_heading_or_code:
-                keep_next = pPr.find('w:keepNext', namespaces)
-                if keep_next is None:
-                    keep_next = ET.Element('{' + namespaces['w'] + '}keepNext')
-                    pPr.append(keep_next)
-
-            modified_paragraph_count += 1
-
-        # Find all table elements and prevent row splitting
-        for table in root.findall('.//w:tbl', namespaces):
-            for row in table.findall('.//w:tr', namespaces):
-                # Check if row properties (<w:trPr>) exist
-                trPr = row.find('w:trPr', namespaces)
-
-                if trPr is None:
-                    # Create <w:trPr> if it doesn't exist
-                    trPr = ET.Element('{' + namespaces['w'] + '}trPr')
-                    # Insert at the beginning of the row
-                    row.insert(0, trPr)
-
-                # Check if <w:cantSplit/> already exists
-                cant_split = trPr.find('w:cantSplit', namespaces)
-                if cant_split is None:
-                    # Prevent table row from splitting across pages
-                    cant_split = ET.Element('{' + namespaces['w'] + '}cantSplit')
-                    trPr.append(cant_split)
-                    modified_table_count += 1
-
-        logger.info(f"Added pagination controls to {modified_paragraph_count} paragraphs and {modified_table_count} table rows")
-
-        # Convert the modified XML tree back to bytes
-        modified_xml = ET.tostring(root, encoding='utf-8', xml_declaration=True)
-
-        # Create a new DOCX file with the modified document.xml
-        # We need to read all files from the original DOCX and write them to a new one
-        temp_docx_path = docx_path + '.tmp'
-
         with zipfile.ZipFile(docx_path, 'r') as docx_zip_read:
-            with zipfile.ZipFile(temp_docx_path, 'w', zipfile.ZIP_DEFLATED) as docx_zip_write:
-                # Copy all files except word/document.xml
-                for item in docx_zip_read.infolist():
-                    if item.filename != 'word/document.xml':
-                        data = docx_zip_read.read(item.filename)
-                        docx_zip_write.writestr(item, data)
-
-                # Write the modified document.xml
-                docx_zip_write.writestr('word/document.xml', modified_xml)
+            with zipfile.ZipFile(temp_docx_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=DOCX_COMPRESSION_LEVEL) as docx_zip_write:
+                _rewrite_docx(docx_zip_read, docx_zip_write)
 
         # Replace the original file with the modified one
         os.replace(temp_docx_path, docx_path)
 
         logger.info(f"Successfully applied RTL BiDi properties and pagination controls to: {docx_path}")
 
-    except FileNotFoundError:
-        raise
     except Exception as e:
         logger.error(f"Error applying RTL properties and pagination controls to DOCX: {e}", exc_info=True)
         # Clean up temp file if it exists
-        temp_docx_path = docx_path + '.tmp'
         if os.path.exists(temp_docx_path):
             try:
                 os.remove(temp_docx_path)
@@ -521,9 +918,167 @@ def apply_rtl_to_docx(docx_path: str):
                 pass
         raise
 
+def apply_rtl_to_docx_bytes(data: bytes) -> bytes:
+    """
+    In-memory variant of apply_rtl_to_docx: takes and returns DOCX bytes.
+    """
+    output = BytesIO()
+    with zipfile.ZipFile(BytesIO(data), 'r') as docx_zip_read:
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED, compresslevel=DOCX_COMPRESSION_LEVEL) as docx_zip_write:
+            _rewrite_docx(docx_zip_read, docx_zip_write)
+    return output.getvalue()
+
+def _rewrite_docx(docx_zip_read: zipfile.ZipFile, docx_zip_write: zipfile.ZipFile):
+    """Copy every member of the DOCX, replacing word/document.xml with its RTL version"""
+    # Copy all files except word/document.xml. Their compressed bytes are copied
+    # verbatim, so styles, fonts and media are never inflated and deflated again.
+    for item in docx_zip_read.infolist():
+        if item.filename != 'word/document.xml':
+            try:
+                copy_zip_member_raw(docx_zip_read, docx_zip_write, item)
+            except (ValueError, zipfile.BadZipFile) as e:
+                logger.warning(f"Raw copy of '{item.filename}' failed ({e}), recompressing it")
+                data = docx_zip_read.read(item.filename)
+                docx_zip_write.writestr(item, data)
+
+    # Write the modified document.xml
+    _stream_rtl_document_xml(docx_zip_read, docx_zip_write)
+
+def _stream_rtl_document_xml(docx_zip_read: zipfile.ZipFile, docx_zip_write: zipfile.ZipFile):
+    """
+    Rewrite word/document.xml chunk by chunk with RtlXmlRewriter, falling back
+    to the tree-based _rtl_document_xml for parts it does not support.
+    """
+    with docx_zip_read.open('word/document.xml') as src:
+        rewriter = RtlXmlRewriter()
+        head = []
+        pending = []
+        try:
+            # Validate the root element before anything is written to the new ZIP
+            while not rewriter.ready:
+                chunk = src.read(CHUNK_SIZE)
+                head.append(chunk)
+                if not chunk:
+                    pending.append(rewriter.close())
+                    break
+                pending.append(rewriter.feed(chunk))
+        except UnsupportedDocumentXml as e:
+            logger.info(f"Streaming RTL rewrite not applicable ({e}), using tree-based rewrite")
+            modified_xml = _rtl_document_xml(b"".join(head) + src.read())
+            docx_zip_write.writestr('word/document.xml', modified_xml)
+            return
+
+        with docx_zip_write.open('word/document.xml', 'w') as dst:
+            for data in pending:
+                dst.write(data)
+            if head[-1]:
+                for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                    dst.write(rewriter.feed(chunk))
+                dst.write(rewriter.close())
+
+    logger.info(f"Added pagination controls to {rewriter.paragraph_count} paragraphs and {rewriter.row_count} table rows")
+
+def _rtl_document_xml(document_xml: bytes) -> bytes:
+    """Add BiDi and pagination properties to a word/document.xml payload"""
+    # Define XML namespaces used in DOCX files
+    namespaces = {
+        'w': 'http://schemas.openxmlformats.org/wordprocessingml/2006/main',
+        'r': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships',
+        'wp': 'http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing'
+    }
+
+    # Register namespaces to preserve prefixes
+    for prefix, uri in namespaces.items():
+        ET.register_namespace(prefix, uri)
+
+    # Parse the XML
+    tree = ET.ElementTree(ET.fromstring(document_xml))
+    root = tree.getroot()
+
+    # Counters for modifications
+    modified_paragraph_count = 0
+    modified_table_count = 0
+
+    # Find all paragraph elements (<w:p>)
+    for paragraph in root.findall('.//w:p', namespaces):
+        # Check if paragraph properties (<w:pPr>) exist
+        pPr = paragraph.find('w:pPr', namespaces)
+
+        if pPr is None:
+            # Create <w:pPr> if it doesn't exist
+            pPr = ET.Element('{' + namespaces['w'] + '}pPr')
+            # Insert at the beginning of the paragraph
+            paragraph.insert(0, pPr)
+
+        # Check if <w:bidi/> already exists
+        bidi = pPr.find('w:bidi', namespaces)
+        if bidi is None:
+            # Create and add <w:bidi/> element
+            bidi = ET.Element('{' + namespaces['w'] + '}bidi')
+            pPr.append(bidi)
+
+        # Add pagination controls to prevent splitting
+        # Check if <w:keepLines/> already exists
+        keep_lines = pPr.find('w:keepLines', namespaces)
+        if keep_lines is None:
+            # Keep all lines of paragraph together
+            keep_lines = ET.Element('{' + namespaces['w'] + '}keepLines')
+            pPr.append(keep_lines)
+
+        # Check if this is a heading or code block by examining the style
+        pStyle = pPr.find('w:pStyle', namespaces)
+        is_heading_or_code = False
+
+        if pStyle is not None:
+            style_val = pStyle.get('{' + namespaces['w'] + '}val', '')
+            # Check if it's a heading or code-related style
+            if (style_val.startswith('Heading') or
+                'Code' in style_val or
+                'Source' in style_val or
+                'Verbatim' in style_val):
+                is_heading_or_code = True
+
+        # For headings and code blocks, keep with next paragraph
+        if is_heading_or_code:
+            keep_next = pPr.find('w:keepNext', namespaces)
+            if keep_next is None:
+                keep_next = ET.Element('{' + namespaces['w'] + '}keepNext')
+                pPr.append(keep_next)
+
+        modified_paragraph_count += 1
+
+    # Find all table elements and prevent row splitting
+    for table in root.findall('.//w:tbl', namespaces):
+        for row in table.findall('.//w:tr', namespaces):
+            # Check if row properties (<w:trPr>) exist
+            trPr = row.find('w:trPr', namespaces)
+
+            if trPr is None:
+                # Create <w:trPr> if it doesn't exist
+                trPr = ET.Element('{' + namespaces['w'] + '}trPr')
+                # Insert at the beginning of the row
+                row.insert(0, trPr)
+
+            # Check if <w:cantSplit/> already exists
+            cant_split = trPr.find('w:cantSplit', namespaces)
+            if cant_split is None:
+                # Prevent table row from splitting across pages
+                cant_split = ET.Element('{' + namespaces['w'] + '}cantSplit')
+                trPr.append(cant_split)
+                modified_table_count += 1
+
+    logger.info(f"Added pagination controls to {modified_paragraph_count} paragraphs and {modified_table_count} table rows")
+
+    # Convert the modified XML tree back to bytes
+    return ET.tostring(root, encoding='utf-8', xml_declaration=True)
+
 def cleanup_old_files():
     """
-    Remove temporary files older than MAX_FILE_AGE_HOURS from OUT_DIR.
+    Remove temporary files older than MAX_FILE_AGE_HOURS from OUT_DIR: whole
+    expired output shards, plus old files directly in OUT_DIR.
+
+    Returns:
+        The number of shards and files removed
     """
     if not OUT_DIR or not os.path.isdir(OUT_DIR):
         logger.warning(f"Output directory '{OUT_DIR}' is not configured or does not exist. Skipping cleanup.")
@@ -533,11 +1088,14 @@ def cleanup_old_files():
     except TypeError:
         logger.error(f"Invalid MAX_FILE_AGE_HOURS: '{MAX_FILE_AGE_HOURS}'. Must be a number. Skipping cleanup.")
         return 0
-    count = 0
+    count = drop_expired_shards(MAX_FILE_AGE_HOURS * 3600)
+    # The current reference document is long-lived; stale ones (from older style
+    # configurations) age out like any other file
+    reference_name = reference_docx_path().name
     logger.info(f"Starting cleanup of files older than {cutoff_time.strftime('%Y-%m-%d %H:%M:%S')} in '{OUT_DIR}'")
     try:
         for entry in os.scandir(OUT_DIR):
-            if entry.is_file():
+            if entry.is_file() and entry.name != reference_name:
                 try:
                     file_path = entry.path
                     mod_time_timestamp = entry.stat().st_mtime
@@ -0,0 +1,406 @@
+"""
+Merge the DOCX packages converted from consecutive pieces of one document
+(see app/chunked.py) into a single package.
+
+Every piece is rendered against the same reference document, so the first
+package is the base: its settings, theme, fonts, section properties and styles
+are kept and the bodies of the other pieces are appended in order. Whatever a
+body refers to outside of itself is renumbered so it stays unique in the
+merged package:
+
+- relationships (images, hyperlinks); media parts are copied under a new name
+- numbering instances (w:numId) and their abstract numbering definitions
+- bookmark ids, plus bookmark names that collide (and the links targeting them)
+- drawing object ids (wp:docPr / pic:cNvPr)
+
+Styles the base lacks (e.g. Pandoc's syntax highlighting styles) and missing
+namespace declarations on the root element are copied over. Footnotes and
+comments are not merged; documents using them are converted in one piece.
+
+A body and everything it refers to is extracted once into a DocxFragment, so
+callers that rebuild documents from the same pieces (incremental conversion)
+only pay for reassembly.
+"""
+
+import logging
+import posixpath
+import re
+import zipfile
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+
+from .config import DOCX_COMPRESSION_LEVEL
+from .ooxml import copy_zip_member_raw
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_PART = "word/document.xml"
+DOCUMENT_RELS_PART = "word/_rels/document.xml.rels"
+NUMBERING_PART = "word/numbering.xml"
+STYLES_PART = "word/styles.xml"
+CONTENT_TYPES_PART = "[Content_Types].xml"
+
+NUMBERING_REL_TYPE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/numbering"
+NUMBERING_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.numbering+xml"
+
+_BODY_START_RE = re.compile(r"<w:body\b[^>]*>")
+_ROOT_RE = re.compile(r"<w:document\b[^>]*>")
+_XMLNS_RE = re.compile(r'\sxmlns:([\w.-]+)="([^"]*)"')
+_RELATIONSHIP_RE = re.compile(r"<Relationship\b[^>]*/>")
+_ATTR_RE = re.compile(r'([\w:]+)="([^"]*)"')
+_REL_ID_NUMBER_RE = re.compile(r'(Id="rId)(\d+)(")')
+_REL_REF_RE = re.compile(r'(\br:(?:id|embed|link|pict|dm|lo|qs|cs)=")([^"]*)(")')
+_NUM_ID_RE = re.compile(r'(<w:numId w:val=")(\d+)(")')
+_ABSTRACT_NUM_RE = re.compile(r'<w:abstractNum\b[^>]*w:abstractNumId="(\d+)"[\s\S]*?</w:abstractNum>')
+_NUM_RE = re.compile(r'<w:num\b[^>]*w:numId="(\d+)"[^>]*>[\s\S]*?</w:num>')
+_NUM_ABSTRACT_REF_RE = re.compile(r'(<w:abstractNumId w:val=")(\d+)(")')
+_NUM_ID_ATTR_RE = re.compile(r'(w:numId=")(\d+)(")')
+_ABSTRACT_ID_ATTR_RE = re.compile(r'(w:abstractNumId=")(\d+)(")')
+_STYLE_RE = re.compile(r'<w:style\b[^>]*w:styleId="([^"]+)"[\s\S]*?</w:style>')
+# Styles used by a body, and the styles a style builds on
+_STYLE_REF_RE = re.compile(r'<w:(?:pStyle|rStyle|tblStyle|basedOn|link|next) w:val="([^"]+)"')
+_BOOKMARK_ID_RE = re.compile(r'(<w:bookmark(?:Start|End)\b[^>]*?\bw:id=")(\d+)(")')
+_BOOKMARK_NAME_RE = re.compile(r'(<w:bookmarkStart\b[^>]*?\bw:name=")([^"]*)(")')
+_ANCHOR_RE = re.compile(r'(<w:hyperlink\b[^>]*?\bw:anchor=")([^"]*)(")')
+_DRAWING_ID_RE = re.compile(r'(<(?:wp:docPr|pic:cNvPr)\b[^>]*?\bid=")(\d+)(")')
+_DEFAULT_RE = re.compile(r'<Default\b[^>]*Extension="([^"]+)"[^>]*/>', re.IGNORECASE)
+_OVERRIDE_RE = re.compile(r'<Override\b[^>]*PartName="([^"]+)"[^>]*ContentType="([^"]+)"[^>]*/>')
+
+
+class DocxMergeError(Exception):
+    """A piece cannot be merged (missing body, footnotes, ...)"""
+
+
+def _split_document(document: str) -> Tuple[str, str, str, str]:
+    """(head up to <w:body>, body content, body-level sectPr, tail from </w:body>)"""
+    start = _BODY_START_RE.search(document)
+    end = document.rfind("</w:body>")
+    if start is None or end == -1:
+        raise DocxMergeError("word/document.xml has no body")
+    body = document[start.end():end]
+    sect = body.rfind("<w:sectPr")
+    if sect != -1 and body.rstrip().endswith("</w:sectPr>"):
+        return document[:start.end()], body[:sect], body[sect:], document[end:]
+    return document[:start.end()], body, "", document[end:]
+
+
+def _relationships(rels_xml: str) -> Dict[str, Dict[str, str]]:
+    """Relationship attributes by Id"""
+    relationships = {}
+    for element in _RELATIONSHIP_RE.findall(rels_xml):
+        attrs = dict(_ATTR_RE.findall(element))
+        if "Id" in attrs:
+            relationships[attrs["Id"]] = attrs
+    return relationships
+
+
+def _max_id(pattern: re.Pattern, text: str) -> int:
+    return max((int(match.group(2)) for match in pattern.finditer(text)), default=-1)
+
+
+def _insert_before_end(xml: str, end_tag: str, content: str) -> str:
+    index = xml.rfind(end_tag)
+    return xml[:index] + content + xml[index:]
+
+
+class DocxFragment:
+    """The body of one package and the parts of the package it refers to"""
+
+    def __init__(self, body: str, namespaces: Dict[str, str], relationships: List[dict],
+                 abstracts: Dict[str, str], nums: Dict[str, str], numbering_skeleton: Optional[str],
+                 styles: Dict[str, str]):
+        self.body = body
+        self.namespaces = namespaces
+        # Id, Type, Target, TargetMode and, for package parts, the copied "media"
+        # (part name, data, compress type, content type override, Default element)
+        self.relationships = relationships
+        self.abstracts = abstracts
+        self.nums = nums
+        self.numbering_skeleton = numbering_skeleton
+        self.styles = styles
+
+    @property
+    def size(self) -> int:
+        """Approximate memory use in bytes"""
+        media = sum(len(rel["media"][1]) for rel in self.relationships if rel.get("media"))
+        text = sum(map(len, self.abstracts.values())) + sum(map(len, self.nums.values()))
+        return len(self.body) * 2 + media + text + sum(map(len, self.styles.values()))
+
+
+def extract_fragment(data: bytes) -> DocxFragment:
+    """
+    Extract the body of a DOCX package with what it refers to.
+
+    Raises:
+        DocxMergeError: If the body cannot be merged into another document
+    """
+    with zipfile.ZipFile(BytesIO(data)) as archive:
+        names = set(archive.namelist())
+        head, body, _, _ = _split_document(archive.read(DOCUMENT_PART).decode("utf-8"))
+        if "<w:footnoteReference" in body or "<w:commentReference" in body:
+            raise DocxMergeError("footnotes and comments cannot be merged")
+        root = _ROOT_RE.search(head)
+        namespaces = dict(_XMLNS_RE.findall(root.group(0))) if root else {}
+
+        relationships = []
+        all_relationships = _relationships(archive.read(DOCUMENT_RELS_PART).decode("utf-8"))
+        content_types = archive.read(CONTENT_TYPES_PART).decode("utf-8")
+        overrides = dict(_OVERRIDE_RE.findall(content_types))
+        defaults = {}
+        for element in re.findall(r"<Default\b[^>]*/>", content_types):
+            defaults[dict(_ATTR_RE.findall(element)).get("Extension", "").lower()] = element
+        for rel_id in dict.fromkeys(match.group(2) for match in _REL_REF_RE.finditer(body)):
+            attrs = all_relationships.get(rel_id)
+            if attrs is None:
+                continue
+            rel = dict(attrs)
+            target = attrs.get("Target", "")
+            if attrs.get("TargetMode") != "External":
+                part_name = target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join("word", target))
+                if part_name in names:
+                    info = archive.getinfo(part_name)
+                    extension = posixpath.splitext(part_name)[1].lstrip(".").lower()
+                    rel["media"] = (part_name, archive.read(info), info.compress_type,
+                                    overrides.get("/" + part_name), defaults.get(extension))
+            relationships.append(rel)
+
+        abstracts: Dict[str, str] = {}
+        nums: Dict[str, str] = {}
+        skeleton = None
+        referenced = [m.group(2) for m in _NUM_ID_RE.finditer(body) if m.group(2) != "0"]
+        if referenced and NUMBERING_PART in names:
+            numbering = archive.read(NUMBERING_PART).decode("utf-8")
+            all_abstracts = {match.group(1): match.group(0) for match in _ABSTRACT_NUM_RE.finditer(numbering)}
+            all_nums = {match.group(1): match.group(0) for match in _NUM_RE.finditer(numbering)}
+            for num_id in dict.fromkeys(referenced):
+                if num_id in all_nums:
+                    nums[num_id] = all_nums[num_id]
+                    abstract_ref = _NUM_ABSTRACT_REF_RE.search(all_nums[num_id])
+                    if abstract_ref is not None and abstract_ref.group(2) in all_abstracts:
+                        abstracts[abstract_ref.group(2)] = all_abstracts[abstract_ref.group(2)]
+            skeleton = _NUM_RE.sub("", _ABSTRACT_NUM_RE.sub("", numbering))
+
+        all_styles = {match.group(1): match.group(0)
+                      for match in _STYLE_RE.finditer(archive.read(STYLES_PART).decode("utf-8"))}
+    styles: Dict[str, str] = {}
+    pending = _STYLE_REF_RE.findall(body + "".join(abstracts.values()))
+    while pending:
+        style_id = pending.pop()
+        if style_id in styles or style_id not in all_styles:
+            continue
+        styles[style_id] = all_styles[style_id]
+        pending.extend(_STYLE_REF_RE.findall(all_styles[style_id]))
+
+    return DocxFragment(body, namespaces, relationships, abstracts, nums, skeleton, styles)
+
+
+class _MergedPackage:
+    """The base package and the parts that change while fragments are appended"""
+
+    def __init__(self, data: bytes):
+        self.archive = zipfile.ZipFile(BytesIO(data))
+        self.names = set(self.archive.namelist())
+        document = self.archive.read(DOCUMENT_PART).decode("utf-8")
+        self.head, body, self.sect_pr, self.tail = _split_document(document)
+        self.bodies: List[str] = [body]
+        self.rels = self.archive.read(DOCUMENT_RELS_PART).decode("utf-8")
+        self.styles = self.archive.read(STYLES_PART).decode("utf-8")
+        self.content_types = self.archive.read(CONTENT_TYPES_PART).decode("utf-8")
+        self.numbering = self.archive.read(NUMBERING_PART).decode("utf-8") if NUMBERING_PART in self.names else None
+        self.numbering_added = False
+        root = _ROOT_RE.search(self.head)
+        self.namespaces = dict(_XMLNS_RE.findall(root.group(0))) if root else {}
+        self.new_namespaces: Dict[str, str] = {}
+
+        # Additions, inserted into their parts once by build()
+        self.new_rels: List[str] = []
+        self.new_types: List[str] = []
+        self.new_abstracts: List[str] = []
+        self.new_nums: List[str] = []
+        self.new_styles: List[str] = []
+        self.media: Dict[str, Tuple[bytes, int]] = {}
+
+        self.style_ids = set(_STYLE_RE.findall(self.styles))
+        self.default_extensions = {ext.lower() for ext in _DEFAULT_RE.findall(self.content_types)}
+        self.bookmark_names = {match.group(2) for match in _BOOKMARK_NAME_RE.finditer(body)}
+        self.next_rel_id = _max_id(_REL_ID_NUMBER_RE, self.rels) + 1
+        self.next_bookmark_id = _max_id(_BOOKMARK_ID_RE, body) + 1
+        self.next_drawing_id = _max_id(_DRAWING_ID_RE, body) + 1
+        self.next_num_id = _max_id(_NUM_ID_ATTR_RE, self.numbering or "") + 1
+        self.next_abstract_id = _max_id(_ABSTRACT_ID_ATTR_RE, self.numbering or "") + 1
+
+    def append(self, fragment: DocxFragment, index: int):
+        """Append `fragment` as piece number `index` (1-based after the base)"""
+        for prefix, uri in fragment.namespaces.items():
+            if prefix not in self.namespaces:
+                self.namespaces[prefix] = self.new_namespaces[prefix] = uri
+        body = self._merge_relationships(fragment, index)
+        body = self._merge_numbering(fragment, body)
+        for style_id, style in fragment.styles.items():
+            if style_id not in self.style_ids:
+                self.style_ids.add(style_id)
+                self.new_styles.append(style)
+        body = self._renumber_bookmarks(body, index)
+        body = self._renumber_drawings(body)
+        self.bodies.append(body)
+
+    def _merge_relationships(self, fragment: DocxFragment, index: int) -> str:
+        id_map: Dict[str, str] = {}
+        for rel in fragment.relationships:
+            new_id = f"rId{self.next_rel_id}"
+            self.next_rel_id += 1
+            target = rel.get("Target", "")
+            if rel.get("media"):
+                target = self._copy_media(rel["media"], index)
+            extra = ' TargetMode="External"' if rel.get("TargetMode") == "External" else ""
+            self.new_rels.append(f'<Relationship Id="{new_id}" Type="{rel.get("Type", "")}" Target="{target}"{extra}/>')
+            id_map[rel["Id"]] = new_id
+        if not id_map:
+            return fragment.body
+        return _REL_REF_RE.sub(lambda m: m.group(1) + id_map.get(m.group(2), m.group(2)) + m.group(3), fragment.body)
+
+    def _copy_media(self, media: tuple, index: int) -> str:
+        """Add a part referenced from a body under a new name; returns the new target"""
+        part_name, data, compress_type, content_type, default = media
+        directory, name = posixpath.split(part_name)
+        new_name = posixpath.join(directory, f"chunk{index}-{name}")
+        while new_name in self.names:
+            new_name = posixpath.join(directory, f"chunk{index}-{len(self.names)}-{name}")
+        self.names.add(new_name)
+        self.media[new_name] = (data, compress_type)
+
+        if content_type:
+            self.new_types.append(f'<Override PartName="/{new_name}" ContentType="{content_type}"/>')
+        else:
+            extension = posixpath.splitext(name)[1].lstrip(".").lower()
+            if default and extension not in self.default_extensions:
+                self.default_extensions.add(extension)
+                self.new_types.append(default)
+        return posixpath.relpath(new_name, "word")
+
+    def _merge_numbering(self, fragment: DocxFragment, body: str) -> str:
+        if not fragment.nums:
+            return body
+        if self.numbering is None:
+            # Adopt the piece's numbering part without its definitions
+            self.numbering = fragment.numbering_skeleton
+            self.numbering_added = True
+
+        abstract_map: Dict[str, str] = {}
+        for old_abstract, abstract in fragment.abstracts.items():
+            abstract_map[old_abstract] = str(self.next_abstract_id)
+            self.next_abstract_id += 1
+            self.new_abstracts.append(_ABSTRACT_ID_ATTR_RE.sub(rf'\g<1>{abstract_map[old_abstract]}\g<3>', abstract, count=1))
+        num_map: Dict[str, str] = {}
+        for num_id, num in fragment.nums.items():
+            abstract_ref = _NUM_ABSTRACT_REF_RE.search(num)
+            if abstract_ref is not None and abstract_ref.group(2) in abstract_map:
+                num = _NUM_ABSTRACT_REF_RE.sub(rf'\g<1>{abstract_map[abstract_ref.group(2)]}\g<3>', num, count=1)
+            num_map[num_id] = str(self.next_num_id)
+            self.next_num_id += 1
+            self.new_nums.append(_NUM_ID_ATTR_RE.sub(rf'\g<1>{num_map[num_id]}\g<3>', num, count=1))
+        return _NUM_ID_RE.sub(lambda m: m.group(1) + num_map.get(m.group(2), m.group(2)) + m.group(3), body)
+
+    def _numbering_part(self) -> str:
+        numbering = self.numbering
+        # Schema order: every w:abstractNum before the first w:num, w:num before w:numIdMacAtCleanup
+        first_num = re.search(r"<w:num\b", numbering)
+        position = first_num.start() if first_num else self._num_insert_position(numbering)
+        numbering = numbering[:position] + "".join(self.new_abstracts) + numbering[position:]
+        position = self._num_insert_position(numbering)
+        return numbering[:position] + "".join(self.new_nums) + numbering[position:]
+
+    @staticmethod
+    def _num_insert_position(numbering: str) -> int:
+        """After the last w:num (before w:numIdMacAtCleanup), else before </w:numbering>"""
+        last = numbering.rfind("</w:num>")
+        if last != -1:
+            return last + len("</w:num>")
+        cleanup = numbering.find("<w:numIdMacAtCleanup")
+        return cleanup if cleanup != -1 else numbering.rfind("</w:numbering>")
+
+    def _renumber_bookmarks(self, body: str, index: int) -> str:
+        if "<w:bookmark" not in body:
+            return body
+        offset = self.next_bookmark_id
+        body = _BOOKMARK_ID_RE.sub(lambda m: m.group(1) + str(int(m.group(2)) + offset) + m.group(3), body)
+        self.next_bookmark_id = max(self.next_bookmark_id, _max_id(_BOOKMARK_ID_RE, body) + 1)
+
+        renamed: Dict[str, str] = {}
+        for match in _BOOKMARK_NAME_RE.finditer(body):
+            name = match.group(2)
+            if name in self.bookmark_names and name not in renamed:
+                renamed[name] = f"{name}-{index}"
+        self.bookmark_names.update(renamed.get(m.group(2), m.group(2)) for m in _BOOKMARK_NAME_RE.finditer(body))
+        if renamed:
+            def rename(match):
+                return match.group(1) + renamed.get(match.group(2), match.group(2)) + match.group(3)
+            body = _BOOKMARK_NAME_RE.sub(rename, body)
+            body = _ANCHOR_RE.sub(rename, body)
+        return body
+
+    def _renumber_drawings(self, body: str) -> str:
+        if "docPr" not in body and "cNvPr" not in body:
+            return body
+        offset = self.next_drawing_id
+        body = _DRAWING_ID_RE.sub(lambda m: m.group(1) + str(int(m.group(2)) + offset) + m.group(3), body)
+        self.next_drawing_id = max(self.next_drawing_id, _max_id(_DRAWING_ID_RE, body) + 1)
+        return body
+
+    def build(self) -> bytes:
+        head = self.head
+        if self.new_namespaces:
+            root = _ROOT_RE.search(head)
+            declarations = "".join(f' xmlns:{prefix}="{uri}"' for prefix, uri in self.new_namespaces.items())
+            head = head[:root.end() - 1] + declarations + head[root.end() - 1:]
+        document = head + "".join(self.bodies) + self.sect_pr + self.tail
+
+        new_rels = list(self.new_rels)
+        new_types = list(self.new_types)
+        if self.numbering_added:
+            new_rels.append(f'<Relationship Id="rId{self.next_rel_id}" Type="{NUMBERING_REL_TYPE}" Target="numbering.xml"/>')
+            new_types.append(f'<Override PartName="/{NUMBERING_PART}" ContentType="{NUMBERING_CONTENT_TYPE}"/>')
+        replaced = {
+            DOCUMENT_PART: document,
+            DOCUMENT_RELS_PART: _insert_before_end(self.rels, "</Relationships>", "".join(new_rels)),
+            STYLES_PART: _insert_before_end(self.styles, "</w:styles>", "".join(self.new_styles)),
+            CONTENT_TYPES_PART: _insert_before_end(self.content_types, "</Types>", "".join(new_types)),
+        }
+        if self.numbering is not None:
+            replaced[NUMBERING_PART] = self._numbering_part()
+
+        output = BytesIO()
+        with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED, compresslevel=DOCX_COMPRESSION_LEVEL) as dst:
+            for info in self.archive.infolist():
+                if info.filename in replaced:
+                    dst.writestr(info.filename, replaced.pop(info.filename))
+                else:
+                    copy_zip_member_raw(self.archive, dst, info)
+            for name, content in replaced.items():
+                dst.writestr(name, content)
+            for name, (content, compress_type) in self.media.items():
+                dst.writestr(name, content, compress_type=compress_type)
+        self.archive.close()
+        return output.getvalue()
+
+
+def merge_fragments(base: bytes, fragments: List[DocxFragment]) -> bytes:
+    """The package `base` with the bodies of `fragments` appended, in order"""
+    if not fragments:
+        return base
+    package = _MergedPackage(base)
+    for index, fragment in enumerate(fragments, 1):
+        package.append(fragment, index)
+    return package.build()
+
+
+def merge_docx(parts: List[bytes]) -> bytes:
+    """
+    Concatenate the documents in `parts` into one DOCX, in order.
+
+    Raises:
+        DocxMergeError: If a part cannot be merged
+    """
+    data = merge_fragments(parts[0], [extract_fragment(part) for part in parts[1:]])
+    logger.info(f"Merged {len(parts)} DOCX parts")
+    return data
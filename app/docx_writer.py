@@ -0,0 +1,497 @@
+"""
+Native DOCX writer for the Markdown subset most documents use: ATX headings,
+paragraphs, bullet and numbered lists (up to three levels), **bold** and
+*italic*, the <span dir="ltr"> runs added by preprocessing, and pipe tables.
+
+word/document.xml is generated directly against the cached reference document,
+with w:bidi, keepLines/keepNext and cantSplit emitted as it is written, so
+neither a Pandoc process nor the RTL post-processing pass is needed. The other
+parts of the reference document are copied without recompression. Anything
+outside the subset raises UnsupportedMarkdown, and the caller renders the
+document with Pandoc instead.
+"""
+
+import functools
+import logging
+import re
+import zipfile
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+from .config import DOCX_COMPRESSION_LEVEL
+from .ooxml import copy_zip_member_raw
+
+logger = logging.getLogger(__name__)
+
+# Bump when the generated documents change; part of the result cache key
+NATIVE_DOCX_VERSION = 1
+
+DOCUMENT_PART = "word/document.xml"
+NUMBERING_PART = "word/numbering.xml"
+PACKAGE_RELS_PART = "_rels/.rels"
+# Preview image of the reference document's sample content
+THUMBNAIL_PART = "docProps/thumbnail.jpeg"
+
+# Deepest list level, and the reference styles used per level
+MAX_LIST_LEVEL = 2
+BULLET_STYLES = ("ListBullet", "ListBullet2", "ListBullet3")
+NUMBER_STYLES = ("ListNumber", "ListNumber2", "ListNumber3")
+TABLE_STYLE = "TableGrid"
+# First w:numId of the numbering instances added for numbered lists
+FIRST_NUM_ID = 1001
+
+_INVALID_XML_CHARS_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f￾￿]")
+_FRONT_MATTER_KEY_RE = re.compile(r"^(lang|dir)\s*:")
+_HEADING_RE = re.compile(r"^(#{1,6})[ \t]+(.*?)(?:[ \t]+#+)?[ \t]*$")
+_LIST_ITEM_RE = re.compile(r"^( {0,12})(?:([-*+])|(\d{1,9})([.)]))( +)(\S.*)$")
+_DELIMITER_ROW_RE = re.compile(r"^\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?\s*$")
+# Block syntax outside the subset: code, quotes, raw HTML, rules, setext
+# underlines, footnotes, images, definition lists, captions, math, title
+# blocks, fancy/example lists and line blocks
+_UNSUPPORTED_BLOCK_RE = re.compile(
+    r"""^(```|~~~|>|<(?!span\ dir="ltr">)|([-*_])(\s*\2){2,}\s*$|=+\s*$|\[\^|!\[|:|Table:|\$\$|%|\\"""
+    r"""|[-*+]\s*$|\d+[.)]\s*$|[a-zA-Z][.)]\s|[ivxlcdmIVXLCDM]+[.)]\s|\(\w+\)\s|\(@|\#\.\s)"""
+)
+_LOOKS_LIKE_BLOCK_RE = re.compile(r"^(#|[-*+]\s|\d+[.)]\s|\|)")
+# Inline syntax outside the subset: code, links, images, footnotes, escapes,
+# math, super/subscript, strikeout, underscore emphasis, smart quotes and entities
+_UNSUPPORTED_INLINE_RE = re.compile(r"""[`\[\]\\$^~_"']|<(?!/?span\b)|&(#\d+|#x[0-9a-fA-F]+|\w+);""")
+_INLINE_TOKEN_RE = re.compile(r'<span dir="ltr">|</span>|\*+')
+_SPAN_TAG_RE = re.compile(r'<span dir="ltr">|</span>')
+_SPAN_OPEN = '<span dir="ltr">'
+_SPAN_CLOSE = "</span>"
+_SPACES_RE = re.compile(r"[ \t]+")
+
+_STYLE_ID_RE = re.compile(r'w:styleId="([^"]+)"')
+_SECT_PR_RE = re.compile(r"<w:sectPr[\s>][\s\S]*?</w:sectPr>(?=\s*</w:body>)")
+_THUMBNAIL_REL_RE = re.compile(r'<Relationship [^>]*Target="/?docProps/thumbnail\.jpeg"[^>]*/>')
+
+
+class UnsupportedMarkdown(Exception):
+    """The document uses Markdown the native writer does not render"""
+
+
+def _style_num_id(styles_xml: str, style_id: str) -> Optional[str]:
+    match = re.search(rf'<w:style [^>]*w:styleId="{style_id}"[\s\S]*?</w:style>', styles_xml)
+    if match is None:
+        return None
+    num = re.search(r'<w:numId w:val="(\d+)"', match.group(0))
+    return num.group(1) if num else None
+
+
+class DocxTemplate:
+    """The parts of the reference document every native conversion reuses"""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        with zipfile.ZipFile(BytesIO(data)) as archive:
+            names = set(archive.namelist())
+            document = archive.read(DOCUMENT_PART).decode("utf-8")
+            styles = archive.read("word/styles.xml").decode("utf-8")
+            self.numbering = archive.read(NUMBERING_PART).decode("utf-8") if NUMBERING_PART in names else None
+            self.package_rels = archive.read(PACKAGE_RELS_PART).decode("utf-8")
+
+        body = document.index("<w:body>") + len("<w:body>")
+        self.document_head = document[:body]
+        sect_pr = _SECT_PR_RE.search(document)
+        self.sect_pr = sect_pr.group(0) if sect_pr else ""
+        self.text_width = self._text_width(self.sect_pr)
+        self.style_ids = set(_STYLE_ID_RE.findall(styles))
+        self.package_rels = _THUMBNAIL_REL_RE.sub("", self.package_rels)
+
+        # Numbered lists get their own numbering instance (so each restarts at
+        # its first number), based on the abstract numbering of the level's style
+        self.number_abstracts: Dict[int, str] = {}
+        if self.numbering is not None:
+            for level, style_id in enumerate(NUMBER_STYLES):
+                num_id = _style_num_id(styles, style_id)
+                abstract = num_id and re.search(
+                    rf'<w:num w:numId="{num_id}"><w:abstractNumId w:val="(\d+)"/>', self.numbering
+                )
+                if abstract:
+                    self.number_abstracts[level] = abstract.group(1)
+
+    @staticmethod
+    def _text_width(sect_pr: str) -> int:
+        """Width between the page margins in twips"""
+        size = re.search(r'<w:pgSz [^>]*w:w="(\d+)"', sect_pr)
+        left = re.search(r'<w:pgMar [^>]*w:left="(\d+)"', sect_pr)
+        right = re.search(r'<w:pgMar [^>]*w:right="(\d+)"', sect_pr)
+        if size and left and right:
+            return int(size.group(1)) - int(left.group(1)) - int(right.group(1))
+        return 9000
+
+    def require_style(self, style_id: str):
+        if style_id not in self.style_ids:
+            raise UnsupportedMarkdown(f"reference document has no '{style_id}' style")
+
+    def build(self, body_xml: str, numbering_instances: List[Tuple[int, str, int]]) -> bytes:
+        """The DOCX package with `body_xml` as the document body"""
+        document = f"{self.document_head}{body_xml}{self.sect_pr}</w:body></w:document>"
+        numbering = None
+        if numbering_instances:
+            nums = "".join(
+                f'<w:num w:numId="{num_id}"><w:abstractNumId w:val="{abstract}"/>'
+                f'<w:lvlOverride w:ilvl="0"><w:startOverride w:val="{start}"/></w:lvlOverride></w:num>'
+                for num_id, abstract, start in numbering_instances
+            )
+            numbering = self.numbering.replace("</w:numbering>", nums + "</w:numbering>")
+
+        output = BytesIO()
+        with zipfile.ZipFile(BytesIO(self.data)) as src, \
+                zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED, compresslevel=DOCX_COMPRESSION_LEVEL) as dst:
+            # Same member order as the reference document, replacing the generated parts
+            for info in src.infolist():
+                if info.filename == THUMBNAIL_PART:
+                    continue
+                if info.filename == DOCUMENT_PART:
+                    dst.writestr(DOCUMENT_PART, document)
+                elif info.filename == PACKAGE_RELS_PART:
+                    dst.writestr(PACKAGE_RELS_PART, self.package_rels)
+                elif info.filename == NUMBERING_PART and numbering is not None:
+                    dst.writestr(NUMBERING_PART, numbering)
+                else:
+                    copy_zip_member_raw(src, dst, info)
+        return output.getvalue()
+
+
+@functools.lru_cache(maxsize=4)
+def load_template(reference_path: str) -> DocxTemplate:
+    """Template for a reference document; its path changes with its content"""
+    with open(reference_path, "rb") as f:
+        return DocxTemplate(f.read())
+
+
+class _BodyWriter:
+    """Parses the Markdown subset line by line and writes the body XML"""
+
+    def __init__(self, template: DocxTemplate):
+        self.template = template
+        self.parts: List[str] = []
+        self.numbering_instances: List[Tuple[int, str, int]] = []
+        self.paragraph_count = 0
+        self.row_count = 0
+
+    def write(self, text: str) -> str:
+        if _INVALID_XML_CHARS_RE.search(text):
+            raise UnsupportedMarkdown("control characters")
+        lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+        i = self._skip_front_matter(lines)
+        while i < len(lines):
+            line = lines[i]
+            if not line.strip():
+                i += 1
+                continue
+            if line.startswith("\t") or len(line) - len(line.lstrip(" ")) >= 4:
+                raise UnsupportedMarkdown("indented code block")
+            stripped = line.strip()
+            heading = _HEADING_RE.match(stripped)
+            if heading:
+                self._heading(len(heading.group(1)), heading.group(2))
+                i += 1
+            elif stripped.startswith("#"):
+                raise UnsupportedMarkdown("heading without a space")
+            elif _LIST_ITEM_RE.match(line):
+                i = self._list(lines, i)
+            elif stripped.startswith("|"):
+                i = self._table(lines, i)
+            elif _UNSUPPORTED_BLOCK_RE.match(stripped):
+                raise UnsupportedMarkdown(f"block starting with '{stripped[:8]}'")
+            else:
+                i = self._paragraph(lines, i)
+        return "".join(self.parts)
+
+    @staticmethod
+    def _skip_front_matter(lines: List[str]) -> int:
+        """Index after the YAML front matter; only the lang/dir keys added by preprocessing are accepted"""
+        if not lines or lines[0].strip() != "---":
+            return 0
+        for i in range(1, len(lines)):
+            if lines[i].strip() in ("---", "..."):
+                return i + 1
+            if lines[i].strip() and not _FRONT_MATTER_KEY_RE.match(lines[i]):
+                raise UnsupportedMarkdown("front matter with document metadata")
+        raise UnsupportedMarkdown("unterminated front matter")
+
+    @staticmethod
+    def _expect_blank(lines: List[str], i: int):
+        if i < len(lines) and lines[i].strip():
+            raise UnsupportedMarkdown("block followed by text without a blank line")
+
+    # Blocks
+
+    def _heading(self, level: int, text: str):
+        if text.endswith("}"):
+            raise UnsupportedMarkdown("heading attributes")
+        style = f"Heading{level}"
+        self.template.require_style(style)
+        self._emit_paragraph(self._runs(_SPACES_RE.sub(" ", text)), style=style, keep_next=True)
+
+    def _paragraph(self, lines: List[str], i: int) -> int:
+        block = [lines[i]]
+        i += 1
+        while i < len(lines) and lines[i].strip():
+            stripped = lines[i].strip()
+            # Lines that would start a block after a blank line are plain text here
+            if _LOOKS_LIKE_BLOCK_RE.match(stripped) or _UNSUPPORTED_BLOCK_RE.match(stripped) \
+                    or _DELIMITER_ROW_RE.match(stripped) or re.match(r"^-+\s*$", stripped):
+                raise UnsupportedMarkdown("block syntax inside a paragraph")
+            block.append(lines[i])
+            i += 1
+        self._emit_paragraph(self._runs(self._join_lines(block)))
+        return i
+
+    @staticmethod
+    def _join_lines(lines: List[str]) -> str:
+        """Paragraph text with soft breaks as spaces and hard breaks (two trailing spaces) as newlines"""
+        parts = []
+        for index, line in enumerate(lines):
+            hard_break = line.endswith("  ") and index < len(lines) - 1
+            parts.append(_SPACES_RE.sub(" ", line.strip()))
+            if index < len(lines) - 1:
+                parts.append("\n" if hard_break else " ")
+        return "".join(parts)
+
+    def _list(self, lines: List[str], i: int) -> int:
+        # (marker indent, content column) of the open levels
+        levels: List[Tuple[int, int]] = []
+        # level, ordered, start number, text lines
+        items: List[Tuple[int, bool, int, List[str]]] = []
+        while i < len(lines):
+            line = lines[i]
+            if not line.strip():
+                j = i
+                while j < len(lines) and not lines[j].strip():
+                    j += 1
+                if j < len(lines) and _LIST_ITEM_RE.match(lines[j]):
+                    i = j
+                    continue
+                if j < len(lines) and lines[j].startswith((" ", "\t")):
+                    raise UnsupportedMarkdown("list item with several paragraphs")
+                break
+            item = _LIST_ITEM_RE.match(line)
+            if item is None:
+                if _LOOKS_LIKE_BLOCK_RE.match(line.strip()) or _UNSUPPORTED_BLOCK_RE.match(line.strip()):
+                    raise UnsupportedMarkdown("block syntax inside a list item")
+                # Lazy continuation of the previous item
+                items[-1][3].append(line)
+                i += 1
+                continue
+            indent = len(item.group(1))
+            marker = item.group(2) or item.group(3) + item.group(4)
+            content = indent + len(marker) + min(len(item.group(5)), 4)
+            level = self._list_level(levels, indent, content)
+            ordered = item.group(3) is not None
+            items.append((level, ordered, int(item.group(3)) if ordered else 1, [item.group(6)]))
+            i += 1
+
+        current: Dict[int, int] = {}
+        previous: Dict[int, bool] = {}
+        for level, ordered, start, text_lines in items:
+            # Deeper lists end with their parent item
+            for deeper in [key for key in previous if key > level]:
+                previous.pop(deeper)
+                current.pop(deeper, None)
+            if ordered:
+                if previous.get(level) is not True or level not in current:
+                    current[level] = self._new_numbering(level, start)
+                style = NUMBER_STYLES[level]
+                num_id = current[level]
+            else:
+                current.pop(level, None)
+                style = BULLET_STYLES[level]
+                num_id = None
+            previous[level] = ordered
+            self.template.require_style(style)
+            self._emit_paragraph(self._runs(self._join_lines(text_lines)), style=style, num_id=num_id)
+        return i
+
+    @staticmethod
+    def _list_level(levels: List[Tuple[int, int]], indent: int, content: int) -> int:
+        if not levels:
+            levels.append((indent, content))
+        elif indent == levels[-1][0]:
+            levels[-1] = (indent, content)
+        elif indent >= levels[-1][1]:
+            levels.append((indent, content))
+        elif indent > levels[-1][0]:
+            # Not indented up to the item's content: a sibling, as in Pandoc
+            pass
+        else:
+            while levels and indent < levels[-1][0]:
+                levels.pop()
+            if not levels or indent != levels[-1][0]:
+                raise UnsupportedMarkdown("ambiguous list indentation")
+            levels[-1] = (indent, content)
+        if len(levels) - 1 > MAX_LIST_LEVEL:
+            raise UnsupportedMarkdown("list nested too deeply")
+        return len(levels) - 1
+
+    def _new_numbering(self, level: int, start: int) -> int:
+        abstract = self.template.number_abstracts.get(level)
+        if abstract is None:
+            raise UnsupportedMarkdown("reference document has no numbering for numbered lists")
+        num_id = FIRST_NUM_ID + len(self.numbering_instances)
+        self.numbering_instances.append((num_id, abstract, start))
+        return num_id
+
+    @staticmethod
+    def _cells(row: str) -> List[str]:
+        row = row.strip()[1:]
+        if row.endswith("|"):
+            row = row[:-1]
+        return [cell.strip() for cell in row.split("|")]
+
+    def _table(self, lines: List[str], i: int) -> int:
+        rows = []
+        while i < len(lines) and lines[i].strip().startswith("|"):
+            rows.append(lines[i])
+            i += 1
+        self._expect_blank(lines, i)
+        if len(rows) < 2 or not _DELIMITER_ROW_RE.match(rows[1].strip()):
+            raise UnsupportedMarkdown("table without a header row")
+        header = self._cells(rows[0])
+        alignments = []
+        for cell in self._cells(rows[1]):
+            if cell.startswith(":") and cell.endswith(":"):
+                alignments.append("center")
+            elif cell.startswith(":"):
+                alignments.append("left")
+            elif cell.endswith(":"):
+                alignments.append("right")
+            else:
+                alignments.append(None)
+        columns = len(header)
+        if len(alignments) != columns:
+            raise UnsupportedMarkdown("table delimiter row does not match the header")
+        self.template.require_style(TABLE_STYLE)
+
+        width = self.template.text_width // columns
+        parts = [
+            f'<w:tbl><w:tblPr><w:tblStyle w:val="{TABLE_STYLE}"/><w:tblW w:w="0" w:type="auto"/>'
+            '<w:tblLook w:val="0020" w:firstRow="1" w:lastRow="0" w:firstColumn="0" w:lastColumn="0"'
+            ' w:noHBand="0" w:noVBand="0"/></w:tblPr><w:tblGrid>',
+            f'<w:gridCol w:w="{width}"/>' * columns,
+            "</w:tblGrid>",
+        ]
+        for index, row in enumerate([rows[0]] + rows[2:]):
+            cells = header if index == 0 else self._cells(row)
+            if len(cells) > columns:
+                raise UnsupportedMarkdown("table row with more cells than the header")
+            cells = cells + [""] * (columns - len(cells))
+            # Rows never split across pages; the header repeats on every page
+            parts.append("<w:tr><w:trPr><w:cantSplit/>" + ("<w:tblHeader/>" if index == 0 else "") + "</w:trPr>")
+            for cell, alignment in zip(cells, alignments):
+                parts.append(f'<w:tc><w:tcPr><w:tcW w:w="{width}" w:type="dxa"/></w:tcPr>')
+                parts.append(self._paragraph_xml(self._runs(_SPACES_RE.sub(" ", cell)), jc=alignment))
+                parts.append("</w:tc>")
+            parts.append("</w:tr>")
+            self.row_count += 1
+        parts.append("</w:tbl>")
+        self.parts.append("".join(parts))
+        return i
+
+    # Paragraphs and runs
+
+    def _paragraph_xml(self, runs: str, style: Optional[str] = None, num_id: Optional[int] = None,
+                       keep_next: bool = False, jc: Optional[str] = None) -> str:
+        # Children in schema order: pStyle, keepNext, keepLines, numPr, bidi, jc
+        properties = [f'<w:pStyle w:val="{style}"/>' if style else ""]
+        if keep_next:
+            properties.append("<w:keepNext/>")
+        properties.append("<w:keepLines/>")
+        if num_id is not None:
+            properties.append(f'<w:numPr><w:ilvl w:val="0"/><w:numId w:val="{num_id}"/></w:numPr>')
+        properties.append("<w:bidi/>")
+        if jc:
+            properties.append(f'<w:jc w:val="{jc}"/>')
+        self.paragraph_count += 1
+        return f'<w:p><w:pPr>{"".join(properties)}</w:pPr>{runs}</w:p>'
+
+    def _emit_paragraph(self, runs: str, **properties):
+        self.parts.append(self._paragraph_xml(runs, **properties))
+
+    def _runs(self, text: str) -> str:
+        """Runs for inline Markdown: emphasis markers and LTR spans, everything else literal"""
+        if _UNSUPPORTED_INLINE_RE.search(_SPAN_TAG_RE.sub("", text)):
+            raise UnsupportedMarkdown("inline syntax")
+        # Pandoc's smart punctuation
+        text = text.replace("...", "…").replace("---", "—").replace("--", "–")
+
+        runs: List[str] = []
+        stack: List[str] = []
+        ltr_depth: Optional[int] = None
+        position = 0
+        for token in _INLINE_TOKEN_RE.finditer(text):
+            self._text_runs(runs, text[position:token.start()], stack, ltr_depth is not None)
+            position = token.end()
+            marker = token.group(0)
+            if marker == _SPAN_OPEN:
+                if ltr_depth is not None:
+                    raise UnsupportedMarkdown("nested spans")
+                ltr_depth = len(stack)
+                continue
+            if marker == _SPAN_CLOSE:
+                if ltr_depth != len(stack):
+                    raise UnsupportedMarkdown("span and emphasis overlap")
+                ltr_depth = None
+                continue
+            before = text[token.start() - 1] if token.start() > 0 else " "
+            after = text[token.end()] if token.end() < len(text) else " "
+            can_open, can_close = not after.isspace(), not before.isspace()
+            if len(marker) == 3:
+                if can_close and len(stack) >= 2 and set(stack[-2:]) == {"*", "**"}:
+                    del stack[-2:]
+                elif can_open:
+                    stack.extend(("**", "*"))
+                else:
+                    raise UnsupportedMarkdown("unmatched emphasis")
+            elif len(marker) <= 2:
+                if can_close and stack and stack[-1] == marker:
+                    stack.pop()
+                elif can_open and marker not in stack:
+                    stack.append(marker)
+                else:
+                    raise UnsupportedMarkdown("unmatched emphasis")
+            else:
+                raise UnsupportedMarkdown("emphasis run")
+            if ltr_depth is not None and len(stack) < ltr_depth:
+                raise UnsupportedMarkdown("span and emphasis overlap")
+        self._text_runs(runs, text[position:], stack, ltr_depth is not None)
+        if stack or ltr_depth is not None:
+            raise UnsupportedMarkdown("unclosed emphasis or span")
+        return "".join(runs)
+
+    @staticmethod
+    def _text_runs(runs: List[str], text: str, stack: List[str], ltr: bool):
+        if not text:
+            return
+        properties = ""
+        if "**" in stack:
+            properties += "<w:b/><w:bCs/>"
+        if "*" in stack:
+            properties += "<w:i/><w:iCs/>"
+        if not ltr:
+            properties += "<w:rtl/>"
+        run_properties = f"<w:rPr>{properties}</w:rPr>" if properties else ""
+        for index, line in enumerate(text.split("\n")):
+            if index:
+                runs.append("<w:r><w:br/></w:r>")
+            if line:
+                runs.append(f'<w:r>{run_properties}<w:t xml:space="preserve">{escape(line)}</w:t></w:r>')
+
+
+def render_docx(markdown_text: str, reference_path: str) -> bytes:
+    """
+    Render preprocessed Markdown to DOCX bytes based on the reference document.
+
+    Raises:
+        UnsupportedMarkdown: If the document uses Markdown outside the subset
+    """
+    template = load_template(str(reference_path))
+    writer = _BodyWriter(template)
+    body = writer.write(markdown_text)
+    data = template.build(body, writer.numbering_instances)
+    logger.info(f"Native DOCX writer produced {writer.paragraph_count} paragraphs and {writer.row_count} table rows")
+    return data
@@ -0,0 +1,47 @@
+"""
+Periodic cleanup of OUT_DIR.
+
+Conversion files expire with their hour shard (see storage.drop_expired_shards),
+so the sweeper only has to run the cleanup callables now and then; it never
+scans or indexes individual files.
+"""
+
+import asyncio
+import logging
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Sweeper:
+    """One background task per process running the cleanup callables periodically"""
+
+    def __init__(self, interval_seconds: float, tasks: List[Callable[[], object]]):
+        self.interval_seconds = interval_seconds
+        self.tasks = tasks
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.interval_seconds > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            await asyncio.to_thread(self.run_once)
+
+    def run_once(self):
+        for task in self.tasks:
+            try:
+                task()
+            except Exception as e:
+                logger.error(f"Error during scheduled cleanup: {e}", exc_info=True)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
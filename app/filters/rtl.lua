@@ -0,0 +1,16 @@
+--[[
+RTL filter for DOCX output (RTL_MODE=filter).
+
+Wraps the document body in a Div with dir="rtl": Pandoc's DOCX writer then
+emits <w:bidi/> on every paragraph it writes (including list items and table
+cells) and marks the runs right-to-left, while the <span dir="ltr"> runs added
+by preprocessing switch back to left-to-right. Pagination comes from the
+reference document styles built by create_reference_docx (app/converter.py):
+keepLines on Normal and the paragraph styles based on it, keepNext on headings
+and Source Code, and cantSplit on the rows of the Table style.
+]]
+
+function Pandoc(doc)
+  local body = pandoc.Div(doc.blocks, pandoc.Attr("", {}, {{"dir", "rtl"}}))
+  return pandoc.Pandoc({body}, doc.meta)
+end
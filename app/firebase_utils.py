@@ -1,8 +1,14 @@
 import firebase_admin
 from firebase_admin import credentials
+import asyncio
+import json
 import logging
+import os
+import threading
 import httpx
 import uuid
+from typing import List, Optional
+from . import metrics
 from .config import settings
 
 logger = logging.getLogger(__name__)
@@ -34,10 +40,210 @@ def initialize_firebase():
     except Exception as e:
         logger.error(f"Failed to initialize Firebase Admin SDK: {e}", exc_info=True)
 
+class AnalyticsQueue:
+    """
+    Bounded in-process queue of analytics events, drained by a background task
+    that sends them to the Measurement Protocol in batches. Events that don't fit
+    are spilled to a JSON-lines file (or dropped when spilling is disabled or the
+    file is full) and re-queued once the queue has drained.
+    """
+
+    def __init__(self, maxsize: int, batch_size: int, flush_interval: float, spill_path: str, spill_max_bytes: int):
+        self.maxsize = max(1, maxsize)
+        # The Measurement Protocol accepts at most 25 events per request
+        self.batch_size = max(1, min(batch_size, 25))
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self.spill_max_bytes = spill_max_bytes
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._pending: List[dict] = []
+        self._spill_lock = threading.Lock()
+
+    def _get_queue(self) -> asyncio.Queue:
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.maxsize)
+        return self._queue
+
+    def put(self, event: dict):
+        """Queue an event without waiting; never raises"""
+        try:
+            self._get_queue().put_nowait(event)
+            metrics.increment("analytics.enqueued")
+        except asyncio.QueueFull:
+            self._overflow([event])
+
+    def _overflow(self, events: List[dict]):
+        if self.spill_max_bytes > 0 and self._spill(events):
+            metrics.increment("analytics.spilled", len(events))
+        else:
+            metrics.increment("analytics.dropped", len(events))
+
+    def _spill(self, events: List[dict]) -> bool:
+        data = "".join(json.dumps(event, ensure_ascii=False) + "\n" for event in events).encode("utf-8")
+        with self._spill_lock:
+            try:
+                os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+                size = os.path.getsize(self.spill_path) if os.path.exists(self.spill_path) else 0
+                if size + len(data) > self.spill_max_bytes:
+                    return False
+                with open(self.spill_path, "ab") as f:
+                    f.write(data)
+                return True
+            except OSError as e:
+                logger.warning(f"Could not spill analytics events to '{self.spill_path}': {e}")
+                return False
+
+    def _unspill(self, limit: int) -> List[dict]:
+        """Take up to `limit` events out of the spill file"""
+        with self._spill_lock:
+            if not os.path.exists(self.spill_path):
+                return []
+            try:
+                with open(self.spill_path, "rb") as f:
+                    lines = f.read().splitlines()
+                taken, rest = lines[:limit], lines[limit:]
+                if rest:
+                    temp_path = self.spill_path + ".tmp"
+                    with open(temp_path, "wb") as f:
+                        f.write(b"\n".join(rest) + b"\n")
+                    os.replace(temp_path, self.spill_path)
+                else:
+                    os.remove(self.spill_path)
+            except OSError as e:
+                logger.warning(f"Could not read spilled analytics events from '{self.spill_path}': {e}")
+                return []
+        events = []
+        for line in taken:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                metrics.increment("analytics.dropped")
+        return events
+
+    def start(self):
+        """Start the background sender on the running event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        queue = self._get_queue()
+        while True:
+            try:
+                await self._send(await self._next_batch(queue))
+                if queue.empty():
+                    for event in await asyncio.to_thread(self._unspill, self.maxsize // 2):
+                        queue.put_nowait(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Analytics sender error: {e}", exc_info=True)
+
+    async def _next_batch(self, queue: asyncio.Queue) -> List[dict]:
+        """Wait for an event, then collect more until the batch is full or flush_interval passes"""
+        self._pending = [await queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        while len(self._pending) < self.batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                self._pending.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return self._pending
+
+    async def _send(self, events: List[dict]):
+        """One Measurement Protocol request for up to 25 events"""
+        # Events are anonymous (no user sessions), so a batch shares one random client id
+        payload = {
+            "client_id": str(uuid.uuid4()),
+            "non_personalized_ads": False, # Adjust as needed based on privacy/consent
+            "events": events,
+        }
+        url = f"{settings.GA_ENDPOINT}?measurement_id={settings.GA_MEASUREMENT_ID}&api_secret={settings.GA_API_SECRET}"
+        # _pending is cleared only once the batch is sent or counted as failed, so a
+        # batch whose send is cancelled by stop() is still there to flush or spill
+        try:
+            response = await client.post(url, json=payload)
+            response.raise_for_status()  # Raises an exception for 4XX/5XX responses
+            metrics.increment("analytics.sent", len(events))
+            logger.debug(f"Sent {len(events)} analytics events, status: {response.status_code}")
+        except httpx.HTTPStatusError as e:
+            metrics.increment("analytics.failed", len(events))
+            logger.error(
+                f"HTTP status error sending {len(events)} events to Google Analytics: {e.response.status_code} "
+                f"Response: {e.response.text}"
+            )
+        except httpx.RequestError as e:
+            metrics.increment("analytics.failed", len(events))
+            logger.error(f"HTTP request error sending {len(events)} events to Google Analytics: {e}")
+        except Exception as e:
+            metrics.increment("analytics.failed", len(events))
+            logger.error(f"Error sending {len(events)} events to Google Analytics: {e}", exc_info=True)
+        self._pending = []
+
+    async def stop(self, timeout: float = 5.0):
+        """Stop the sender, flush what is queued and spill whatever could not be sent"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        events = list(self._pending)
+        self._pending = []
+        if self._queue is not None:
+            while not self._queue.empty():
+                events.append(self._queue.get_nowait())
+            self._queue = None
+
+        if client.is_closed:
+            # The app shut down before and closed the shared client; keep the events for the next run
+            if events:
+                logger.warning(f"Analytics client is closed, spilling {len(events)} events")
+                self._overflow(events)
+            return
+
+        async def flush():
+            while events:
+                await self._send(events[:self.batch_size])
+                del events[:self.batch_size]
+
+        try:
+            await asyncio.wait_for(flush(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Analytics flush timed out, spilling {len(events)} events")
+            self._overflow(events)
+
+    def stats(self) -> dict:
+        spill_bytes = os.path.getsize(self.spill_path) if os.path.exists(self.spill_path) else 0
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "max_queued": self.maxsize,
+            "spill_bytes": spill_bytes,
+            "running": self._task is not None and not self._task.done(),
+        }
+
+
+# Global analytics queue; the sender is started with the application
+analytics_queue = AnalyticsQueue(
+    maxsize=settings.ANALYTICS_QUEUE_SIZE,
+    batch_size=settings.ANALYTICS_BATCH_SIZE,
+    flush_interval=settings.ANALYTICS_FLUSH_SECONDS,
+    spill_path=os.path.join(settings.OUT_DIR, "analytics", "spill.jsonl"),
+    spill_max_bytes=settings.ANALYTICS_SPILL_MAX_BYTES,
+)
+
 async def track_event(event_name: str, event_params: dict = None, user_ip: str = None, user_agent: str = None):
     """
     Tracks a custom event to Google Analytics 4 using the Measurement Protocol.
     Firebase Admin SDK's own analytics capabilities are limited for custom server-side events.
+
+    The event is only queued here; analytics_queue sends it in the background,
+    so this never waits on the network.
     """
     if not settings.FIREBASE_ANALYTICS_ENABLED:
         logger.debug(f"Firebase Analytics (overall feature) is disabled. Event '{event_name}' not tracked.")
@@ -50,67 +256,14 @@ async def track_event(event_name: str, event_params: dict = None, user_ip: str =
         )
         return
 
-    # For server-side events, a stable client_id is recommended.
-    # This could be a hashed user ID if available, or a randomly generated UUID
-    # if you can't tie it to a specific user. For simplicity, we generate one per event.
-    # Ideally, you'd want to manage client_id more consistently if tracking user journeys.
-    # A common practice is to use a unique ID for the instance or session.
-    # Since we don't have user sessions here, we generate a new one each time.
-    # Or, if you have a client-side GA instance, you might pass its client_id to the backend.
-    client_id = str(uuid.uuid4())
-
-    payload = {
-        "client_id": client_id,
-        "non_personalized_ads": False, # Adjust as needed based on privacy/consent
-        "events": [{
-            "name": event_name,
-            "params": event_params or {}
-        }]
-    }
-    
+    params = dict(event_params or {})
     # Add user_ip and user_agent to event_params if available,
     # GA4 might use these for some processing or reporting.
     # Note: Be mindful of PII and privacy regulations when handling IP addresses.
     # GA4 has IP anonymization enabled by default.
     if user_ip:
-        payload["events"][0]["params"]["user_ip_address"] = user_ip # Use standard GA4 parameter name if available
+        params["user_ip_address"] = user_ip # Use standard GA4 parameter name if available
     if user_agent:
-        payload["events"][0]["params"]["user_agent"] = user_agent
-
-    url = f"https://www.google-analytics.com/mp/collect?measurement_id={settings.GA_MEASUREMENT_ID}&api_secret={settings.GA_API_SECRET}"
-
-    try:
-        response = await client.post(url, json=payload)
-        response.raise_for_status()  # Raises an exception for 4XX/5XX responses
-        logger.info(
-            f"Event '{event_name}' sent to Google Analytics. "
-            f"Client ID: {client_id}, Status: {response.status_code}"
-        )
-        # For debugging Measurement Protocol hits:
-        # You can use the GA4 Event Debugger or Realtime reports.
-        # For more detailed validation, send to:
-        # https://www.google-analytics.com/debug/mp/collect?measurement_id=...&api_secret=...
-        # The response will be JSON with validation messages.
-        # logger.debug(f"GA Response: {response.text}")
-        
-    except httpx.RequestError as e:
-        logger.error(
-            f"HTTP request error sending event '{event_name}' to Google Analytics: {e}",
-            exc_info=True
-        )
-    except httpx.HTTPStatusError as e:
-        logger.error(
-            f"HTTP status error sending event '{event_name}' to Google Analytics: {e.response.status_code} "
-            f"Response: {e.response.text}",
-            exc_info=True
-        )
-    except Exception as e:
-        logger.error(
-            f"Unexpected error sending event '{event_name}' to Google Analytics: {e}",
-            exc_info=True
-        )
+        params["user_agent"] = user_agent
 
-# Consider adding a shutdown event for the httpx.AsyncClient if managing it globally
-# async def close_httpx_client():
-#    await client.aclose()
-# This would typically be registered with FastAPI's "shutdown" event. 
\ No newline at end of file
+    analytics_queue.put({"name": event_name, "params": params})
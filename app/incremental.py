@@ -0,0 +1,206 @@
+"""
+Incremental reconversion for documents that are edited and submitted again.
+
+A document is split into blocks at its headings (outside code fences and
+tables, see app/chunked.py). Every block is preprocessed and converted on its
+own, and the result is cached under a hash of the block text and the
+conversion options, together with the DocxFragment extracted from it. A
+session remembers the blocks of its last submission; when the document comes
+back, only blocks with a new hash are rendered and word/document.xml is
+reassembled from the cached fragments.
+
+Sessions live in the memory of the worker process that created them, so
+multi-worker deployments need sticky routing for /api/convert/incremental.
+"""
+
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from . import metrics
+from .chunked import split_markdown, chunk_pool
+from .config import settings, PANDOC_TIMEOUT
+from .converter import convert_chunk, conversion_options
+from .docx_merge import DocxFragment, DocxMergeError, extract_fragment, merge_fragments
+from .utils.memo import ByteBudgetLRU
+
+logger = logging.getLogger(__name__)
+
+SESSION_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+class BlockResult:
+    """A converted block: its package and, once needed, the extracted fragment"""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self._fragment: Optional[DocxFragment] = None
+
+    @property
+    def fragment(self) -> DocxFragment:
+        if self._fragment is None:
+            self._fragment = extract_fragment(self.data)
+        return self._fragment
+
+    @property
+    def size(self) -> int:
+        return len(self.data) + (self._fragment.size if self._fragment is not None else 0)
+
+
+class IncrementalSession:
+    def __init__(self, session_id: str):
+        self.id = session_id
+        self.lock = threading.Lock()
+        self.updated = time.time()
+        # Blocks of the last submission, kept even when the shared cache evicts them
+        self.blocks: Dict[str, BlockResult] = {}
+
+
+def _is_bare_heading(block: str) -> bool:
+    lines = [line for line in block.split("\n") if line.strip()]
+    return len(lines) == 1 and lines[0].startswith("#")
+
+
+def split_blocks(text: str) -> List[str]:
+    """
+    The blocks of a document, one per heading. A heading with no body of its
+    own (e.g. a title right above a section) stays with the block after it;
+    documents that cannot be split are one block.
+    """
+    pieces = split_markdown(text, 0, all_levels=True)
+    if pieces is None:
+        return [text]
+    blocks: List[str] = []
+    carried: Optional[str] = None
+    for piece in pieces:
+        if carried is not None:
+            piece, carried = carried + "\n" + piece, None
+        if _is_bare_heading(piece):
+            carried = piece
+        else:
+            blocks.append(piece)
+    if carried is not None:
+        if blocks:
+            blocks[-1] += "\n" + carried
+        else:
+            blocks.append(carried)
+    return blocks
+
+
+class IncrementalConverter:
+    """Sessions plus a shared, memory-bounded cache of converted blocks"""
+
+    def __init__(self, max_sessions: int, ttl_seconds: float, cache_bytes: int):
+        self.max_sessions = max(1, max_sessions)
+        self.ttl_seconds = ttl_seconds
+        self.blocks = ByteBudgetLRU(cache_bytes, name="incremental_blocks", sizeof=lambda block: block.size)
+        self._sessions: "OrderedDict[str, IncrementalSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _session(self, session_id: Optional[str]) -> IncrementalSession:
+        """The live session `session_id`, or a new one when it is unknown or expired"""
+        now = time.time()
+        with self._lock:
+            self._purge_expired(now)
+            session = self._sessions.get(session_id) if session_id else None
+            if session is None:
+                session = IncrementalSession(uuid.uuid4().hex)
+                self._sessions[session.id] = session
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+                    metrics.increment("incremental.sessions_evicted")
+            self._sessions.move_to_end(session.id)
+            session.updated = now
+            return session
+
+    def _purge_expired(self, now: float):
+        cutoff = now - self.ttl_seconds
+        for session_id in [sid for sid, session in self._sessions.items() if session.updated < cutoff]:
+            del self._sessions[session_id]
+
+    def end_session(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    @staticmethod
+    def _block_key(options: str, fmt: str, block: str) -> str:
+        digest = hashlib.sha256()
+        digest.update(options.encode("utf-8"))
+        digest.update(b"\0" + fmt.encode("utf-8") + b"\0")
+        digest.update(block.encode("utf-8"))
+        return digest.hexdigest()
+
+    def convert(self, session_id: Optional[str], text: str, fmt: str, timeout: int = PANDOC_TIMEOUT) -> dict:
+        """
+        Convert `text` within a session, rendering only blocks that are not cached.
+        Blocking; run it on a thread.
+
+        Returns:
+            {"session_id", "data", "blocks", "rendered"}
+        """
+        session = self._session(session_id)
+        with session.lock:
+            blocks = split_blocks(text)
+            options = json.dumps(conversion_options(), sort_keys=True)
+            keys = [self._block_key(options, fmt, block) for block in blocks]
+
+            results, rendered = self._results(session, dict(zip(keys, blocks)), fmt, timeout)
+            try:
+                with metrics.timed("incremental.assemble"):
+                    data = merge_fragments(results[keys[0]].data, [results[key].fragment for key in keys[1:]])
+            except DocxMergeError as e:
+                logger.info(f"Blocks cannot be merged ({e}), converting the document as one block")
+                keys = [self._block_key(options, fmt, text)]
+                results, rendered = self._results(session, {keys[0]: text}, fmt, timeout)
+                data = results[keys[0]].data
+
+            for key, result in results.items():
+                self.blocks.put(key, result)
+            session.blocks = results
+        metrics.increment("incremental.blocks_rendered", rendered)
+        metrics.increment("incremental.blocks_reused", len(results) - rendered)
+        logger.info(f"Incremental conversion in session {session.id}: {rendered} of {len(results)} distinct blocks rendered")
+        return {"session_id": session.id, "data": data, "blocks": len(keys), "rendered": rendered}
+
+    def _results(self, session: IncrementalSession, blocks: Dict[str, str], fmt: str, timeout: int):
+        """Converted blocks by key, rendering the ones that are not cached; also returns how many were rendered"""
+        results: Dict[str, BlockResult] = {}
+        missing: Dict[str, str] = {}
+        for key, block in blocks.items():
+            result = session.blocks.get(key) or self.blocks.get(key)
+            if result is None:
+                missing[key] = block
+            else:
+                results[key] = result
+        if missing:
+            with metrics.timed("incremental.render"):
+                results.update(self._render(missing, fmt, timeout))
+        return results, len(missing)
+
+    @staticmethod
+    def _render(blocks: Dict[str, str], fmt: str, timeout: int) -> Dict[str, BlockResult]:
+        """Convert blocks, in parallel on the chunk pool when there are several"""
+        keys = list(blocks)
+        if len(keys) == 1:
+            parts = [convert_chunk(0, blocks[keys[0]], fmt, timeout)]
+        else:
+            parts = chunk_pool.map(convert_chunk, [blocks[key] for key in keys], fmt, timeout)
+        return {key: BlockResult(data) for key, data in zip(keys, parts)}
+
+    def stats(self) -> dict:
+        with self._lock:
+            sessions = len(self._sessions)
+        return {"sessions": sessions, "blocks": self.blocks.stats()}
+
+
+incremental_converter = IncrementalConverter(
+    max_sessions=settings.INCREMENTAL_MAX_SESSIONS,
+    ttl_seconds=settings.INCREMENTAL_SESSION_TTL_SECONDS,
+    cache_bytes=settings.INCREMENTAL_CACHE_BYTES,
+)
@@ -0,0 +1,211 @@
+"""
+Request body ingestion with the size limit enforced while reading.
+
+BodySizeLimitMiddleware rejects a request with 413 as soon as its declared
+Content-Length, or the bytes received so far, exceed the limit of its route,
+so oversized uploads are never buffered. read_conversion_input takes the text
+of a conversion from a form field, an uploaded file or a raw text/markdown
+body, measuring the UTF-8 size on the received bytes instead of re-encoding.
+"""
+
+import json
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import unquote_to_bytes
+
+from starlette.requests import Request
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Room for the other form fields, multipart boundaries and part headers
+BODY_OVERHEAD_BYTES = 64 * 1024
+# Percent-encoding (forms) and \uXXXX escapes (JSON) take up to 3 bytes per byte of UTF-8 text
+ESCAPED_BODY_FACTOR = 3
+ESCAPED_CONTENT_TYPES = ("application/x-www-form-urlencoded", "application/json")
+RAW_TEXT_TYPES = ("text/markdown", "text/x-markdown", "text/plain")
+
+
+class RequestBodyTooLarge(Exception):
+    """Raised from receive() once a request body passes its limit"""
+
+
+class ConversionInputError(ValueError):
+    """Invalid conversion input; carries the HTTP status to answer with"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def media_type(content_type: Optional[str]) -> str:
+    return (content_type or "").split(";")[0].strip().lower()
+
+
+def body_limit(text_limit: int, content_type: Optional[str]) -> int:
+    """Largest body that can carry `text_limit` bytes of text in the given encoding"""
+    if media_type(content_type) in ESCAPED_CONTENT_TYPES:
+        return text_limit * ESCAPED_BODY_FACTOR + BODY_OVERHEAD_BYTES
+    return text_limit + BODY_OVERHEAD_BYTES
+
+
+async def _send_too_large(send):
+    body = json.dumps({"detail": "Request body too large"}).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": 413,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("latin-1")),
+            (b"connection", b"close"),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class BodySizeLimitMiddleware:
+    """
+    Answers 413 for request bodies larger than `limit_for(scope)` bytes (None:
+    no limit), before the application buffers or parses them
+    """
+
+    def __init__(self, app, limit_for: Callable[[dict], Optional[int]]):
+        self.app = app
+        self.limit_for = limit_for
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        limit = self.limit_for(scope)
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        try:
+            declared = int(headers.get(b"content-length", b""))
+        except ValueError:
+            declared = None
+        if declared is not None and declared > limit:
+            metrics.increment("ingest.rejected")
+            await _send_too_large(send)
+            return
+
+        received = 0
+        started = False
+        responded = False
+
+        async def limited_receive():
+            nonlocal received, responded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    metrics.increment("ingest.rejected")
+                    if not started:
+                        responded = True
+                        await _send_too_large(send)
+                    raise RequestBodyTooLarge(f"Request body exceeds {limit} bytes")
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            # The 413 is already out; whatever the app answers to the aborted read is dropped
+            if responded:
+                return
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except RequestBodyTooLarge:
+            if not responded:
+                raise
+
+
+async def read_body(request: Request, limit: int) -> bytes:
+    """The request body, read chunk by chunk and given up on once it passes `limit` bytes"""
+    chunks: List[bytes] = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            raise ConversionInputError("Input text too large", 413)
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def _decode(data: bytes, source: str) -> str:
+    try:
+        return data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise ConversionInputError(f"{source} is not valid UTF-8 text")
+
+
+def parse_urlencoded(body: bytes) -> List[Tuple[bytes, bytes]]:
+    """Name/value pairs of a urlencoded form, left as bytes so their UTF-8 size is known"""
+    pairs = []
+    for field in body.split(b"&"):
+        if field:
+            name, _, value = field.partition(b"=")
+            pairs.append((unquote_to_bytes(name.replace(b"+", b" ")), unquote_to_bytes(value.replace(b"+", b" "))))
+    return pairs
+
+
+def utf8_size_exceeds(text: str, limit: int) -> bool:
+    """Whether `text` takes more than `limit` bytes as UTF-8, encoding it only when the length can't tell"""
+    if len(text) > limit:
+        return True
+    if len(text) * 4 <= limit:
+        return False
+    return len(text.encode("utf-8")) > limit
+
+
+async def read_conversion_input(request: Request, limit: int) -> Tuple[str, Dict[str, str]]:
+    """
+    Text and other fields of a conversion request, sent as
+    - a form (urlencoded or multipart) with a `text` field,
+    - a multipart upload of a Markdown `file` (plus the other fields), or
+    - a raw text/markdown (or text/plain) body, with the other fields in the query string.
+
+    Raises:
+        ConversionInputError: If the text is missing, too large (413), not
+            UTF-8, or sent with an unsupported content type (415)
+    """
+    content_type = media_type(request.headers.get("content-type"))
+
+    if content_type in RAW_TEXT_TYPES:
+        text = _decode(await read_body(request, limit), "The request body")
+        return text, dict(request.query_params)
+
+    if content_type == "application/x-www-form-urlencoded":
+        body = await read_body(request, body_limit(limit, content_type))
+        text, fields = None, {}
+        for key, value in parse_urlencoded(body):
+            key = key.decode("utf-8", "replace")
+            if key == "text" and text is None:
+                if len(value) > limit:
+                    raise ConversionInputError("Input text too large", 413)
+                text = _decode(value, "The text")
+            elif key not in fields:
+                fields[key] = value.decode("utf-8", "replace")
+    elif content_type == "multipart/form-data":
+        form = await request.form()
+        upload, text = form.get("file"), form.get("text")
+        if upload is not None and not isinstance(upload, str):
+            data = await upload.read(limit + 1)
+            if len(data) > limit:
+                raise ConversionInputError("Input text too large", 413)
+            text = _decode(data, f"File '{upload.filename}'")
+        elif isinstance(text, str) and utf8_size_exceeds(text, limit):
+            raise ConversionInputError("Input text too large", 413)
+        fields = {key: value for key, value in form.items() if key not in ("text", "file") and isinstance(value, str)}
+    else:
+        raise ConversionInputError("Send the text as a form, an uploaded file or a text/markdown body", 415)
+
+    if not isinstance(text, str):
+        raise ConversionInputError("Missing 'text' field or uploaded 'file'", 422)
+    return text, fields
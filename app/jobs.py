@@ -0,0 +1,353 @@
+"""
+Asynchronous conversion jobs for documents too large to convert within one
+HTTP request.
+
+POST /api/jobs records a job and converts it in the background on the
+conversion pool; clients poll GET /api/jobs/{id} and download the result from
+OUT_DIR/jobs once it is done. Job records live in a pluggable store:
+
+- "memory": in-process dict (single worker)
+- "sqlite": a SQLite file shared by all worker processes on the host
+- "redis": any Redis-compatible server (needs the optional `redis` package)
+
+With a shared store any worker can answer status and result requests, while
+the conversion itself runs on the worker that accepted the job.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import sqlite3
+import subprocess
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Set
+
+from . import metrics
+from .config import settings, OUT_DIR
+from .converter import run_conversion, run_conversion_in_memory, conversion_cache_key, write_result_file
+from .result_cache import result_cache
+from .worker_pool import conversion_pool
+
+logger = logging.getLogger(__name__)
+
+JOB_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+# Job states, in order
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class JobStore(ABC):
+    """Storage for job records (plain JSON-serializable dicts keyed by job id)"""
+
+    @abstractmethod
+    def create(self, job: Dict[str, Any]):
+        ...
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def update(self, job_id: str, **fields):
+        ...
+
+    @abstractmethod
+    def delete(self, job_id: str):
+        ...
+
+    @abstractmethod
+    def expired(self, cutoff: float) -> List[str]:
+        """Ids of jobs created before `cutoff` (a UNIX timestamp)"""
+
+
+class MemoryJobStore(JobStore):
+    """Job records in a dict; only visible to the current process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+
+    def create(self, job):
+        with self._lock:
+            self._jobs[job["id"]] = dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def delete(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def expired(self, cutoff):
+        with self._lock:
+            return [job_id for job_id, job in self._jobs.items() if job["created_at"] < cutoff]
+
+
+class SqliteJobStore(JobStore):
+    """Job records in a SQLite database shared by the worker processes of one host"""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, created_at REAL NOT NULL, data TEXT NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_created_at ON jobs (created_at)")
+
+    def create(self, job):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, created_at, data) VALUES (?, ?, ?)",
+                (job["id"], job["created_at"], json.dumps(job)),
+            )
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                if row:
+                    job = json.loads(row[0])
+                    job.update(fields)
+                    self._conn.execute("UPDATE jobs SET data = ? WHERE id = ?", (json.dumps(job), job_id))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def delete(self, job_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def expired(self, cutoff):
+        with self._lock:
+            rows = self._conn.execute("SELECT id FROM jobs WHERE created_at < ?", (cutoff,)).fetchall()
+        return [row[0] for row in rows]
+
+
+class RedisJobStore(JobStore):
+    """Job records in a Redis-compatible server; records expire on their own"""
+
+    def __init__(self, url: str, ttl_seconds: int, prefix: str = "docright:job:"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("JOB_BACKEND=redis requires the 'redis' package (pip install redis)")
+        self._redis = redis.Redis.from_url(url)
+        self.ttl_seconds = max(1, int(ttl_seconds))
+        self.prefix = prefix
+
+    def create(self, job):
+        self._redis.set(self.prefix + job["id"], json.dumps(job), ex=self.ttl_seconds)
+
+    def get(self, job_id):
+        data = self._redis.get(self.prefix + job_id)
+        return json.loads(data) if data else None
+
+    def update(self, job_id, **fields):
+        # Only the worker running a job updates it, so read-modify-write is safe
+        job = self.get(job_id)
+        if job is not None:
+            job.update(fields)
+            self._redis.set(self.prefix + job_id, json.dumps(job), keepttl=True)
+
+    def delete(self, job_id):
+        self._redis.delete(self.prefix + job_id)
+
+    def expired(self, cutoff):
+        return []
+
+
+def create_job_store(backend: str) -> JobStore:
+    """Job store for the JOB_BACKEND setting"""
+    if backend == "memory":
+        return MemoryJobStore()
+    if backend == "sqlite":
+        return SqliteJobStore(settings.JOB_SQLITE_PATH)
+    if backend == "redis":
+        return RedisJobStore(settings.JOB_REDIS_URL, settings.MAX_FILE_AGE_HOURS * 3600)
+    raise ValueError(f"Unsupported job backend: '{backend}'. Use 'memory', 'sqlite' or 'redis'.")
+
+
+def _error_message(error: BaseException) -> str:
+    if isinstance(error, subprocess.TimeoutExpired):
+        return f"Conversion timed out after {error.timeout} seconds."
+    if isinstance(error, ValueError):
+        return str(error)
+    if isinstance(error, subprocess.CalledProcessError):
+        return "Conversion failed due to an internal processing error."
+    return "An unexpected error occurred during conversion."
+
+
+class JobManager:
+    """Accepts jobs, runs them in the background and tracks their state in a JobStore"""
+
+    def __init__(self, store: Optional[JobStore], results_dir: str, concurrency: int, ttl_seconds: float,
+                 timeout: int):
+        self._store = store
+        self.results_dir = results_dir
+        self.concurrency = max(1, concurrency)
+        self.ttl_seconds = ttl_seconds
+        self.timeout = timeout
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def store(self) -> JobStore:
+        # Created on first use, so a misconfigured backend only affects /api/jobs
+        if self._store is None:
+            self._store = create_job_store(settings.JOB_BACKEND)
+        return self._store
+
+    def result_path(self, job: Dict[str, Any]) -> str:
+        return os.path.join(self.results_dir, f"{job['id']}.{job['format']}")
+
+    async def submit(self, text: str, fmt: str) -> Dict[str, Any]:
+        """Record a new job and start converting it in the background"""
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": QUEUED,
+            "format": fmt,
+            "text_length": len(text),
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result_size": None,
+            "error": None,
+        }
+        await asyncio.to_thread(self.store.create, job)
+        task = asyncio.create_task(self._run(job, text))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        metrics.increment("jobs.submitted")
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        if not JOB_ID_RE.match(job_id):
+            return None
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def _run(self, job: Dict[str, Any], text: str):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        fmt = job["format"]
+        result_path = self.result_path(job)
+        try:
+            async with self._slots:
+                started_at = time.time()
+                await asyncio.to_thread(self.store.update, job["id"], status=RUNNING, started_at=started_at)
+                metrics.observe("jobs.queue_wait", started_at - job["created_at"])
+                os.makedirs(self.results_dir, exist_ok=True)
+
+                cache_key = conversion_cache_key(text, fmt) if settings.RESULT_CACHE_ENABLED else None
+                data = await asyncio.to_thread(result_cache.get, cache_key, fmt) if cache_key else None
+                if data is None:
+                    with metrics.timed("jobs.conversion"):
+                        data = await self._convert(text, fmt, result_path)
+                    if cache_key:
+                        await asyncio.to_thread(result_cache.put, cache_key, fmt, data)
+                else:
+                    await asyncio.to_thread(write_result_file, result_path, data)
+
+            await asyncio.to_thread(
+                self.store.update, job["id"], status=DONE, finished_at=time.time(), result_size=len(data)
+            )
+            metrics.increment("jobs.completed")
+            logger.info(f"Job {job['id']} completed ({len(data)} bytes)")
+        except asyncio.CancelledError:
+            await asyncio.to_thread(
+                self.store.update, job["id"], status=FAILED, finished_at=time.time(), error="The server shut down before the job finished."
+            )
+            raise
+        except Exception as e:
+            logger.error(f"Job {job['id']} failed: {e}", exc_info=not isinstance(e, (ValueError, subprocess.SubprocessError)))
+            metrics.increment("jobs.failed")
+            await asyncio.to_thread(
+                self.store.update, job["id"], status=FAILED, finished_at=time.time(), error=_error_message(e)
+            )
+
+    async def _convert(self, text: str, fmt: str, result_path: str) -> bytes:
+        """Convert on the shared pool (waiting for a slot) and write the result to `result_path`"""
+        if settings.IN_MEMORY_CONVERSION:
+            return await conversion_pool.run(
+                run_conversion_in_memory, text, fmt, result_path, self.timeout, wait=True
+            )
+        md_path = os.path.splitext(result_path)[0] + ".md"
+        try:
+            await conversion_pool.run(run_conversion, text, md_path, result_path, fmt, self.timeout, wait=True)
+        finally:
+            if os.path.exists(md_path):
+                os.remove(md_path)
+        with open(result_path, "rb") as f:
+            return f.read()
+
+    def describe(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """Public view of a job record, with timings"""
+        now = time.time()
+        started_at, finished_at = job.get("started_at"), job.get("finished_at")
+        view = {key: job.get(key) for key in ("id", "status", "format", "text_length", "result_size", "error")}
+        view["created_at"] = job["created_at"]
+        view["started_at"] = started_at
+        view["finished_at"] = finished_at
+        view["queue_seconds"] = round((started_at or now) - job["created_at"], 3)
+        view["run_seconds"] = round((finished_at or now) - started_at, 3) if started_at else None
+        view["status_url"] = f"/api/jobs/{job['id']}"
+        if job["status"] == DONE:
+            view["result_url"] = f"/api/jobs/{job['id']}/result"
+        return view
+
+    def purge_expired(self) -> int:
+        """Remove job records and result files older than the TTL"""
+        cutoff = time.time() - self.ttl_seconds
+        count = 0
+        for job_id in self.store.expired(cutoff):
+            self.store.delete(job_id)
+            count += 1
+        if os.path.isdir(self.results_dir):
+            for entry in os.scandir(self.results_dir):
+                if entry.is_file() and JOB_ID_RE.match(entry.name.split(".")[0]) and entry.stat().st_mtime < cutoff:
+                    try:
+                        os.remove(entry.path)
+                    except OSError as e:
+                        logger.warning(f"Could not remove expired job result '{entry.path}': {e}")
+        if count:
+            logger.info(f"Removed {count} expired jobs")
+        return count
+
+    def stats(self) -> dict:
+        return {"backend": settings.JOB_BACKEND, "concurrency": self.concurrency, "active": len(self._tasks)}
+
+    async def shutdown(self):
+        """Cancel running jobs and wait until each has recorded that it failed"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# Global job manager used by the API endpoints
+job_manager = JobManager(
+    store=None,
+    results_dir=os.path.join(OUT_DIR, "jobs"),
+    concurrency=settings.JOB_CONCURRENCY,
+    ttl_seconds=settings.MAX_FILE_AGE_HOURS * 3600,
+    timeout=settings.JOB_PANDOC_TIMEOUT,
+)
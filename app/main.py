@@ -1,21 +1,42 @@
-from fastapi import FastAPI, Form, HTTPException, Request, BackgroundTasks, Depends
-from fastapi.responses import FileResponse, HTMLResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, HTTPException, Request, BackgroundTasks, Depends, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, HTMLResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exception_handlers import http_exception_handler
+import asyncio
+import json
 import uuid
 import os
 import logging
 import time
 import subprocess
+from collections import deque
 from pathlib import Path
-from datetime import datetime, timedelta
-from typing import Dict, Any, Callable # Keep Callable if used
 
-from .converter import render_markdown, cleanup_old_files
+from starlette.concurrency import run_in_threadpool
+
+from .converter import (
+    run_conversion, run_conversion_in_memory, run_merge_conversion, cleanup_old_files, get_reference_docx,
+    conversion_cache_key, pandoc_version, write_result_file,
+)
+from .worker_pool import conversion_pool, PoolSaturatedError
+from .chunked import chunk_pool
+from .incremental import incremental_converter, SESSION_ID_RE
+from .preview import preview_renderer
+from .rate_limiter import rate_limiter, RateLimitHeadersMiddleware
+from .ingest import BodySizeLimitMiddleware, ConversionInputError, body_limit, read_conversion_input
+from .static_cache import (
+    StaticBundle, StaticAsset, asset_response_headers, not_modified,
+    IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL,
+)
+from .result_cache import result_cache
+from .expiry import Sweeper
+from .storage import output_path, drop_expired_shards, migrate_flat_outputs
+from .batch import build_batch, stream_batch_zip, read_markdown_zip, BatchRequestError
+from .jobs import job_manager, DONE, FAILED
+from .utils.text_processor import preprocess_memo
+from . import metrics
 from .config import settings, OUT_DIR # settings.ALLOWED_FORMATS will be {"docx"}
-from .firebase_utils import initialize_firebase, track_event # Add Firebase imports
-from .utils.text_processor import preprocess_farsi_text # Enhanced text processing
+from .firebase_utils import initialize_firebase, track_event, analytics_queue # Add Firebase imports
 
 # Setup logging
 logger = logging.getLogger(__name__)
@@ -28,6 +49,21 @@ app = FastAPI(
     redoc_url="/api/redoc" if settings.DEBUG else None,
 )
 
+def _request_body_limit(scope) -> int:
+    """Largest accepted request body for the route of `scope`"""
+    path = scope["path"]
+    if path == "/api/convert/batch":
+        text_limit = settings.BATCH_MAX_DOCUMENTS * settings.MAX_INPUT_SIZE
+    elif path == "/api/convert/merge":
+        text_limit = settings.MERGE_MAX_INPUT_SIZE
+    else:
+        text_limit = settings.MAX_INPUT_SIZE
+    content_type = dict(scope.get("headers") or []).get(b"content-type", b"").decode("latin-1")
+    return body_limit(text_limit, content_type)
+
+# Oversized bodies are rejected while they are received (inside CORS, so the 413 carries its headers)
+app.add_middleware(BodySizeLimitMiddleware, limit_for=_request_body_limit)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -37,68 +73,117 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Rate limiter implementation
-class RateLimiter:
-    def __init__(self, limit: int = settings.RATE_LIMIT):
-        self.limit = limit
-        self.requests: Dict[str, list] = {}
-
-    def is_rate_limited(self, ip: str) -> bool:
-        now = datetime.now()
-        minute_ago = now - timedelta(minutes=1)
-
-        if ip not in self.requests:
-            self.requests[ip] = []
-        else:
-            self.requests[ip] = [ts for ts in self.requests[ip] if ts > minute_ago]
-
-        if len(self.requests[ip]) >= self.limit:
-            return True
-
-        self.requests[ip].append(now)
-        return False
-
-rate_limiter = RateLimiter()
+app.add_middleware(RateLimitHeadersMiddleware)
 
 async def check_rate_limit(request: Request):
     client_ip = request.client.host if request.client else "unknown"
-    if rate_limiter.is_rate_limited(client_ip):
+    result = rate_limiter.check(client_ip)
+    request.state.rate_limit = result
+    if not result.allowed:
         logger.warning(f"Rate limit exceeded for IP: {client_ip}")
         raise HTTPException(
             status_code=429,
-            detail="Too many requests. Please try again later."
+            detail="Too many requests. Please try again later.",
+            headers=result.headers(),
         )
 
 def schedule_cleanup():
-    try:
-        count = cleanup_old_files()
-        logger.info(f"Scheduled cleanup removed {count} files")
-    except Exception as e:
-        logger.error(f"Error during scheduled cleanup: {e}")
+    """Periodic cleanup: removes only expired entries, without scanning OUT_DIR"""
+    count = drop_expired_shards(settings.MAX_FILE_AGE_HOURS * 3600)
+    logger.debug(f"Scheduled cleanup removed {count} shards")
+    if settings.RESULT_CACHE_ENABLED:
+        result_cache.purge_expired()
+    job_manager.purge_expired()
+
+# One sweeper task per process runs the cleanup every CLEANUP_INTERVAL_SECONDS
+sweeper = Sweeper(settings.CLEANUP_INTERVAL_SECONDS, [schedule_cleanup])
+
+def _remove_files(*paths: str):
+    """Delete files that are no longer needed (e.g. after a download)"""
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not remove '{path}': {e}")
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "message": "DocRight API is running"}
 
-@app.get("/", response_class=HTMLResponse)
-async def homepage():
-    try:
-        # Ensure path is correct relative to this file's location
-        html_file_path = Path(__file__).parent.parent / "static" / "index.html"
-        with open(html_file_path, encoding="utf-8") as f:
-            return HTMLResponse(f.read())
-    except Exception as e:
-        logger.error(f"Error serving homepage: {e}", exc_info=True)
-        raise HTTPException(500, "Unable to serve homepage")
+@app.get("/api/metrics")
+async def metrics_endpoint():
+    """In-process counters and timings (cache hits, rebuilds, ...) for monitoring"""
+    snapshot = metrics.snapshot()
+    snapshot["conversion_pool"] = conversion_pool.stats()
+    snapshot["chunk_pool"] = chunk_pool.stats()
+    snapshot["incremental"] = incremental_converter.stats()
+    snapshot["preview"] = preview_renderer.stats()
+    if settings.RESULT_CACHE_ENABLED:
+        snapshot["result_cache"] = result_cache.stats()
+    snapshot["preprocess_memo"] = preprocess_memo.stats()
+    snapshot["jobs"] = job_manager.stats()
+    snapshot["analytics"] = analytics_queue.stats()
+    return snapshot
+
+# Measurement Protocol requests received by the local stub (ANALYTICS_STUB_ENABLED)
+analytics_stub_requests = deque(maxlen=1000)
+
+@app.post("/api/analytics/stub/collect", status_code=204)
+async def analytics_stub_collect(request: Request):
+    """Stand-in for the GA Measurement Protocol endpoint, for tests and local runs"""
+    if not settings.ANALYTICS_STUB_ENABLED:
+        raise HTTPException(404, "Not Found")
+    payload = await request.json()
+    if not payload.get("client_id") or not 0 < len(payload.get("events", [])) <= 25:
+        raise HTTPException(400, "Invalid Measurement Protocol payload")
+    analytics_stub_requests.append(payload)
+
+@app.get("/api/analytics/stub/collect")
+async def analytics_stub_received():
+    """Payloads received by the analytics stub, oldest first"""
+    if not settings.ANALYTICS_STUB_ENABLED:
+        raise HTTPException(404, "Not Found")
+    return list(analytics_stub_requests)
 
 BASE_DIR = Path(__file__).parent.parent
 STATIC_DIR = BASE_DIR / "static"
 if not STATIC_DIR.exists():
     logger.error(f"Static directory not found at: {STATIC_DIR}")
-    # Decide how to handle this - raise an error or proceed?
-    # For now, we'll let it fail at mount if it's truly missing.
-app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
+
+# Homepage and static files are served from memory (reloaded on change in DEBUG)
+static_bundle = StaticBundle(STATIC_DIR, reload=settings.DEBUG)
+
+def _static_response(request: Request, asset: StaticAsset, cache_control: str) -> Response:
+    """Precompressed, ETag-validated response for an in-memory asset"""
+    body, encoding = asset.variant(request.headers.get("accept-encoding", ""))
+    if not_modified(asset, request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=asset_response_headers(asset, cache_control, encoding))
+    metrics.increment("static.served")
+    headers = asset_response_headers(asset, cache_control, encoding)
+    if request.method == "HEAD":
+        # Same headers as the GET response, including the length of the body it would carry
+        headers["Content-Length"] = str(len(body))
+        return Response(content=b"", media_type=asset.media_type, headers=headers)
+    return Response(content=body, media_type=asset.media_type, headers=headers)
+
+@app.api_route("/", methods=["GET", "HEAD"], response_class=HTMLResponse)
+async def homepage(request: Request):
+    page = static_bundle.homepage()
+    if page is None:
+        logger.error(f"Homepage not found in {STATIC_DIR}")
+        raise HTTPException(500, "Unable to serve homepage")
+    return _static_response(request, page, REVALIDATE_CACHE_CONTROL)
+
+@app.api_route("/static/{name:path}", methods=["GET", "HEAD"])
+async def static_file(request: Request, name: str):
+    asset = static_bundle.get(name)
+    if asset is None:
+        raise HTTPException(404, "Not Found")
+    cache_control = IMMUTABLE_CACHE_CONTROL if static_bundle.is_hashed(name) else REVALIDATE_CACHE_CONTROL
+    return _static_response(request, asset, cache_control)
 
 
 @app.post("/api/admin/cleanup") # Keep if you want admin cleanup
@@ -108,20 +193,51 @@ async def admin_cleanup(request: Request):
     count = cleanup_old_files()
     return {"status": "success", "files_removed": count}
 
+DOCX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+def _docx_response(format: str, data: bytes = None, path: str = None):
+    """Download response for a finished conversion, from memory or from a file"""
+    if data is not None:
+        return Response(
+            content=data,
+            media_type=DOCX_MEDIA_TYPE,
+            headers={"Content-Disposition": f'attachment; filename="farsi_text.{format}"'},
+        )
+    return FileResponse(
+        path,
+        media_type=DOCX_MEDIA_TYPE, # Only DOCX
+        filename=f"farsi_text.{format}" # format will be "docx"
+    )
+
+def _form_flag(value, default: bool) -> bool:
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).lower() in ("true", "1", "yes", "on")
+
+async def _read_conversion_input(request: Request):
+    """Text and fields of a single conversion request, size-checked while reading"""
+    try:
+        return await read_conversion_input(request, settings.MAX_INPUT_SIZE)
+    except ConversionInputError as e:
+        raise HTTPException(e.status_code, str(e))
+
 @app.post("/api/convert", dependencies=[Depends(check_rate_limit)])
-async def convert(
-    background_tasks: BackgroundTasks,
-    request: Request,
-    text: str = Form(...),
-    format: str = Form(...) # format will now always be "docx" based on frontend
-):
+async def convert(background_tasks: BackgroundTasks, request: Request):
+    """
+    Convert Markdown sent as a form `text` field, an uploaded `file` or a raw
+    text/markdown body. Fields: `format` (docx), `persist` (keep a copy of the
+    result in OUT_DIR until it expires) and `toc` (generate a table of contents)
+    """
+    text, fields = await _read_conversion_input(request)
+    format = fields.get("format", "docx") # format will now always be "docx" based on frontend
+    persist = _form_flag(fields.get("persist"), False)
+    toc = _form_flag(fields.get("toc"), False)
     if format not in settings.ALLOWED_FORMATS:
         # This check is still good, though frontend should only send "docx"
         raise HTTPException(400, f"Format must be 'docx'. Received: {format}")
 
-    if len(text.encode('utf-8')) > settings.MAX_INPUT_SIZE:
-        raise HTTPException(413, "Input text too large")
-
     # Track conversion event
     if settings.FIREBASE_ANALYTICS_ENABLED:
         user_ip = request.client.host if request.client else None
@@ -134,35 +250,60 @@ async def convert(
         )
 
     uid = uuid.uuid4().hex
-    md_file = os.path.join(OUT_DIR, f"{uid}.md")
+    # Files go to this hour's shard of OUT_DIR; in-memory conversions only need one to persist
+    uses_files = persist or not settings.IN_MEMORY_CONVERSION
+    md_file = output_path(uid, "md", create=uses_files)
     # Format will be 'docx'
-    out_file = os.path.join(OUT_DIR, f"{uid}.{format}")
+    out_file = output_path(uid, format, create=uses_files)
 
     logger.info(f"Converting to {format}, text length: {len(text)} chars, UID: {uid}")
 
     try:
-        # Preprocess text with Farsi enhancements
-        processed_text = preprocess_farsi_text(text)
-        logger.info(f"Text preprocessing completed. Original: {len(text)}, Processed: {len(processed_text)} chars")
-
-        with open(md_file, "w", encoding="utf-8") as f:
-            f.write(processed_text)
-    except Exception as e:
-        logger.error(f"Failed to write markdown file {md_file}: {e}", exc_info=True)
-        raise HTTPException(500, "Failed to process your request (writing md)")
+        # Identical requests are served from the result cache
+        options = {"toc": True} if toc else {}
+        cache_key = conversion_cache_key(text, format, **options) if settings.RESULT_CACHE_ENABLED else None
+        data = None
+        if cache_key and settings.IN_MEMORY_CONVERSION:
+            data = await run_in_threadpool(result_cache.get, cache_key, format)
+            if data is not None:
+                logger.info(f"Serving cached {format} result, UID: {uid}")
+                if persist:
+                    await run_in_threadpool(write_result_file, out_file, data)
+                return _docx_response(format, data=data)
+        elif cache_key:
+            cached_path = await run_in_threadpool(result_cache.get_path, cache_key, format)
+            if cached_path is not None:
+                logger.info(f"Serving cached {format} result, UID: {uid}")
+                return _docx_response(format, path=cached_path)
 
-    try:
+        # Preprocessing and Pandoc both block, so they run on the bounded
+        # conversion pool instead of the event loop
         start_time = time.time()
-        render_markdown(md_file, out_file, format)
+        if settings.IN_MEMORY_CONVERSION:
+            data = await conversion_pool.run(
+                run_conversion_in_memory, text, format, out_file if persist else None, toc=toc
+            )
+        else:
+            await conversion_pool.run(run_conversion, text, md_file, out_file, format, toc=toc)
         duration = time.time() - start_time
-        logger.info(f"Conversion to {format} completed in {duration:.2f} seconds for {out_file}")
+        logger.info(f"Conversion to {format} completed in {duration:.2f} seconds, UID: {uid}")
 
-        background_tasks.add_task(schedule_cleanup)
+        if cache_key and data is not None:
+            background_tasks.add_task(result_cache.put, cache_key, format, data)
+        elif cache_key:
+            background_tasks.add_task(result_cache.put_file, cache_key, format, out_file)
 
-        return FileResponse(
-            out_file,
-            media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document", # Only DOCX
-            filename=f"farsi_text.{format}" # format will be "docx"
+        if settings.IN_MEMORY_CONVERSION:
+            return _docx_response(format, data=data)
+        # The intermediate markdown, and the output once downloaded, are not needed anymore
+        background_tasks.add_task(_remove_files, md_file, *(() if persist else (out_file,)))
+        return _docx_response(format, path=out_file)
+    except PoolSaturatedError:
+        logger.warning(f"Conversion pool saturated, rejecting request UID: {uid}")
+        raise HTTPException(
+            503,
+            "Server is busy converting other documents. Please try again shortly.",
+            headers={"Retry-After": str(settings.CONVERT_RETRY_AFTER)},
         )
     except ValueError as e: # From render_markdown if format is somehow wrong
         logger.warning(f"Format validation error during conversion: {e}")
@@ -183,6 +324,314 @@ async def convert(
         raise HTTPException(500, "An unexpected error occurred during conversion.")
     # No finally here for cleanup, as render_markdown and specific exceptions handle it.
 
+async def _read_batch_entries(request: Request):
+    """
+    Documents of a batch or merge request, either JSON
+    ({"format": "docx", "documents": [{"name": ..., "text": ...} or "text", ...], ...})
+    or multipart with uploaded `files` (Markdown files or ZIP archives of them)
+    and/or repeated `texts` fields. Returns the other request fields and the documents.
+    """
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("application/json"):
+        try:
+            body = await request.json()
+        except ValueError:
+            raise HTTPException(400, "Invalid JSON body")
+        if not isinstance(body, dict) or not isinstance(body.get("documents"), list):
+            raise HTTPException(400, "Expected a JSON object with a 'documents' list")
+        entries = []
+        for item in body["documents"]:
+            if isinstance(item, str):
+                entries.append({"name": None, "text": item})
+            elif isinstance(item, dict) and isinstance(item.get("text"), str):
+                entries.append({"name": item.get("name"), "text": item["text"]})
+            else:
+                raise HTTPException(400, "Each document must be a string or an object with a 'text' field")
+        fields = {key: value for key, value in body.items() if key != "documents"}
+        return fields, entries
+
+    if content_type.startswith(("multipart/form-data", "application/x-www-form-urlencoded")):
+        form = await request.form()
+        entries = []
+        for upload in form.getlist("files"):
+            if isinstance(upload, str):
+                entries.append({"name": None, "text": upload})
+                continue
+            raw = await upload.read()
+            if (upload.filename or "").lower().endswith(".zip"):
+                try:
+                    entries.extend(read_markdown_zip(raw))
+                except BatchRequestError as e:
+                    raise HTTPException(400, str(e))
+                continue
+            try:
+                entries.append({"name": upload.filename, "text": raw.decode("utf-8-sig")})
+            except UnicodeDecodeError:
+                raise HTTPException(400, f"File '{upload.filename}' is not valid UTF-8 text")
+        entries.extend({"name": None, "text": text} for text in form.getlist("texts"))
+        fields = {key: value for key, value in form.items() if key not in ("files", "texts")}
+        return fields, entries
+
+    raise HTTPException(415, "Send the batch as application/json or multipart/form-data")
+
+@app.post("/api/convert/batch", dependencies=[Depends(check_rate_limit)])
+async def convert_batch(request: Request):
+    """Convert several documents in one request; returns a ZIP streamed as documents finish"""
+    fields, entries = await _read_batch_entries(request)
+    format = fields.get("format", "docx")
+    if format not in settings.ALLOWED_FORMATS:
+        raise HTTPException(400, f"Format must be 'docx'. Received: {format}")
+    try:
+        documents = build_batch(entries)
+    except BatchRequestError as e:
+        raise HTTPException(400, str(e))
+
+    if settings.FIREBASE_ANALYTICS_ENABLED:
+        user_ip = request.client.host if request.client else None
+        user_agent = request.headers.get("user-agent")
+        await track_event(
+            "batch_conversion_requested",
+            {"format": format, "documents": len(documents), "text_length": sum(len(d.text) for d in documents)},
+            user_ip=user_ip,
+            user_agent=user_agent
+        )
+
+    logger.info(f"Batch converting {len(documents)} documents to {format}")
+    return StreamingResponse(
+        stream_batch_zip(documents, format),
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="farsi_texts.zip"'},
+    )
+
+@app.post("/api/convert/merge", dependencies=[Depends(check_rate_limit)])
+async def convert_merge(request: Request, background_tasks: BackgroundTasks):
+    """
+    Merge an ordered list of Markdown documents (same input as /api/convert/batch)
+    into one DOCX with a single Pandoc run; `toc` adds a table of contents and
+    `page_breaks` (default on) starts each document on a new page
+    """
+    fields, entries = await _read_batch_entries(request)
+    format = fields.get("format", "docx")
+    if format not in settings.ALLOWED_FORMATS:
+        raise HTTPException(400, f"Format must be 'docx'. Received: {format}")
+    toc = _form_flag(fields.get("toc"), False)
+    page_breaks = _form_flag(fields.get("page_breaks"), True)
+    try:
+        documents = build_batch(entries)
+    except BatchRequestError as e:
+        raise HTTPException(400, str(e))
+    sources = [document.text for document in documents if document.text.strip()]
+    if not sources:
+        raise HTTPException(400, "All documents are empty")
+    if sum(len(source.encode("utf-8")) for source in sources) > settings.MERGE_MAX_INPUT_SIZE:
+        raise HTTPException(413, "Input text too large")
+
+    if settings.FIREBASE_ANALYTICS_ENABLED:
+        user_ip = request.client.host if request.client else None
+        user_agent = request.headers.get("user-agent")
+        await track_event(
+            "merge_conversion_requested",
+            {"format": format, "documents": len(sources), "text_length": sum(len(s) for s in sources), "toc": toc},
+            user_ip=user_ip,
+            user_agent=user_agent
+        )
+
+    logger.info(f"Merging {len(sources)} documents into one {format} (toc: {toc})")
+    try:
+        cache_key = None
+        if settings.RESULT_CACHE_ENABLED:
+            cache_key = conversion_cache_key("\0".join(sources), format, merge=len(sources), toc=toc, page_breaks=page_breaks)
+            data = await run_in_threadpool(result_cache.get, cache_key, format)
+            if data is not None:
+                return _docx_response(format, data=data)
+
+        data = await conversion_pool.run(run_merge_conversion, sources, format, toc, page_breaks)
+        if cache_key:
+            background_tasks.add_task(result_cache.put, cache_key, format, data)
+        return _docx_response(format, data=data)
+    except PoolSaturatedError:
+        logger.warning("Conversion pool saturated, rejecting merge request")
+        raise HTTPException(
+            503,
+            "Server is busy converting other documents. Please try again shortly.",
+            headers={"Retry-After": str(settings.CONVERT_RETRY_AFTER)},
+        )
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+        logger.error(f"Pandoc execution failed while merging {len(sources)} documents: {type(e).__name__}")
+        raise HTTPException(500, "Conversion failed due to an internal processing error.")
+
+@app.post("/api/convert/incremental", dependencies=[Depends(check_rate_limit)])
+async def convert_incremental(request: Request):
+    """
+    Convert a document that is edited and submitted again (same input as
+    /api/convert). Send the `session` field or X-Session-Id header returned by
+    the previous response and only the blocks that changed are converted again
+    """
+    text, fields = await _read_conversion_input(request)
+    format = fields.get("format", "docx")
+    if format not in settings.ALLOWED_FORMATS:
+        raise HTTPException(400, f"Format must be 'docx'. Received: {format}")
+    session_id = fields.get("session") or request.headers.get("x-session-id")
+    if session_id and not SESSION_ID_RE.match(session_id):
+        raise HTTPException(400, "Invalid session id")
+
+    try:
+        # Sessions live in this process, so the work runs here while holding a conversion pool slot
+        async with conversion_pool.slot():
+            result = await run_in_threadpool(incremental_converter.convert, session_id, text, format)
+    except PoolSaturatedError:
+        logger.warning("Conversion pool saturated, rejecting incremental conversion request")
+        raise HTTPException(
+            503,
+            "Server is busy converting other documents. Please try again shortly.",
+            headers={"Retry-After": str(settings.CONVERT_RETRY_AFTER)},
+        )
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+        logger.error(f"Pandoc execution failed during incremental conversion: {type(e).__name__}")
+        raise HTTPException(500, "Conversion failed due to an internal processing error.")
+
+    response = _docx_response(format, data=result["data"])
+    response.headers["X-Session-Id"] = result["session_id"]
+    response.headers["X-Blocks"] = str(result["blocks"])
+    response.headers["X-Blocks-Rendered"] = str(result["rendered"])
+    return response
+
+@app.delete("/api/convert/incremental/{session_id}", status_code=204)
+async def end_incremental_session(session_id: str):
+    """Drop an incremental conversion session and the blocks only it was holding"""
+    if not incremental_converter.end_session(session_id):
+        raise HTTPException(404, "Session not found")
+    return Response(status_code=204)
+
+@app.post("/api/preview", dependencies=[Depends(check_rate_limit)])
+async def preview(request: Request):
+    """
+    RTL HTML preview of Markdown (same input as /api/convert), preprocessed
+    like a conversion but without producing a DOCX
+    """
+    text, _ = await _read_conversion_input(request)
+    try:
+        result = await run_in_threadpool(preview_renderer.render, text)
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+        logger.error(f"Pandoc execution failed while rendering a preview: {type(e).__name__}")
+        raise HTTPException(500, "Preview failed due to an internal processing error.")
+    return HTMLResponse(
+        result["html"],
+        headers={"X-Blocks": str(result["blocks"]), "X-Blocks-Rendered": str(result["rendered"])},
+    )
+
+@app.websocket("/api/preview/ws")
+async def preview_socket(websocket: WebSocket):
+    """
+    Live preview channel. The client sends {"seq": n, "text": "..."} on every
+    edit; edits arriving within PREVIEW_DEBOUNCE_MS of each other are coalesced
+    and only the latest is rendered. Answers are {"seq", "html", "blocks",
+    "rendered"} or {"seq", "error"}. Every render counts against the client's
+    rate limit, and the socket is closed (1008) once it is exceeded
+    """
+    client_ip = websocket.client.host if websocket.client else "unknown"
+    if not rate_limiter.check(client_ip).allowed:
+        logger.warning(f"Rate limit exceeded for IP: {client_ip}")
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+
+    pending = {}  # latest message that has not been rendered yet
+    changed = asyncio.Event()
+
+    async def receive():
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+                text = message["text"]
+                if not isinstance(text, str):
+                    raise TypeError("text must be a string")
+            except (ValueError, KeyError, TypeError):
+                await websocket.send_json({"error": "Send {\"seq\": n, \"text\": \"...\"}"})
+                continue
+            if len(text.encode("utf-8")) > settings.MAX_INPUT_SIZE:
+                await websocket.send_json({"seq": message.get("seq"), "error": "Input is too large"})
+                continue
+            pending["message"] = message
+            changed.set()
+
+    receiver = asyncio.create_task(receive())
+    try:
+        while True:
+            waiter = asyncio.create_task(changed.wait())
+            done, _ = await asyncio.wait({receiver, waiter}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver in done:
+                waiter.cancel()
+                receiver.result()  # re-raises the disconnect
+                break
+            # Later edits replace the pending one while we wait
+            await asyncio.sleep(settings.PREVIEW_DEBOUNCE_MS / 1000)
+            changed.clear()
+            message = pending.pop("message")
+            if not rate_limiter.check(client_ip).allowed:
+                logger.warning(f"Rate limit exceeded for IP: {client_ip}")
+                await websocket.close(code=1008)
+                break
+            try:
+                result = await run_in_threadpool(preview_renderer.render, message["text"])
+            except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+                logger.error(f"Pandoc execution failed while rendering a preview: {type(e).__name__}")
+                await websocket.send_json({"seq": message.get("seq"), "error": "Preview failed"})
+                continue
+            await websocket.send_json({"seq": message.get("seq"), **result})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+
+@app.post("/api/jobs", status_code=202, dependencies=[Depends(check_rate_limit)])
+async def create_job(request: Request):
+    """Queue a conversion and return its id immediately; poll /api/jobs/{id} for the result"""
+    text, fields = await _read_conversion_input(request)
+    format = fields.get("format", "docx")
+    if format not in settings.ALLOWED_FORMATS:
+        raise HTTPException(400, f"Format must be 'docx'. Received: {format}")
+
+    if settings.FIREBASE_ANALYTICS_ENABLED:
+        user_ip = request.client.host if request.client else None
+        user_agent = request.headers.get("user-agent")
+        await track_event(
+            "job_submitted",
+            {"format": format, "text_length": len(text)},
+            user_ip=user_ip,
+            user_agent=user_agent
+        )
+
+    job = await job_manager.submit(text, format)
+    logger.info(f"Queued job {job['id']} for {format}, text length: {len(text)} chars")
+    return job_manager.describe(job)
+
+async def _get_job(job_id: str):
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(404, "Job not found")
+    return job
+
+@app.get("/api/jobs/{job_id}")
+async def job_status(job_id: str):
+    """Status and timings of a job"""
+    return job_manager.describe(await _get_job(job_id))
+
+@app.get("/api/jobs/{job_id}/result")
+async def job_result(job_id: str):
+    """Download the document produced by a finished job"""
+    job = await _get_job(job_id)
+    if job["status"] == FAILED:
+        raise HTTPException(409, f"Job failed: {job['error']}")
+    if job["status"] != DONE:
+        raise HTTPException(409, f"Job is not finished yet (status: {job['status']})")
+    path = job_manager.result_path(job)
+    if not os.path.exists(path):
+        raise HTTPException(410, "The job result has expired")
+    return _docx_response(job["format"], path=path)
+
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     logger.error(f"Unhandled exception: {exc} for request {request.method} {request.url}", exc_info=True)
@@ -201,10 +650,27 @@ async def startup_event():
     # os.makedirs(OUT_DIR, exist_ok=True) # Still good to have, or rely on validator
     initialize_firebase() # Initialize Firebase
     cleanup_old_files()
+    # Build (or pick up) the RTL reference document before the first request
+    get_reference_docx()
+    # Outputs of older versions move into the sharded layout and expire with their shard
+    migrate_flat_outputs()
+    sweeper.start()
+    # Read and precompress the homepage and static files once
+    static_bundle.load()
+    # Inputs of the result cache key, so the first request doesn't pay for them
+    pandoc_version()
+    if settings.FIREBASE_ANALYTICS_ENABLED:
+        analytics_queue.start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("Shutting down DocRight")
+    await sweeper.stop()
+    await job_manager.shutdown()
+    conversion_pool.shutdown()
+    chunk_pool.shutdown()
+    # Send (or spill) queued analytics events before the client goes away
+    await analytics_queue.stop()
     # Gracefully close the httpx client
     from .firebase_utils import client as httpx_client # Get the client instance
     await httpx_client.aclose()
\ No newline at end of file
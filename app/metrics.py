@@ -0,0 +1,50 @@
+"""
+Lightweight in-process counters and timings exposed through /api/metrics
+"""
+
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Any
+
+_lock = threading.Lock()
+_counters: Dict[str, int] = defaultdict(int)
+_timings: Dict[str, Dict[str, float]] = {}
+
+
+def increment(name: str, value: int = 1):
+    """Increase the counter `name` by `value`."""
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name: str, seconds: float):
+    """Record one duration sample (in seconds) for the timing `name`."""
+    with _lock:
+        timing = _timings.get(name)
+        if timing is None:
+            timing = _timings[name] = {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+        timing["count"] += 1
+        timing["total_seconds"] += seconds
+        timing["max_seconds"] = max(timing["max_seconds"], seconds)
+
+
+@contextmanager
+def timed(name: str):
+    """Context manager recording the duration of its body under `name`."""
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start_time)
+
+
+def snapshot() -> Dict[str, Any]:
+    """Return a copy of all counters and timings (with averages)."""
+    with _lock:
+        timings = {}
+        for name, timing in _timings.items():
+            timings[name] = dict(timing)
+            timings[name]["avg_seconds"] = timing["total_seconds"] / timing["count"] if timing["count"] else 0.0
+        return {"counters": dict(_counters), "timings": timings}
@@ -0,0 +1,305 @@
+"""
+Streaming helpers for rewriting WordprocessingML parts without building a tree.
+
+RtlXmlRewriter injects the same properties as the tree-based
+apply_rtl_to_docx implementation (<w:bidi/>, <w:keepLines/>, <w:keepNext/> and
+<w:cantSplit/>) in a single pass over word/document.xml. It only looks at the
+handful of tags it cares about and copies everything else byte-for-byte, so
+memory stays bounded by the chunk size and namespace declarations, markup
+compatibility attributes etc. are preserved exactly.
+
+The rewriter relies on the conventions of Pandoc and Word output: the
+WordprocessingML namespace is bound to the `w` prefix on the root element, the
+part is UTF-8 encoded, and paragraph/row properties are the first child of
+their paragraph/row. Documents that don't bind `w` that way raise
+UnsupportedDocumentXml so callers can fall back to the tree implementation.
+"""
+
+import copy
+import re
+import struct
+import zipfile
+from typing import List
+
+WORDML_NS = b"http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+
+# Default chunk size used when streaming ZIP members
+CHUNK_SIZE = 64 * 1024
+
+# Only tags relevant to the rewrite are matched; attribute values may contain '>'
+_TAG_RE = re.compile(
+    rb'<(/?)w:(p|pPr|pStyle|bidi|keepLines|keepNext|tr|trPr|tblPrEx|cantSplit)'
+    rb'(?=[\s/>])((?:[^>"\']|"[^"]*"|\'[^\']*\')*?)(/?)>'
+)
+# Name of the next tag after a position (used to look for pPr / trPr)
+_PEEK_RE = re.compile(rb'\s*<(/?)([^\s/>]+)[\s/>]')
+_ROOT_RE = re.compile(rb'<(?![?!])[^\s/>]+((?:[^>"\']|"[^"]*"|\'[^\']*\')*)>')
+_ENCODING_RE = re.compile(rb'<\?xml[^>]*encoding=["\']([^"\']+)["\']')
+_VAL_RE = re.compile(rb'w:val\s*=\s*["\']([^"\']*)["\']')
+
+_BIDI = b"<w:bidi/>"
+_KEEP_LINES = b"<w:keepLines/>"
+_KEEP_NEXT = b"<w:keepNext/>"
+_CANT_SPLIT = b"<w:cantSplit/>"
+
+# Returned by _peek when more input is needed to decide
+_NEED_MORE = object()
+
+
+class UnsupportedDocumentXml(Exception):
+    """The part does not follow the conventions the streaming rewriter relies on"""
+
+
+def _is_heading_or_code(style_val: bytes) -> bool:
+    # Same rule as the tree-based implementation
+    return (style_val.startswith(b'Heading') or
+            b'Code' in style_val or
+            b'Source' in style_val or
+            b'Verbatim' in style_val)
+
+
+class RtlXmlRewriter:
+    """
+    Incremental rewriter for word/document.xml.
+
+    Feed it the part in arbitrary chunks; every call returns the rewritten
+    bytes that are final so far, close() returns the remainder.
+    """
+
+    def __init__(self):
+        self._buffer = b""
+        self._root_checked = False
+        # Paragraph properties state
+        self._expect_ppr = False
+        self._ppr_depth = 0
+        self._ppr_seen = set()
+        self._ppr_style = b""
+        # Table row properties state
+        self._expect_trpr = False
+        self._after_tblprex = False
+        self._trpr_depth = 0
+        self._trpr_has_cant_split = False
+        # Statistics, matching the tree-based implementation's log line
+        self.paragraph_count = 0
+        self.row_count = 0
+
+    @property
+    def ready(self) -> bool:
+        """True once the root element has been seen and validated"""
+        return self._root_checked
+
+    def feed(self, data: bytes) -> bytes:
+        self._buffer += data
+        return self._process(final=False)
+
+    def close(self) -> bytes:
+        output = self._process(final=True)
+        if not self._root_checked:
+            raise UnsupportedDocumentXml("No root element found")
+        return output
+
+    def _check_root(self, final: bool) -> bool:
+        match = _ROOT_RE.search(self._buffer)
+        if match is None:
+            if final:
+                raise UnsupportedDocumentXml("No root element found")
+            return False
+        declaration = _ENCODING_RE.match(self._buffer)
+        if declaration and declaration.group(1).lower() not in (b"utf-8", b"utf8"):
+            raise UnsupportedDocumentXml(f"Unsupported encoding: {declaration.group(1).decode('ascii', 'replace')}")
+        if b'xmlns:w="' + WORDML_NS + b'"' not in match.group(1) and b"xmlns:w='" + WORDML_NS + b"'" not in match.group(1):
+            raise UnsupportedDocumentXml("The 'w' prefix is not bound to the WordprocessingML namespace on the root element")
+        self._root_checked = True
+        return True
+
+    def _peek(self, buf: bytes, pos: int, final: bool):
+        """Name of the next tag after `pos` ('/name' for end tags, b'' for text)"""
+        match = _PEEK_RE.match(buf, pos)
+        if match:
+            return match.group(1) + match.group(2)
+        if not final and b">" not in buf[pos:pos + 256]:
+            return _NEED_MORE
+        return b""
+
+    def _process(self, final: bool) -> bytes:
+        if not self._root_checked and not self._check_root(final):
+            return b""
+
+        buf = self._buffer
+        # Every tag that starts before the last '<' is complete
+        end = len(buf) if final else buf.rfind(b"<")
+        if end <= 0:
+            return b""
+
+        out: List[bytes] = []
+        pos = 0
+        stop = end
+        for match in _TAG_RE.finditer(buf, 0, end):
+            replacement = self._handle(match, buf, final)
+            if replacement is _NEED_MORE:
+                stop = match.start()
+                break
+            out.append(buf[pos:match.start()])
+            out.append(replacement)
+            pos = match.end()
+        out.append(buf[pos:stop])
+        self._buffer = buf[stop:]
+        return b"".join(out)
+
+    def _handle(self, match, buf: bytes, final: bool):
+        closing, name, attrs, self_closing = match.groups()
+        tag = match.group(0)
+
+        if name == b"p" and not closing:
+            if self_closing:
+                self.paragraph_count += 1
+                return b"<w:p" + attrs + b"><w:pPr>" + _BIDI + _KEEP_LINES + b"</w:pPr></w:p>"
+            next_tag = self._peek(buf, match.end(), final)
+            if next_tag is _NEED_MORE:
+                return _NEED_MORE
+            self.paragraph_count += 1
+            if next_tag == b"w:pPr":
+                self._expect_ppr = True
+                return tag
+            # No properties yet: insert them at the beginning of the paragraph
+            return tag + b"<w:pPr>" + _BIDI + _KEEP_LINES + b"</w:pPr>"
+
+        if name == b"pPr":
+            if closing:
+                if self._ppr_depth == 1:
+                    self._ppr_depth = 0
+                    return self._ppr_additions() + tag
+                if self._ppr_depth > 1:
+                    self._ppr_depth -= 1
+                return tag
+            if self._expect_ppr:
+                self._expect_ppr = False
+                self._ppr_seen = set()
+                self._ppr_style = b""
+                if self_closing:
+                    return b"<w:pPr" + attrs + b">" + self._ppr_additions() + b"</w:pPr>"
+                self._ppr_depth = 1
+            elif self._ppr_depth and not self_closing:
+                # e.g. the previous properties inside <w:pPrChange>
+                self._ppr_depth += 1
+            return tag
+
+        if self._ppr_depth == 1 and not closing:
+            if name == b"pStyle":
+                val = _VAL_RE.search(attrs)
+                self._ppr_style = val.group(1) if val else b""
+            elif name in (b"bidi", b"keepLines", b"keepNext"):
+                self._ppr_seen.add(name)
+            return tag
+
+        if name == b"tr" and not closing:
+            if self_closing:
+                self.row_count += 1
+                return b"<w:tr" + attrs + b"><w:trPr>" + _CANT_SPLIT + b"</w:trPr></w:tr>"
+            return self._row_properties_start(tag, buf, match.end(), final, is_tblprex=False)
+
+        if name == b"tblPrEx" and self._after_tblprex and (closing or self_closing):
+            return self._row_properties_start(tag, buf, match.end(), final, is_tblprex=True)
+
+        if name == b"trPr":
+            if closing:
+                if self._trpr_depth == 1:
+                    self._trpr_depth = 0
+                    if not self._trpr_has_cant_split:
+                        self.row_count += 1
+                        return _CANT_SPLIT + tag
+                elif self._trpr_depth > 1:
+                    self._trpr_depth -= 1
+                return tag
+            if self._expect_trpr:
+                self._expect_trpr = False
+                self._trpr_has_cant_split = False
+                if self_closing:
+                    self.row_count += 1
+                    return b"<w:trPr" + attrs + b">" + _CANT_SPLIT + b"</w:trPr>"
+                self._trpr_depth = 1
+            elif self._trpr_depth and not self_closing:
+                # e.g. the previous properties inside <w:trPrChange>
+                self._trpr_depth += 1
+            return tag
+
+        if name == b"cantSplit" and self._trpr_depth == 1 and not closing:
+            self._trpr_has_cant_split = True
+
+        return tag
+
+    def _row_properties_start(self, tag: bytes, buf: bytes, pos: int, final: bool, is_tblprex: bool):
+        """Decide where a row's <w:trPr> lives, right after <w:tr> or after <w:tblPrEx>"""
+        next_tag = self._peek(buf, pos, final)
+        if next_tag is _NEED_MORE:
+            return _NEED_MORE
+        self._after_tblprex = False
+        if next_tag == b"w:trPr":
+            self._expect_trpr = True
+            return tag
+        if next_tag == b"w:tblPrEx" and not is_tblprex:
+            # Row-level table property exceptions come first; trPr follows them
+            self._after_tblprex = True
+            return tag
+        self.row_count += 1
+        return tag + b"<w:trPr>" + _CANT_SPLIT + b"</w:trPr>"
+
+    def _ppr_additions(self) -> bytes:
+        additions = b""
+        if b"bidi" not in self._ppr_seen:
+            additions += _BIDI
+        if b"keepLines" not in self._ppr_seen:
+            additions += _KEEP_LINES
+        if _is_heading_or_code(self._ppr_style) and b"keepNext" not in self._ppr_seen:
+            additions += _KEEP_NEXT
+        return additions
+
+
+def rewrite_rtl_document_xml(data: bytes) -> bytes:
+    """Convenience wrapper running RtlXmlRewriter over a complete part"""
+    rewriter = RtlXmlRewriter()
+    return rewriter.feed(data) + rewriter.close()
+
+
+def copy_zip_member_raw(src: zipfile.ZipFile, dst: zipfile.ZipFile, info: zipfile.ZipInfo):
+    """
+    Copy one member from `src` to `dst` without decompressing it: the local
+    file header is rewritten and the compressed bytes are copied verbatim.
+
+    zipfile has no public API for this, so the central directory bookkeeping of
+    `dst` (filelist, NameToInfo, start_dir) is updated the same way
+    ZipFile.writestr does it.
+
+    Raises:
+        zipfile.BadZipFile: If the member's local header cannot be read
+    """
+    if info.flag_bits & 0x1:
+        raise ValueError(f"Encrypted member cannot be copied raw: {info.filename}")
+
+    src_fp = src.fp
+    src_fp.seek(info.header_offset)
+    header = src_fp.read(zipfile.sizeFileHeader)
+    if len(header) != zipfile.sizeFileHeader or header[:4] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile(f"Bad local file header for member {info.filename}")
+    fields = struct.unpack(zipfile.structFileHeader, header)
+    src_fp.seek(fields[zipfile._FH_FILENAME_LENGTH] + fields[zipfile._FH_EXTRA_FIELD_LENGTH], 1)
+
+    new_info = copy.copy(info)
+    # Sizes and CRC are known up front, so no trailing data descriptor is needed
+    new_info.flag_bits &= ~0x08
+    new_info.header_offset = dst.fp.tell()
+    zip64 = new_info.file_size > zipfile.ZIP64_LIMIT or new_info.compress_size > zipfile.ZIP64_LIMIT
+    dst.fp.write(new_info.FileHeader(zip64))
+
+    remaining = info.compress_size
+    while remaining > 0:
+        chunk = src_fp.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            raise zipfile.BadZipFile(f"Truncated data for member {info.filename}")
+        dst.fp.write(chunk)
+        remaining -= len(chunk)
+
+    dst.filelist.append(new_info)
+    dst.NameToInfo[new_info.filename] = new_info
+    dst.start_dir = dst.fp.tell()
+    dst._didModify = True
@@ -0,0 +1,253 @@
+"""
+Pool of long-lived `pandoc server` processes.
+
+Instead of fork-exec'ing pandoc (and paying Haskell runtime startup plus argument
+parsing) for every document, conversions are POSTed as JSON to local pandoc
+server processes. Servers are health-checked, restarted when they crash and
+recycled after a configurable number of jobs. Callers fall back to the
+subprocess path whenever PandocServerError is raised.
+"""
+
+import atexit
+import base64
+import json
+import logging
+import os
+import queue
+import socket
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, Optional
+
+from . import metrics
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Seconds a server may take to answer its first health check after start
+STARTUP_TIMEOUT = 10
+# Re-check an idle server's health when it has not been used for this long
+HEALTHCHECK_INTERVAL = 30
+# After a failed start, don't try to start servers again for this long
+START_FAILURE_BACKOFF = 60
+
+
+class PandocServerError(Exception):
+    """The pandoc server pool could not serve a conversion"""
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class PandocServerProcess:
+    """A single `pandoc server` process listening on a localhost port"""
+
+    def __init__(self, executable: str = "pandoc", timeout: int = 120):
+        self.executable = executable
+        self.timeout = timeout
+        self.port: Optional[int] = None
+        self.process: Optional[subprocess.Popen] = None
+        self.jobs = 0
+        self.last_checked = 0.0
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        """Start the server and wait until it answers health checks"""
+        # Works across several uvicorn workers: every process picks its own ports
+        self.port = _free_port()
+        cmd = [self.executable, "server", "--port", str(self.port), "--timeout", str(self.timeout)]
+        logger.info(f"Starting pandoc server: \"{' '.join(cmd)}\"")
+        try:
+            self.process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except OSError as e:
+            raise PandocServerError(f"Could not start pandoc server: {e}") from e
+        self.jobs = 0
+
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if not self.alive():
+                raise PandocServerError(f"pandoc server exited with code {self.process.returncode} during startup")
+            if self.healthy():
+                metrics.increment("pandoc_server.starts")
+                return
+            time.sleep(0.1)
+        self.stop()
+        raise PandocServerError(f"pandoc server on port {self.port} did not become healthy within {STARTUP_TIMEOUT}s")
+
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def healthy(self) -> bool:
+        """GET /version must answer 200"""
+        try:
+            with urllib.request.urlopen(f"{self.url}/version", timeout=2) as response:
+                ok = response.status == 200
+        except (urllib.error.URLError, OSError):
+            ok = False
+        if ok:
+            self.last_checked = time.monotonic()
+        return ok
+
+    def convert(self, payload: Dict) -> bytes:
+        """
+        Send one conversion request and return the (binary) output.
+
+        Raises:
+            PandocServerError: On connection problems or conversion errors
+        """
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json", "Accept": "application/json"},
+            method="POST",
+        )
+        try:
+            # Leave a margin over the server-side timeout so the server reports it first
+            with urllib.request.urlopen(request, timeout=self.timeout + 5) as response:
+                result = json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            detail = e.read().decode("utf-8", errors="replace").strip()
+            raise PandocServerError(f"pandoc server returned HTTP {e.code}: {detail or '<empty>'}") from e
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            raise PandocServerError(f"pandoc server request failed: {e}") from e
+        finally:
+            self.jobs += 1
+
+        if result.get("error"):
+            raise PandocServerError(f"pandoc server conversion error: {result['error']}")
+        for message in result.get("messages") or []:
+            logger.warning(f"Pandoc server message: {message}")
+        self.last_checked = time.monotonic()
+
+        output = result.get("output", "")
+        if result.get("base64"):
+            return base64.b64decode(output)
+        return output.encode("utf-8")
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+
+
+class PandocServerPool:
+    """
+    Fixed-size pool of pandoc server processes shared by the conversion threads.
+    Servers are started lazily on first use.
+    """
+
+    def __init__(self, size: int = 2, max_jobs: int = 500, timeout: int = 120, executable: str = "pandoc"):
+        self.size = max(1, size)
+        self.max_jobs = max_jobs
+        self.timeout = timeout
+        self.executable = executable
+        self._idle: "queue.Queue[PandocServerProcess]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+        self._unavailable_until = 0.0
+        # base64-encoded auxiliary files (e.g. the reference docx), encoded once per path
+        self._encoded_files: Dict[str, tuple] = {}
+
+    def available(self) -> bool:
+        return time.monotonic() >= self._unavailable_until
+
+    def _ensure_started(self):
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            for _ in range(self.size):
+                self._idle.put(PandocServerProcess(self.executable, self.timeout))
+            self._started = True
+
+    def _prepare(self, server: PandocServerProcess):
+        """Make sure a checked-out server is running, healthy and not due for recycling"""
+        if server.alive() and server.jobs >= self.max_jobs > 0:
+            logger.info(f"Recycling pandoc server on port {server.port} after {server.jobs} jobs")
+            metrics.increment("pandoc_server.recycles")
+            server.stop()
+        elif server.alive() and time.monotonic() - server.last_checked > HEALTHCHECK_INTERVAL and not server.healthy():
+            logger.warning(f"pandoc server on port {server.port} failed its health check, restarting")
+            metrics.increment("pandoc_server.restarts")
+            server.stop()
+        elif server.process is not None and not server.alive():
+            logger.warning(f"pandoc server on port {server.port} exited with code {server.process.returncode}, restarting")
+            metrics.increment("pandoc_server.restarts")
+            server.process = None
+
+        if not server.alive():
+            try:
+                server.start()
+            except PandocServerError:
+                self._unavailable_until = time.monotonic() + START_FAILURE_BACKOFF
+                metrics.increment("pandoc_server.start_failures")
+                raise
+
+    def encoded_file(self, path: str) -> str:
+        """base64 content of `path`, cached until the file changes"""
+        mtime = os.path.getmtime(path)
+        cached = self._encoded_files.get(path)
+        if cached is None or cached[0] != mtime:
+            with open(path, "rb") as f:
+                cached = (mtime, base64.b64encode(f.read()).decode("ascii"))
+            self._encoded_files[path] = cached
+        return cached[1]
+
+    def convert(self, payload: Dict) -> bytes:
+        """
+        Convert with the next free server.
+
+        Raises:
+            PandocServerError: If no server is available or the conversion failed
+        """
+        if not self.available():
+            raise PandocServerError("pandoc server pool is temporarily unavailable")
+        self._ensure_started()
+        try:
+            server = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PandocServerError("Timed out waiting for a free pandoc server")
+
+        try:
+            self._prepare(server)
+            with metrics.timed("pandoc_server.convert"):
+                return server.convert(payload)
+        except PandocServerError:
+            # A crashed server is restarted on its next checkout
+            if server.process is not None and not server.alive():
+                metrics.increment("pandoc_server.crashes")
+            raise
+        finally:
+            self._idle.put(server)
+
+    def shutdown(self):
+        while True:
+            try:
+                server = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            server.stop()
+        self._started = False
+
+
+# Global pool, only used when PANDOC_SERVER_ENABLED is set
+pandoc_server_pool = PandocServerPool(
+    size=settings.PANDOC_SERVER_POOL_SIZE,
+    max_jobs=settings.PANDOC_SERVER_MAX_JOBS,
+    timeout=settings.PANDOC_SERVER_TIMEOUT,
+)
+atexit.register(pandoc_server_pool.shutdown)
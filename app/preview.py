@@ -0,0 +1,109 @@
+"""
+Live HTML preview: Markdown is preprocessed the same way as for a conversion
+and rendered to HTML by Pandoc inside a `dir="rtl"` container, so the editor
+can show what the DOCX will contain without producing one.
+
+Documents are split into blocks at their headings (see split_blocks). The HTML
+of every block is cached under a hash of its text, so an update renders only
+the blocks that changed, all of them in a single Pandoc run. Previews never go
+through the conversion pool, which stays reserved for DOCX exports.
+"""
+
+import hashlib
+import logging
+import subprocess
+import threading
+from typing import List
+
+from . import metrics
+from .config import settings, PANDOC_SERVER_ENABLED
+from .incremental import split_blocks
+from .pandoc_server import pandoc_server_pool, PandocServerError
+from .utils.memo import ByteBudgetLRU
+from .utils.text_processor import preprocess_farsi_text
+
+logger = logging.getLogger(__name__)
+
+# Raw HTML comment placed between blocks rendered together; Pandoc copies it to the output
+PREVIEW_BLOCK_MARKER = "<!-- docright-preview-block -->"
+
+
+def _pandoc_html(markdown_text: str, timeout: int) -> str:
+    """HTML fragment for `markdown_text`, from the pandoc server when it is available"""
+    if PANDOC_SERVER_ENABLED and pandoc_server_pool.available():
+        try:
+            with metrics.timed("preview.pandoc"):
+                output = pandoc_server_pool.convert({
+                    "text": markdown_text,
+                    "from": "markdown",
+                    "to": "html5",
+                    "wrap": "preserve",
+                })
+            return output.decode("utf-8")
+        except PandocServerError as e:
+            logger.warning(f"pandoc server preview failed, falling back to a pandoc subprocess: {e}")
+            metrics.increment("pandoc_server.fallbacks")
+
+    cmd = ["pandoc", "--from=markdown", "--to=html5", "--wrap=preserve"]
+    with metrics.timed("preview.pandoc"):
+        result = subprocess.run(
+            cmd,
+            input=markdown_text.encode("utf-8"),
+            check=True,
+            timeout=timeout,
+            capture_output=True,
+        )
+    return result.stdout.decode("utf-8")
+
+
+class PreviewRenderer:
+    """Renders previews, reusing the HTML of blocks that did not change"""
+
+    def __init__(self, cache_bytes: int, concurrency: int):
+        self.blocks = ByteBudgetLRU(cache_bytes, name="preview_blocks")
+        # Bounds the Pandoc processes started for previews
+        self._slots = threading.BoundedSemaphore(max(1, concurrency))
+
+    def render(self, text: str, timeout: int = settings.PREVIEW_TIMEOUT) -> dict:
+        """
+        Preview HTML for `text`. Blocking; run it on a thread.
+
+        Returns:
+            {"html", "blocks", "rendered"}
+        """
+        blocks = split_blocks(text)
+        keys = [hashlib.sha256(block.encode("utf-8")).hexdigest() for block in blocks]
+        html = {key: self.blocks.get(key) for key in set(keys)}
+        missing = {key: block for key, block in zip(keys, blocks) if html[key] is None}
+        if missing:
+            with self._slots, metrics.timed("preview.render"):
+                rendered = self._render_blocks(list(missing.values()), timeout)
+            for key, fragment in zip(missing, rendered):
+                html[key] = fragment
+                self.blocks.put(key, fragment)
+        metrics.increment("preview.blocks_rendered", len(missing))
+        metrics.increment("preview.blocks_reused", len(html) - len(missing))
+        body = "\n".join(html[key] for key in keys)
+        return {"html": f'<div dir="rtl" lang="fa">\n{body}\n</div>', "blocks": len(keys), "rendered": len(missing)}
+
+    @staticmethod
+    def _render_blocks(blocks: List[str], timeout: int) -> List[str]:
+        """HTML of each block, rendered in one Pandoc run when the markers survive"""
+        processed = [preprocess_farsi_text(block, memoize=False) for block in blocks]
+        if len(processed) == 1:
+            return [_pandoc_html(processed[0], timeout).strip()]
+
+        output = _pandoc_html(f"\n\n{PREVIEW_BLOCK_MARKER}\n\n".join(processed), timeout)
+        parts = output.split(PREVIEW_BLOCK_MARKER)
+        if len(parts) == len(processed):
+            return [part.strip() for part in parts]
+        # A block left something open (e.g. an unterminated HTML element) that swallowed a marker
+        logger.info("Preview block markers were not preserved, rendering blocks one by one")
+        metrics.increment("preview.marker_fallbacks")
+        return [_pandoc_html(block, timeout).strip() for block in processed]
+
+    def stats(self) -> dict:
+        return {"blocks": self.blocks.stats()}
+
+
+preview_renderer = PreviewRenderer(settings.PREVIEW_CACHE_BYTES, settings.PREVIEW_CONCURRENCY)
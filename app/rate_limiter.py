@@ -0,0 +1,282 @@
+"""
+Sliding-window-counter rate limiter with a fixed amount of state per client.
+
+Each key keeps the request counts of the current and the previous window; the
+number of requests in the last `window` seconds is estimated by weighting the
+previous count with the part of it that still overlaps. Backends:
+
+- "memory": per-process dict (each uvicorn worker enforces its own limit)
+- "sqlite": a SQLite file shared by the worker processes of one host, kept in
+  /dev/shm when available so it never touches the disk
+- "redis": any Redis-compatible server (needs the optional `redis` package)
+"""
+
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from . import metrics
+from .config import settings, OUT_DIR
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RateLimitResult:
+    """Outcome of one rate limit check, as reported in the X-RateLimit-* headers"""
+    allowed: bool
+    limit: int
+    remaining: int
+    reset_after: float
+
+    def headers(self) -> Dict[str, str]:
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(math.ceil(self.reset_after)),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(max(1, math.ceil(self.reset_after)))
+        return headers
+
+
+def sliding_window_check(previous: int, current: int, elapsed_fraction: float, limit: int) -> Tuple[bool, int]:
+    """
+    Decide a request given the counts of the previous and current window.
+    Returns whether it is allowed and how many requests remain afterwards.
+    """
+    estimated = previous * (1.0 - elapsed_fraction) + current
+    if estimated + 1 > limit:
+        return False, 0
+    return True, max(0, int(limit - estimated - 1))
+
+
+class RateLimitBackend(ABC):
+    """Storage of the per-key window counters"""
+
+    @abstractmethod
+    def hit(self, key: str, limit: int, window: float) -> RateLimitResult:
+        """Count a request from `key` if it is within `limit` per `window` seconds"""
+
+
+def _window_position(window: float) -> Tuple[int, float, float]:
+    """Index of the current window, the elapsed fraction of it and the seconds until it ends"""
+    now = time.time()
+    index = int(now // window)
+    elapsed = now - index * window
+    return index, elapsed / window, window - elapsed
+
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    """Counters in a dict; idle keys are evicted once per window"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> [window index, previous count, current count]
+        self._counters: Dict[str, List[int]] = {}
+        self._last_sweep = 0
+
+    def hit(self, key, limit, window):
+        index, fraction, reset_after = _window_position(window)
+        with self._lock:
+            if index != self._last_sweep:
+                self._sweep(index)
+            counter = self._counters.get(key)
+            if counter is None:
+                counter = self._counters[key] = [index, 0, 0]
+            elif counter[0] != index:
+                # Roll over: the old current window becomes the previous one only if adjacent
+                counter[1] = counter[2] if counter[0] == index - 1 else 0
+                counter[0], counter[2] = index, 0
+            allowed, remaining = sliding_window_check(counter[1], counter[2], fraction, limit)
+            if allowed:
+                counter[2] += 1
+        return RateLimitResult(allowed, limit, remaining, reset_after)
+
+    def _sweep(self, index: int):
+        """Drop keys without requests in the current or previous window (caller holds the lock)"""
+        idle = [key for key, counter in self._counters.items() if counter[0] < index - 1]
+        for key in idle:
+            del self._counters[key]
+        self._last_sweep = index
+        if idle:
+            metrics.increment("rate_limit.evicted_keys", len(idle))
+
+    def __len__(self):
+        return len(self._counters)
+
+
+class SqliteRateLimitBackend(RateLimitBackend):
+    """Counters in a SQLite database shared by the worker processes of one host"""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limits "
+            "(key TEXT PRIMARY KEY, window INTEGER NOT NULL, previous INTEGER NOT NULL, current INTEGER NOT NULL)"
+        )
+        self._last_sweep = 0
+
+    def hit(self, key, limit, window):
+        index, fraction, reset_after = _window_position(window)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if index != self._last_sweep:
+                    self._conn.execute("DELETE FROM rate_limits WHERE window < ?", (index - 1,))
+                    self._last_sweep = index
+                row = self._conn.execute(
+                    "SELECT window, previous, current FROM rate_limits WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    previous, current = 0, 0
+                elif row[0] != index:
+                    previous, current = (row[2] if row[0] == index - 1 else 0), 0
+                else:
+                    previous, current = row[1], row[2]
+                allowed, remaining = sliding_window_check(previous, current, fraction, limit)
+                if allowed:
+                    current += 1
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO rate_limits (key, window, previous, current) VALUES (?, ?, ?, ?)",
+                    (key, index, previous, current),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return RateLimitResult(allowed, limit, remaining, reset_after)
+
+
+# sliding_window_check plus the increment in one atomic step, so concurrent
+# workers cannot all read the same count and all be allowed.
+# KEYS: previous, current window key; ARGV: elapsed fraction, limit, expiry seconds
+_REDIS_HIT_SCRIPT = """
+local previous = tonumber(redis.call("GET", KEYS[1]) or "0")
+local current = tonumber(redis.call("GET", KEYS[2]) or "0")
+local limit = tonumber(ARGV[2])
+local estimated = previous * (1 - tonumber(ARGV[1])) + current
+if estimated + 1 > limit then
+    return {0, 0}
+end
+redis.call("INCR", KEYS[2])
+redis.call("EXPIRE", KEYS[2], ARGV[3])
+return {1, math.max(0, math.floor(limit - estimated - 1))}
+"""
+
+
+class RedisRateLimitBackend(RateLimitBackend):
+    """Counters in a Redis-compatible server, one key per client and window"""
+
+    def __init__(self, url: str, prefix: str = "docright:ratelimit:"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis requires the 'redis' package (pip install redis)")
+        self._redis = redis.Redis.from_url(url)
+        self._hit_script = self._redis.register_script(_REDIS_HIT_SCRIPT)
+        self.prefix = prefix
+
+    def hit(self, key, limit, window):
+        index, fraction, reset_after = _window_position(window)
+        # Keys expire on their own once they can no longer affect a decision
+        allowed, remaining = self._hit_script(
+            keys=[f"{self.prefix}{key}:{index - 1}", f"{self.prefix}{key}:{index}"],
+            args=[repr(fraction), limit, int(math.ceil(window * 2))],
+        )
+        return RateLimitResult(bool(allowed), limit, int(remaining), reset_after)
+
+
+def default_sqlite_path() -> str:
+    shm = "/dev/shm"
+    if os.path.isdir(shm) and os.access(shm, os.W_OK):
+        return os.path.join(shm, "docright-ratelimit.sqlite3")
+    # In a subdirectory, so file cleanup in OUT_DIR never touches it
+    return os.path.join(OUT_DIR, "ratelimit", "ratelimit.sqlite3")
+
+
+def create_rate_limit_backend(backend: str) -> RateLimitBackend:
+    """Rate limit backend for the RATE_LIMIT_BACKEND setting"""
+    if backend == "memory":
+        return MemoryRateLimitBackend()
+    if backend == "sqlite":
+        return SqliteRateLimitBackend(settings.RATE_LIMIT_SQLITE_PATH or default_sqlite_path())
+    if backend == "redis":
+        return RedisRateLimitBackend(settings.RATE_LIMIT_REDIS_URL)
+    raise ValueError(f"Unsupported rate limit backend: '{backend}'. Use 'memory', 'sqlite' or 'redis'.")
+
+
+class RateLimiter:
+    """Applies `limit` requests per `window` seconds per client key"""
+
+    def __init__(self, limit: int = settings.RATE_LIMIT, window: float = settings.RATE_LIMIT_WINDOW,
+                 backend: Optional[RateLimitBackend] = None):
+        self.limit = limit
+        self.window = window
+        self._backend = backend
+
+    @property
+    def backend(self) -> RateLimitBackend:
+        if self._backend is None:
+            self._backend = create_rate_limit_backend(settings.RATE_LIMIT_BACKEND)
+        return self._backend
+
+    def check(self, key: str) -> RateLimitResult:
+        """Count a request from `key` and report whether it is within the limit"""
+        try:
+            result = self.backend.hit(key, self.limit, self.window)
+        except Exception as e:
+            # A broken shared store must not take the API down with it
+            logger.error(f"Rate limit backend failed, allowing request: {e}")
+            metrics.increment("rate_limit.backend_errors")
+            return RateLimitResult(True, self.limit, self.limit, self.window)
+        if not result.allowed:
+            metrics.increment("rate_limit.rejected")
+        return result
+
+    def is_rate_limited(self, key: str) -> bool:
+        return not self.check(key).allowed
+
+
+class RateLimitHeadersMiddleware:
+    """
+    Adds the X-RateLimit-* headers of the check stored in request.state to the
+    response (endpoints may return Response objects, which bypass dependency headers)
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                result = scope.get("state", {}).get("rate_limit")
+                if result is not None and result.allowed:
+                    headers = list(message.get("headers", []))
+                    headers.extend(
+                        (name.lower().encode("latin-1"), value.encode("latin-1"))
+                        for name, value in result.headers().items()
+                    )
+                    message["headers"] = headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+
+# Global limiter used by the API endpoints
+rate_limiter = RateLimiter()
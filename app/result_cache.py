@@ -0,0 +1,219 @@
+"""
+Content-addressed cache of finished conversions.
+
+Results are stored under OUT_DIR/cache as <key>.<format>, where the key is a
+hash of everything that determines the output (see converter.conversion_cache_key).
+The disk tier is a size-bounded LRU; an optional in-memory tier keeps the most
+recently used results in RAM. Entries expire after a TTL.
+
+Each process keeps its own index of the disk tier. Entries written by other
+workers sharing the directory are picked up on lookup, so the size bound is
+enforced per process and may be exceeded briefly across several workers.
+"""
+
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from . import metrics
+from .config import settings, OUT_DIR
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """Disk LRU with an optional memory tier in front of it"""
+
+    def __init__(self, directory: str, max_bytes: int, ttl_seconds: float, memory_max_bytes: int = 0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.memory_max_bytes = memory_max_bytes
+        self._lock = threading.Lock()
+        # key -> (size, created); ordered from least to most recently used
+        self._disk: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self._disk_bytes = 0
+        # key -> (data, created)
+        self._memory: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self._memory_bytes = 0
+        self._loaded = False
+
+    def _path(self, key: str, fmt: str) -> str:
+        return os.path.join(self.directory, f"{key}.{fmt}")
+
+    def _load(self):
+        """Index the entries already on disk, oldest first"""
+        if self._loaded:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.startswith("."):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for mtime, name, size in sorted(entries):
+            self._disk[name] = (size, mtime)
+            self._disk_bytes += size
+        self._loaded = True
+        logger.info(f"Result cache: {len(self._disk)} entries ({self._disk_bytes} bytes) in '{self.directory}'")
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl_seconds > 0 and time.time() - created > self.ttl_seconds
+
+    def get(self, key: str, fmt: str) -> Optional[bytes]:
+        """Cached result for `key`, or None"""
+        name = f"{key}.{fmt}"
+        with self._lock:
+            cached = self._memory.get(name)
+            if cached is not None:
+                if not self._expired(cached[1]):
+                    self._memory.move_to_end(name)
+                    metrics.increment("result_cache.hits")
+                    metrics.increment("result_cache.memory_hits")
+                    return cached[0]
+                self._drop_memory(name)
+
+        path = self.get_path(key, fmt)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            metrics.increment("result_cache.misses")
+            return None
+        with self._lock:
+            created = self._disk.get(name, (0, time.time()))[1]
+            self._remember(name, data, created)
+        return data
+
+    def get_path(self, key: str, fmt: str) -> Optional[str]:
+        """Path of the cached result on disk, or None (counts a hit or a miss)"""
+        name = f"{key}.{fmt}"
+        path = self._path(key, fmt)
+        with self._lock:
+            self._load()
+            entry = self._disk.get(name)
+            # The file may also have been written, evicted or expired by another worker process
+            try:
+                stat = os.stat(path)
+            except OSError:
+                stat = None
+            if stat is None and entry is not None:
+                self._drop_disk(name)
+                metrics.increment("result_cache.stale")
+                entry = None
+            elif stat is not None and entry is None:
+                entry = (stat.st_size, stat.st_mtime)
+                self._disk[name] = entry
+                self._disk_bytes += entry[0]
+            if entry is None:
+                metrics.increment("result_cache.misses")
+                return None
+            if self._expired(entry[1]):
+                self._drop_disk(name)
+                metrics.increment("result_cache.expired")
+                metrics.increment("result_cache.misses")
+                return None
+            self._disk.move_to_end(name)
+        metrics.increment("result_cache.hits")
+        return path
+
+    def put(self, key: str, fmt: str, data: bytes):
+        """Store a finished result"""
+        name = f"{key}.{fmt}"
+        with self._lock:
+            self._load()
+            if name in self._disk:
+                return
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".", suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key, fmt))
+        except OSError as e:
+            logger.warning(f"Could not store result cache entry {name}: {e}")
+            return
+        now = time.time()
+        with self._lock:
+            if name not in self._disk:
+                self._disk[name] = (len(data), now)
+                self._disk_bytes += len(data)
+            self._remember(name, data, now)
+            while self._disk_bytes > self.max_bytes and len(self._disk) > 1:
+                oldest = next(iter(self._disk))
+                self._drop_disk(oldest)
+                metrics.increment("result_cache.evictions")
+        metrics.increment("result_cache.stores")
+
+    def put_file(self, key: str, fmt: str, path: str):
+        """Store a finished result that is already written to `path`"""
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError as e:
+            logger.warning(f"Could not read '{path}' for the result cache: {e}")
+            return
+        self.put(key, fmt, data)
+
+    def _remember(self, name: str, data: bytes, created: float):
+        """Keep `data` in the memory tier (caller holds the lock)"""
+        if len(data) > self.memory_max_bytes:
+            return
+        if name in self._memory:
+            self._memory.move_to_end(name)
+            return
+        self._memory[name] = (data, created)
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.memory_max_bytes:
+            self._drop_memory(next(iter(self._memory)))
+
+    def _drop_memory(self, name: str):
+        data, _ = self._memory.pop(name)
+        self._memory_bytes -= len(data)
+
+    def _drop_disk(self, name: str):
+        size, _ = self._disk.pop(name)
+        self._disk_bytes -= size
+        if name in self._memory:
+            self._drop_memory(name)
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass
+
+    def purge_expired(self) -> int:
+        """Remove expired entries, returns how many were removed"""
+        with self._lock:
+            self._load()
+            expired = [name for name, (_, created) in self._disk.items() if self._expired(created)]
+            for name in expired:
+                self._drop_disk(name)
+        if expired:
+            metrics.increment("result_cache.expired", len(expired))
+            logger.info(f"Result cache: removed {len(expired)} expired entries")
+        return len(expired)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._disk),
+                "bytes": self._disk_bytes,
+                "max_bytes": self.max_bytes,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "memory_max_bytes": self.memory_max_bytes,
+            }
+
+
+# Global cache used by the API endpoints
+result_cache = ResultCache(
+    directory=os.path.join(OUT_DIR, "cache"),
+    max_bytes=settings.RESULT_CACHE_MAX_BYTES,
+    ttl_seconds=settings.RESULT_CACHE_TTL_HOURS * 3600,
+    memory_max_bytes=settings.RESULT_CACHE_MEMORY_BYTES,
+)
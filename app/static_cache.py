@@ -0,0 +1,199 @@
+"""
+In-memory static bundle: the homepage and every file under static/ are read
+once, precompressed (gzip, and brotli when the optional `brotli` package is
+installed) and served with strong ETags, one per content-coding.
+
+Each asset is also reachable under a content-hashed name
+(/static/icon.3f2a9c1b.svg) that can be cached forever; references to
+/static/... in index.html are rewritten to those names. In DEBUG mode files
+are reloaded when they change on disk.
+"""
+
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional, Set
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Media types worth compressing; fonts and images are already compressed
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml", "application/xml")
+# Hashed URLs never change content, unhashed ones are revalidated with the ETag
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+
+ENCODING_ETAG_SUFFIXES = {"gzip": "gz", "br": "br"}
+
+_STATIC_URL_RE = re.compile(r"/static/([\w\-./]+)")
+
+
+@dataclass
+class StaticAsset:
+    """One file held in memory, with its precompressed variants"""
+    name: str
+    media_type: str
+    content: bytes
+    etag: str
+    mtime: float
+    gzip: Optional[bytes] = None
+    brotli: Optional[bytes] = None
+
+    @property
+    def hashed_name(self) -> str:
+        stem, ext = os.path.splitext(self.name)
+        return f"{stem}.{self.etag.strip(chr(34))[:12]}{ext}"
+
+    def etag_for(self, encoding: Optional[str]) -> str:
+        """Strong ETag of one representation; each content-coding has its own"""
+        if encoding is None:
+            return self.etag
+        suffix = ENCODING_ETAG_SUFFIXES[encoding]
+        return f'{self.etag[:-1]}-{suffix}"'
+
+    @property
+    def etags(self) -> Set[str]:
+        """ETags of every representation of this asset"""
+        tags = {self.etag}
+        if self.gzip is not None:
+            tags.add(self.etag_for("gzip"))
+        if self.brotli is not None:
+            tags.add(self.etag_for("br"))
+        return tags
+
+    def variant(self, accept_encoding: str):
+        """Body and Content-Encoding for the client's Accept-Encoding header"""
+        accepted = {part.split(";")[0].strip() for part in accept_encoding.lower().split(",")}
+        if self.brotli is not None and "br" in accepted:
+            return self.brotli, "br"
+        if self.gzip is not None and "gzip" in accepted:
+            return self.gzip, "gzip"
+        return self.content, None
+
+
+def _media_type(name: str) -> str:
+    media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    if media_type.startswith("text/") or media_type == "application/javascript":
+        media_type += "; charset=utf-8"
+    return media_type
+
+
+def build_asset(name: str, content: bytes, mtime: float = 0.0) -> StaticAsset:
+    """Hash and precompress `content`"""
+    media_type = _media_type(name)
+    asset = StaticAsset(
+        name=name,
+        media_type=media_type,
+        content=content,
+        etag='"' + hashlib.sha256(content).hexdigest()[:32] + '"',
+        mtime=mtime,
+    )
+    if media_type.startswith(COMPRESSIBLE_TYPES) and len(content) > 256:
+        compressed = gzip.compress(content, compresslevel=9, mtime=0)
+        if len(compressed) < len(content):
+            asset.gzip = compressed
+        if brotli is not None:
+            compressed = brotli.compress(content, quality=11)
+            if len(compressed) < len(content):
+                asset.brotli = compressed
+    return asset
+
+
+class StaticBundle:
+    """Every file of a directory, plus the homepage with hashed asset URLs"""
+
+    def __init__(self, directory: Path, homepage: str = "index.html", reload: bool = False):
+        self.directory = Path(directory)
+        self.homepage_name = homepage
+        self.reload = reload
+        self._lock = threading.Lock()
+        self._assets: Dict[str, StaticAsset] = {}
+        self._hashed: Dict[str, StaticAsset] = {}
+        self._homepage: Optional[StaticAsset] = None
+        self._loaded = False
+
+    def load(self):
+        """Read and compress every file (again)"""
+        assets = {}
+        if self.directory.is_dir():
+            for path in sorted(self.directory.rglob("*")):
+                if path.is_file() and not path.name.startswith("."):
+                    name = path.relative_to(self.directory).as_posix()
+                    assets[name] = build_asset(name, path.read_bytes(), path.stat().st_mtime)
+        else:
+            logger.error(f"Static directory not found at: {self.directory}")
+        with self._lock:
+            self._assets = assets
+            self._hashed = {asset.hashed_name: asset for asset in assets.values()}
+            self._homepage = self._build_homepage()
+            self._loaded = True
+        total = sum(len(asset.content) for asset in assets.values())
+        logger.info(f"Loaded {len(assets)} static files ({total} bytes) into memory")
+
+    def _build_homepage(self) -> Optional[StaticAsset]:
+        """index.html with /static/... references pointing at the hashed names (caller holds the lock)"""
+        page = self._assets.get(self.homepage_name)
+        if page is None:
+            return None
+
+        def hashed_url(match):
+            asset = self._assets.get(match.group(1))
+            return f"/static/{asset.hashed_name}" if asset is not None else match.group(0)
+
+        html = _STATIC_URL_RE.sub(hashed_url, page.content.decode("utf-8"))
+        return build_asset(self.homepage_name, html.encode("utf-8"), page.mtime)
+
+    def _changed(self) -> bool:
+        for name, asset in self._assets.items():
+            try:
+                if (self.directory / name).stat().st_mtime != asset.mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def _ensure_loaded(self):
+        if not self._loaded or (self.reload and self._changed()):
+            self.load()
+
+    def homepage(self) -> Optional[StaticAsset]:
+        self._ensure_loaded()
+        return self._homepage
+
+    def get(self, name: str) -> Optional[StaticAsset]:
+        """Asset by plain or content-hashed name"""
+        self._ensure_loaded()
+        return self._assets.get(name) or self._hashed.get(name)
+
+    def is_hashed(self, name: str) -> bool:
+        return name in self._hashed and name not in self._assets
+
+
+def asset_response_headers(asset: StaticAsset, cache_control: str, encoding: Optional[str]) -> Dict[str, str]:
+    headers = {"ETag": asset.etag_for(encoding), "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return headers
+
+
+def not_modified(asset: StaticAsset, if_none_match: Optional[str]) -> bool:
+    """Whether the client's If-None-Match already names this version, in any content-coding"""
+    if not if_none_match:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    hit = "*" in tags or not tags.isdisjoint(asset.etags)
+    if hit:
+        metrics.increment("static.not_modified")
+    return hit
@@ -0,0 +1,92 @@
+"""
+Sharded layout for conversion files in OUT_DIR:
+
+    OUT_DIR/shards/<YYYYMMDDHH>/<uid[:2]>/<uid>.<ext>
+
+Files are grouped by the UTC hour they were created in, so expiry removes a
+whole hour with one rmtree, and by uuid prefix, so no directory grows past a
+few hundred entries. Flat <uid>.<ext> files from older versions are moved into
+their shard (by modification time) at startup.
+"""
+
+import calendar
+import logging
+import os
+import re
+import shutil
+import time
+from typing import Optional
+
+from .config import OUT_DIR
+
+logger = logging.getLogger(__name__)
+
+SHARD_ROOT = os.path.join(OUT_DIR, "shards")
+SHARD_HOUR_FORMAT = "%Y%m%d%H"
+
+_HOUR_RE = re.compile(r"^\d{10}$")
+_FLAT_OUTPUT_RE = re.compile(r"^([0-9a-f]{32})\.[\w.]+$")
+
+
+def shard_dir(uid: str, created: Optional[float] = None, root: str = SHARD_ROOT) -> str:
+    """Directory holding the files of `uid` created at `created` (default: now)"""
+    hour = time.strftime(SHARD_HOUR_FORMAT, time.gmtime(created))
+    return os.path.join(root, hour, uid[:2])
+
+
+def output_path(uid: str, ext: str, created: Optional[float] = None, root: str = SHARD_ROOT,
+                create: bool = True) -> str:
+    """Path for a new `<uid>.<ext>` file; its shard directory is created unless `create` is False"""
+    directory = shard_dir(uid, created, root)
+    if create:
+        os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{uid}.{ext}")
+
+
+def _hour_start(name: str) -> Optional[float]:
+    if not _HOUR_RE.match(name):
+        return None
+    try:
+        return float(calendar.timegm(time.strptime(name, SHARD_HOUR_FORMAT)))
+    except ValueError:
+        return None
+
+
+def drop_expired_shards(max_age_seconds: float, root: str = SHARD_ROOT, now: Optional[float] = None) -> int:
+    """Remove every hour shard whose newest possible file is older than `max_age_seconds`"""
+    if not os.path.isdir(root):
+        return 0
+    cutoff = (time.time() if now is None else now) - max_age_seconds
+    count = 0
+    for entry in os.scandir(root):
+        start = _hour_start(entry.name)
+        if entry.is_dir() and start is not None and start + 3600 <= cutoff:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            count += 1
+    if count:
+        logger.info(f"Removed {count} expired output shard(s) from '{root}'")
+    return count
+
+
+def migrate_flat_outputs(directory: str = OUT_DIR, root: str = SHARD_ROOT) -> int:
+    """Move flat `<uid>.<ext>` files of `directory` into their shards (by mtime)"""
+    count = 0
+    try:
+        entries = list(os.scandir(directory))
+    except OSError as e:
+        logger.error(f"Could not scan '{directory}' for flat outputs: {e}")
+        return 0
+    for entry in entries:
+        match = _FLAT_OUTPUT_RE.match(entry.name)
+        if not match or not entry.is_file():
+            continue
+        try:
+            target = os.path.join(shard_dir(match.group(1), entry.stat().st_mtime, root), entry.name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(entry.path, target)
+            count += 1
+        except OSError as e:
+            logger.warning(f"Could not move '{entry.path}' into its shard: {e}")
+    if count:
+        logger.info(f"Moved {count} flat output file(s) from '{directory}' into shards")
+    return count
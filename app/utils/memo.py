@@ -0,0 +1,59 @@
+"""
+Thread-safe LRU cache bounded by the memory its values use rather than by
+the number of entries
+"""
+
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from .. import metrics
+
+
+class ByteBudgetLRU:
+    """
+    LRU mapping whose total value size stays under `max_bytes`. Values larger
+    than the whole budget are not stored. A budget of 0 disables the cache.
+    """
+
+    def __init__(self, max_bytes: int, name: str, sizeof: Callable[[Any], int] = sys.getsizeof):
+        self.max_bytes = max_bytes
+        self.name = name
+        self._sizeof = sizeof
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                metrics.increment(f"{self.name}.misses")
+                return None
+            self._entries.move_to_end(key)
+        metrics.increment(f"{self.name}.hits")
+        return entry[0]
+
+    def put(self, key: Hashable, value: Any):
+        size = self._sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                metrics.increment(f"{self.name}.evictions")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes}
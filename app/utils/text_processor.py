@@ -3,12 +3,142 @@ Enhanced text processing utilities for Farsi text with improved RTL/LTR mixed co
 """
 
 import re
+import hashlib
+import json
 import logging
 import unicodedata
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Optional, Tuple
+
+from .. import metrics
+from ..config import settings
+from .memo import ByteBudgetLRU
 
 logger = logging.getLogger(__name__)
 
+# A whole-word literal term such as r'\bAPI\b' or r'\bAccess\s+Token\b'
+_LITERAL_TERM_RE = re.compile(r'\\b((?:[A-Za-z0-9]|\\s\+)+)\\b')
+_LITERAL_TOKEN_RE = re.compile(r'\\s\+|.')
+# Term prefixes whose first matched character is in [\w.%+-]
+_GUARD_SAFE_TERM_RE = re.compile(r'\\b(?:[A-Za-z0-9]|\\d)|\\b\[A-Za-z0-9\._%\+-\]|\\\.|https?')
+
+
+def _trie_regex(sequences: List[List[str]]) -> str:
+    """Regex alternation with common prefixes factored out, longest match first"""
+    trie: Dict[str, Any] = {}
+    for sequence in sequences:
+        node = trie
+        for token in sequence:
+            node = node.setdefault(token, {})
+        node[''] = {}  # end of a term
+
+    def emit(node: Dict[str, Any]) -> str:
+        branches = [token + emit(child) for token, child in node.items() if token]
+        if not branches:
+            return ''
+        optional = '' in node
+        if len(branches) == 1 and not optional:
+            return branches[0]
+        return '(?:' + '|'.join(branches) + ')' + ('?' if optional else '')
+
+    return emit(trie)
+
+
+def _compile_ltr_pattern(terms: List[str]) -> re.Pattern:
+    """
+    Compile the LTR term patterns into one case-insensitive regex.
+
+    Whole-word literal terms are merged into a single prefix trie (placed where
+    the first of them appears in the list), so the engine does not try every
+    term at every position; the other patterns stay separate alternatives in
+    list order.
+    """
+    literals = []
+    alternatives = []
+    for term in terms:
+        match = _LITERAL_TERM_RE.fullmatch(term)
+        if match:
+            if not literals:
+                alternatives.append(None)  # placeholder for the trie
+            literals.append([token.lower() for token in _LITERAL_TOKEN_RE.findall(match.group(1))])
+        else:
+            alternatives.append(f'(?:{term})')
+    if literals:
+        trie = r'\b' + _trie_regex(literals) + r'\b'
+        alternatives = [trie if alternative is None else alternative for alternative in alternatives]
+    # Cheap first-character guard, only when every term is known to start with one of these
+    guard = r'(?=[\w.%+-])' if all(_GUARD_SAFE_TERM_RE.match(term) for term in terms) else ''
+    return re.compile(guard + '(?:' + '|'.join(alternatives) + ')', re.IGNORECASE)
+
+
+def _is_line_local(term: str) -> bool:
+    """Conservative check that a (non-literal) term pattern can't match a line break"""
+    # Negated classes that exclude whitespace, e.g. [^\s<>"], are safe
+    term = re.sub(r'\[\^\\[sn][^\]]*\]', '', term)
+    return not re.search(r'\\[sWDn]|\[\^|\(\?[a-zA-Z]*s', term)
+
+
+def _compile_line_spanning_pattern(terms: List[str]) -> Optional[re.Pattern]:
+    """
+    Pattern finding multi-word literal terms whose words are separated by a
+    line break, e.g. 'Access\\nToken'; None if there are no such terms.
+    """
+    alternatives = []
+    for term in terms:
+        match = _LITERAL_TERM_RE.fullmatch(term)
+        if not match or r'\s+' not in term:
+            continue
+        words = match.group(1).split(r'\s+')
+        for gap in range(1, len(words)):
+            alternatives.append(r'\s+'.join(words[:gap]) + r'[^\S\n]*\n\s*' + r'\s+'.join(words[gap:]))
+    if not alternatives:
+        return None
+    return re.compile(r'\b(?:' + '|'.join(alternatives) + r')\b', re.IGNORECASE)
+
+
+# Lines handed to the LTR stage at once by the fused pipeline
+LTR_BATCH_LINES = 64
+
+# Code protected from LTR wrapping, fenced blocks first
+_FENCED_CODE_RE = re.compile(r'```[\s\S]*?```')
+_INLINE_CODE_RE = re.compile(r'`[^`\n]+`')
+
+# Farsi letters and ASCII letters/digits, the two strong classes of detect_language_spans
+FARSI_CHAR_CLASS = r'[\u067E\u0686\u0698\u06AF\u06BE\u06CC\u0621-\u063A\u0641-\u064A]'
+LATIN_CHAR_CLASS = r'[A-Za-z0-9]'
+
+
+def compile_script_runs(farsi_class: str = FARSI_CHAR_CLASS, latin_class: str = LATIN_CHAR_CLASS) -> re.Pattern:
+    """
+    Pattern whose matches are script runs: a strong character followed by
+    everything up to the next strong character of the other script.
+    """
+    farsi_set = farsi_class[1:-1]
+    latin_set = latin_class[1:-1]
+    return re.compile(f'(?P<fa>[{farsi_set}][^{latin_set}]*)|(?P<en>[{latin_set}][^{farsi_set}]*)')
+
+
+_SCRIPT_RUN_RE = compile_script_runs()
+
+
+def segment_script_runs(text: str, pattern: re.Pattern = _SCRIPT_RUN_RE) -> List[Tuple[str, str, int, int]]:
+    """
+    Split text into Farsi ('fa') and Latin ('en') runs in a single regex scan.
+
+    Neutral characters (spaces, punctuation, other scripts) belong to the run
+    before them; leading neutrals belong to the first run, and text without
+    any strong character is one 'fa' run.
+
+    Returns:
+        List of (text_span, language, start_pos, end_pos)
+    """
+    spans = []
+    for match in pattern.finditer(text):
+        start = 0 if not spans else match.start()
+        spans.append((text[start:match.end()], match.lastgroup, start, match.end()))
+    if not spans and text.strip():
+        spans.append((text, 'fa', 0, len(text)))
+    return spans
+
 
 class EnhancedFarsiTextProcessor:
     """
@@ -19,13 +149,20 @@ class EnhancedFarsiTextProcessor:
         # Persian/Arabic character ranges
         self.persian_chars = r'[\u0600-\u06FF\u0750-\u077F\u08A0-\u08FF\uFB50-\uFDFF\uFE70-\uFEFF]'
         self.arabic_chars = r'[\u0621-\u063A\u0641-\u064A\u067E\u0686\u0698\u06AF\u06BE\u06CC]'
-        self.farsi_chars = r'[\u067E\u0686\u0698\u06AF\u06BE\u06CC\u0621-\u063A\u0641-\u064A]'
+        self.farsi_chars = FARSI_CHAR_CLASS
 
         # Latin character range
-        self.latin_chars = r'[A-Za-z0-9]'
+        self.latin_chars = LATIN_CHAR_CLASS
+        self._script_run_re = _SCRIPT_RUN_RE
 
-        # Common technical terms that should remain LTR
+        # Common technical terms that should remain LTR. They are compiled into a
+        # single alternation, so earlier entries win when several match at the
+        # same position: URLs and emails come first to be wrapped as a whole.
         self.ltr_terms = [
+            # URLs
+            r'https?://[^\s<>"]+',
+            # Email patterns
+            r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b',
             r'\bAPI\b', r'\bGraph\b', r'\bInstagram\b', r'\bFacebook\b',
             r'\bn8n\b', r'\bAccess\s+Token\b', r'\bCredential\b', r'\bWorkflow\b',
             r'\bDashboard\b', r'\bMeta\b', r'\bBusiness\s+Account\b',
@@ -37,10 +174,6 @@ class EnhancedFarsiTextProcessor:
             r'\bv\d+\.\d+\b', r'\b\d+\.\d+\.\d+\b',
             # File extensions
             r'\.\w{2,4}\b',
-            # Email patterns
-            r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b',
-            # URLs
-            r'https?://[^\s<>"]+',
         ]
 
         # Persian punctuation mapping
@@ -57,113 +190,137 @@ class EnhancedFarsiTextProcessor:
             (r' +([،؛؟٪])', r'\1'),
             (r'([،؛؟٪])(?=[^\s])', r'\1 '),
             # Fix multiple spaces
-            (r' +', ' '),
-            # Fix Persian quotes
-            (r'"([^"]*)"', r'«\1»'),
-            (r"'([^']*)'", r'‹\1›'),
+            (r' {2,}', ' '),
+        ]
+        # Lines without a match are left unchanged by typography_rules
+        self._typography_trigger = re.compile(r'[،؛؟٪]| {2}')
+
+        # Persian quotes: (straight quote, opening, closing). Quotes are paired in
+        # document order, so a pair may span lines; an unpaired last quote is kept.
+        self.quote_rules = [
+            ('"', '«', '»'),
+            ("'", '‹', '›'),
         ]
 
+    @property
+    def ltr_terms(self) -> List[str]:
+        return list(self._ltr_terms)
+
+    @ltr_terms.setter
+    def ltr_terms(self, terms: List[str]):
+        """Replace the LTR term patterns and recompile the combined matcher"""
+        self._ltr_terms = list(terms)
+        self._ltr_pattern = _compile_ltr_pattern(self._ltr_terms) if self._ltr_terms else None
+        # Used by the fused pipeline, which wraps terms line by line
+        self._ltr_terms_line_local = all(
+            _LITERAL_TERM_RE.fullmatch(term) or _is_line_local(term) for term in self._ltr_terms
+        )
+        self._line_spanning_term_re = _compile_line_spanning_pattern(self._ltr_terms)
+        # Identifies the configuration in memoization keys
+        self.config_fingerprint = hashlib.sha256(json.dumps(self._ltr_terms).encode('utf-8')).hexdigest()[:16]
+
+    def add_ltr_terms(self, terms: List[str], literal: bool = True):
+        """
+        Add terms that should stay LTR.
+
+        Args:
+            terms: Words or phrases, or regex patterns when `literal` is False
+            literal: Escape the terms and match them as whole words
+        """
+        if literal:
+            terms = [r'\b' + r'\s+'.join(re.escape(word) for word in term.split()) + r'\b'
+                     for term in terms if term.strip()]
+        self.ltr_terms = self._ltr_terms + list(terms)
+
+    def wrap_ltr_terms(self, text: str) -> str:
+        """
+        Wrap every LTR term in a `<span dir="ltr">` in a single pass
+        """
+        if self._ltr_pattern is None:
+            return text
+        return self._ltr_pattern.sub(lambda m: f'<span dir="ltr">{m.group(0)}</span>', text)
+
     def detect_language_spans(self, text: str) -> List[Tuple[str, str, int, int]]:
         """
         Detect language spans in mixed RTL/LTR text
         Returns list of (text_span, language, start_pos, end_pos)
         """
-        spans = []
-        current_lang = None
-        current_start = 0
-
-        i = 0
-        while i < len(text):
-            char = text[i]
-
-            # Detect character type
-            if re.match(self.farsi_chars, char):
-                char_lang = 'fa'
-            elif re.match(r'[A-Za-z0-9]', char):
-                char_lang = 'en'
-            else:
-                # Neutral characters (spaces, punctuation) - inherit from context
-                char_lang = current_lang
-
-            # If language changes, save the previous span
-            if char_lang != current_lang and current_lang is not None:
-                span_text = text[current_start:i]
-                if span_text.strip():  # Only add non-empty spans
-                    spans.append((span_text, current_lang, current_start, i))
-                current_start = i
-
-            current_lang = char_lang
-            i += 1
-
-        # Add the final span
-        if current_start < len(text):
-            span_text = text[current_start:]
-            if span_text.strip():
-                spans.append((span_text, current_lang or 'fa', current_start, len(text)))
-
-        return spans
+        return segment_script_runs(text, self._script_run_re)
 
     def wrap_ltr_content(self, text: str) -> str:
         """
         Wrap LTR content in appropriate markdown for proper rendering
         """
+        # Fenced blocks are numbered first, inline code after them
+        text, _, _ = self._wrap_ltr_segment(text, 0, text.count('```') // 2)
+        return text
+
+    def _wrap_ltr_segment(self, text: str, fenced_index: int, inline_index: int) -> Tuple[str, int, int]:
+        """
+        wrap_ltr_content for a piece of the document that does not cut through a
+        fenced code block. Placeholders are numbered from `fenced_index` /
+        `inline_index` so they match the numbering of a whole-document run.
+
+        Returns:
+            (wrapped text, number of fenced blocks, number of inline code spans)
+        """
         # First, protect existing code blocks and inline code
         protected_blocks = []
+        next_index = fenced_index
 
         def protect_code(match):
-            protected_blocks.append(match.group(0))
-            return f"__PROTECTED_CODE_{len(protected_blocks)-1}__"
+            nonlocal next_index
+            placeholder = f"__PROTECTED_CODE_{next_index}__"
+            next_index += 1
+            protected_blocks.append((placeholder, match.group(0)))
+            return placeholder
 
         # Protect code blocks and inline code
-        text = re.sub(r'```[\s\S]*?```', protect_code, text)
-        text = re.sub(r'`[^`\n]+`', protect_code, text)
-
-        # Process LTR terms
-        for term_pattern in self.ltr_terms:
-            # Wrap technical terms in spans with LTR direction
-            text = re.sub(
-                term_pattern,
-                lambda m: f'<span dir="ltr">{m.group(0)}</span>',
-                text,
-                flags=re.IGNORECASE
-            )
+        if '```' in text:
+            text = _FENCED_CODE_RE.sub(protect_code, text)
+        fenced_count = len(protected_blocks)
+        if '`' in text:
+            next_index = inline_index
+            text = _INLINE_CODE_RE.sub(protect_code, text)
+        inline_count = len(protected_blocks) - fenced_count
 
-        # Handle sequences of Latin characters mixed with Persian
-        lines = text.split('\n')
-        processed_lines = []
-
-        for line in lines:
-            if not line.strip():
-                processed_lines.append(line)
-                continue
-
-            # Skip if line is primarily code or already has direction markers
-            if ('```' in line or line.strip().startswith('    ') or
-                '<span dir=' in line or line.startswith('#')):
-                processed_lines.append(line)
-                continue
+        # Wrap technical terms in spans with LTR direction
+        text = self.wrap_ltr_terms(text)
 
-            # Detect and wrap LTR sequences
-            spans = self.detect_language_spans(line)
-            if len(spans) > 1:  # Mixed content
-                result = ""
-                for span_text, lang, start, end in spans:
-                    if lang == 'en' and len(span_text.strip()) > 1:
-                        # Wrap English spans
-                        result += f'<span dir="ltr">{span_text}</span>'
-                    else:
-                        result += span_text
-                processed_lines.append(result)
-            else:
-                processed_lines.append(line)
-
-        text = '\n'.join(processed_lines)
+        # Handle sequences of Latin characters mixed with Persian
+        if '\n' in text:
+            text = '\n'.join([self._wrap_mixed_line(line) for line in text.split('\n')])
+        else:
+            text = self._wrap_mixed_line(text)
 
         # Restore protected code blocks
-        for i, block in enumerate(protected_blocks):
-            text = text.replace(f"__PROTECTED_CODE_{i}__", block)
-
-        return text
+        for placeholder, block in protected_blocks:
+            text = text.replace(placeholder, block)
+
+        return text, fenced_count, inline_count
+
+    def _wrap_mixed_line(self, line: str) -> str:
+        """Wrap the English runs of a line that mixes Farsi and English"""
+        if not line.strip():
+            return line
+
+        # Skip if line is primarily code or already has direction markers
+        if ('```' in line or line.strip().startswith('    ') or
+            '<span dir=' in line or line.startswith('#')):
+            return line
+
+        # Detect and wrap LTR sequences
+        spans = self.detect_language_spans(line)
+        if len(spans) > 1:  # Mixed content
+            result = ""
+            for span_text, lang, start, end in spans:
+                if lang == 'en' and len(span_text.strip()) > 1:
+                    # Wrap English spans
+                    result += f'<span dir="ltr">{span_text}</span>'
+                else:
+                    result += span_text
+            return result
+        return line
 
     def apply_persian_typography(self, text: str) -> str:
         """
@@ -177,76 +334,76 @@ class EnhancedFarsiTextProcessor:
         for pattern, replacement in self.typography_rules:
             text = re.sub(pattern, replacement, text, flags=re.MULTILINE)
 
+        # Fix Persian quotes
+        for quote, opening, closing in self.quote_rules:
+            text = re.sub(f'{quote}([^{quote}]*){quote}', f'{opening}\\1{closing}', text)
+
         return text
 
     def enhance_markdown_structure(self, text: str) -> str:
         """
         Enhance markdown structure for better RTL rendering
         """
-        lines = text.split('\n')
-        enhanced_lines = []
-
-        in_code_block = False
-        in_table = False
-
-        for line in lines:
-            original_line = line
-
-            # Track code blocks
-            if line.strip().startswith('```'):
-                in_code_block = not in_code_block
-                enhanced_lines.append(line)
-                continue
-
-            if in_code_block:
-                enhanced_lines.append(line)
-                continue
-
-            # Detect tables
-            if '|' in line and not line.strip().startswith('#'):
-                in_table = True
-                # Ensure proper table formatting
-                if not line.strip().startswith('|'):
-                    line = '| ' + line.strip()
-                if not line.strip().endswith('|'):
-                    line = line.rstrip() + ' |'
-                # Clean up spacing
-                line = re.sub(r'\s*\|\s*', ' | ', line)
-                line = re.sub(r'^\s*\|\s*', '| ', line)
-                line = re.sub(r'\s*\|\s*$', ' |', line)
-            elif in_table and not line.strip():
-                in_table = False
-
-            # Enhance headers
-            if line.startswith('#'):
-                # Clean up header text
-                header_match = re.match(r'^(#+)\s*(.*)$', line)
-                if header_match:
-                    level, title = header_match.groups()
-                    title = title.strip()
-                    if title:
-                        line = f"{level} {title}"
-
-            # Enhance lists
-            if re.match(r'^\s*[-*+]\s', line):
-                # Ensure consistent list formatting
-                line = re.sub(r'^(\s*)([-*+])\s+', r'\1- ', line)
-            elif re.match(r'^\s*\d+\.\s', line):
-                # Clean up numbered lists
-                line = re.sub(r'^(\s*)(\d+)\.\s+', r'\1\2. ', line)
-
-            enhanced_lines.append(line)
-
-        return '\n'.join(enhanced_lines)
+        state = {'in_code_block': False, 'in_table': False}
+        return '\n'.join([self._enhance_structure_line(line, state) for line in text.split('\n')])
+
+    def _enhance_structure_line(self, line: str, state: Dict[str, bool]) -> str:
+        """enhance_markdown_structure for one line; `state` carries code block / table tracking"""
+        # Track code blocks
+        if line.strip().startswith('```'):
+            state['in_code_block'] = not state['in_code_block']
+            return line
+
+        if state['in_code_block']:
+            return line
+
+        # Detect tables
+        if '|' in line and not line.strip().startswith('#'):
+            state['in_table'] = True
+            # Ensure proper table formatting
+            if not line.strip().startswith('|'):
+                line = '| ' + line.strip()
+            if not line.strip().endswith('|'):
+                line = line.rstrip() + ' |'
+            # Clean up spacing
+            line = re.sub(r'\s*\|\s*', ' | ', line)
+            line = re.sub(r'^\s*\|\s*', '| ', line)
+            line = re.sub(r'\s*\|\s*$', ' |', line)
+        elif state['in_table'] and not line.strip():
+            state['in_table'] = False
+
+        # Enhance headers
+        if line.startswith('#'):
+            # Clean up header text
+            header_match = re.match(r'^(#+)\s*(.*)$', line)
+            if header_match:
+                level, title = header_match.groups()
+                title = title.strip()
+                if title:
+                    line = f"{level} {title}"
+
+        # Enhance lists
+        if re.match(r'^\s*[-*+]\s', line):
+            # Ensure consistent list formatting
+            line = re.sub(r'^(\s*)([-*+])\s+', r'\1- ', line)
+        elif re.match(r'^\s*\d+\.\s', line):
+            # Clean up numbered lists
+            line = re.sub(r'^(\s*)(\d+)\.\s+', r'\1\2. ', line)
+
+        return line
 
     def add_rtl_metadata(self, text: str) -> str:
         """
         Add RTL metadata to markdown document
         """
+        return '\n'.join(self._rtl_metadata_lines(text.split('\n')))
+
+    def _rtl_metadata_lines(self, lines: List[str]) -> List[str]:
+        """add_rtl_metadata on a document that is already split into lines"""
         # Check if document already has YAML front matter
-        if text.strip().startswith('---'):
+        first_line = next((line for line in lines if line.strip()), '')
+        if first_line.strip().startswith('---'):
             # Find end of front matter
-            lines = text.split('\n')
             yaml_end = -1
             for i, line in enumerate(lines[1:], 1):
                 if line.strip() == '---':
@@ -267,17 +424,10 @@ class EnhancedFarsiTextProcessor:
                     yaml_section.append('dir: rtl')
 
                 # Reconstruct document
-                result_lines = ['---'] + yaml_section + lines[yaml_end:]
-                return '\n'.join(result_lines)
-
-        # No front matter exists, add it
-        yaml_header = """---
-lang: fa
-dir: rtl
----
+                return ['---'] + yaml_section + lines[yaml_end:]
 
-"""
-        return yaml_header + text
+        # No front matter exists, add it (followed by an empty line)
+        return ['---', 'lang: fa', 'dir: rtl', '---', ''] + lines
 
     def preprocess_text(self, text: str) -> str:
         """
@@ -287,29 +437,135 @@ dir: rtl
 
         try:
             # Step 1: Normalize Unicode
-            text = unicodedata.normalize('NFKC', text)
+            with metrics.timed("preprocess.normalize"):
+                text = unicodedata.normalize('NFKC', text)
+
+            # Steps 2-6 in a single pass over the lines when the document allows it
+            result = None
+            if self._can_fuse(text):
+                with metrics.timed("preprocess.fused"):
+                    result = self._preprocess_fused(text)
+            if result is None:
+                with metrics.timed("preprocess.multipass"):
+                    result = self._preprocess_multipass(text)
 
-            # Step 2: Add RTL metadata
-            text = self.add_rtl_metadata(text)
+            logger.info("Enhanced Farsi text preprocessing completed")
+            return result
 
-            # Step 3: Apply Persian typography
-            text = self.apply_persian_typography(text)
+        except Exception as e:
+            logger.error(f"Error in text preprocessing: {e}")
+            return text  # Return original text on error
 
-            # Step 4: Enhance markdown structure
-            text = self.enhance_markdown_structure(text)
+    def _preprocess_multipass(self, text: str) -> str:
+        """Steps 2-6 as separate whole-document passes"""
+        # Step 2: Add RTL metadata
+        text = self.add_rtl_metadata(text)
 
-            # Step 5: Handle mixed LTR/RTL content
-            text = self.wrap_ltr_content(text)
+        # Step 3: Apply Persian typography
+        text = self.apply_persian_typography(text)
 
-            # Step 6: Final cleanup
-            text = self.final_cleanup(text)
+        # Step 4: Enhance markdown structure
+        text = self.enhance_markdown_structure(text)
 
-            logger.info("Enhanced Farsi text preprocessing completed")
-            return text
+        # Step 5: Handle mixed LTR/RTL content
+        text = self.wrap_ltr_content(text)
 
-        except Exception as e:
-            logger.error(f"Error in text preprocessing: {e}")
-            return text  # Return original text on error
+        # Step 6: Final cleanup
+        return self.final_cleanup(text)
+
+    def _can_fuse(self, text: str) -> bool:
+        """
+        Whether the fused pipeline gives the same output as the multipass one.
+        It can't when an LTR term may match across a line break, or when the
+        text itself contains code placeholders.
+        """
+        if '__PROTECTED_CODE_' in text:
+            return False
+        if not self._ltr_terms_line_local:
+            return False
+        return self._line_spanning_term_re is None or self._line_spanning_term_re.search(text) is None
+
+    def _preprocess_fused(self, text: str) -> Optional[str]:
+        """
+        Steps 2-6 with the document split once: every line goes through
+        typography and structure enhancement, the LTR stage gets batches of
+        lines that end outside fenced code blocks, and the result is joined once
+        for the document-level final cleanup (whose rules cross line breaks).
+
+        Returns:
+            The processed text, or None if the multipass path has to be used
+        """
+        lines = self._rtl_metadata_lines(text.split('\n'))
+
+        # Quotes are paired in document order; only complete pairs are converted
+        quote_states = []
+        for quote, opening, closing in self.quote_rules:
+            count = sum(line.count(quote) for line in lines)
+            quote_states.append([quote, opening, closing, 0, count - count % 2])
+
+        typography_rules = [(re.compile(pattern, re.MULTILINE), replacement)
+                            for pattern, replacement in self.typography_rules]
+        structure_state = {'in_code_block': False, 'in_table': False}
+
+        # Fenced blocks are numbered before inline code, as in wrap_ltr_content
+        fence_pairs = sum(line.count('```') for line in lines) // 2
+        fenced_index, inline_index = 0, fence_pairs
+        fence_open = False
+
+        output = []
+        pending = []
+        for line in lines:
+            # Persian typography
+            for latin, persian in self.persian_punctuation.items():
+                if latin in line:
+                    line = line.replace(latin, persian)
+            if self._typography_trigger.search(line):
+                for pattern, replacement in typography_rules:
+                    line = pattern.sub(replacement, line)
+            for state in quote_states:
+                if state[0] in line:
+                    line = self._convert_quotes(line, state)
+
+            # Markdown structure
+            line = self._enhance_structure_line(line, structure_state)
+
+            # Mixed LTR/RTL content, in batches of lines that end outside fenced blocks
+            pending.append(line)
+            if line.count('```') % 2:
+                fence_open = not fence_open
+            if not fence_open and len(pending) >= LTR_BATCH_LINES:
+                segment, fenced, inline = self._wrap_ltr_segment('\n'.join(pending), fenced_index, inline_index)
+                fenced_index += fenced
+                inline_index += inline
+                output.append(segment)
+                pending = []
+
+        if pending:
+            segment, fenced, inline = self._wrap_ltr_segment('\n'.join(pending), fenced_index, inline_index)
+            fenced_index += fenced
+            output.append(segment)
+
+        if fenced_index != fence_pairs:
+            # Typography or structure changes moved a fence; number them like the multipass path
+            return None
+
+        return self.final_cleanup('\n'.join(output))
+
+    @staticmethod
+    def _convert_quotes(line: str, state: list) -> str:
+        """Replace the straight quotes of a line, continuing the document-wide pairing in `state`"""
+        quote, opening, closing, seen, convertible = state
+        parts = line.split(quote)
+        result = [parts[0]]
+        for part in parts[1:]:
+            if seen < convertible:
+                result.append(opening if seen % 2 == 0 else closing)
+            else:
+                result.append(quote)
+            result.append(part)
+            seen += 1
+        state[3] = seen
+        return ''.join(result)
 
     def final_cleanup(self, text: str) -> str:
         """
@@ -327,7 +583,7 @@ dir: rtl
         text = re.sub(r'\s*\)\s*', ') ', text)
 
         # Clean up multiple spaces
-        text = re.sub(r' +', ' ', text)
+        text = re.sub(r' {2,}', ' ', text)
 
         return text.strip()
 
@@ -633,16 +889,34 @@ dir: rtl
 
 # Global processor instance
 enhanced_processor = EnhancedFarsiTextProcessor()
+if settings.LTR_EXTRA_TERMS:
+    enhanced_processor.add_ltr_terms(settings.LTR_EXTRA_TERMS.split(','))
+
+
+# Memoized preprocess_farsi_text results, keyed by a hash of the input
+preprocess_memo = ByteBudgetLRU(settings.PREPROCESS_MEMO_BYTES, name="preprocess_memo")
 
 
-def preprocess_farsi_text(text: str) -> str:
+def preprocess_farsi_text(text: str, memoize: bool = True) -> str:
     """
     Enhanced preprocessing function for Farsi text with proper RTL/LTR mixed content handling
 
     Args:
         text: Input text to process
+        memoize: Reuse the result for identical input (preprocessing is a pure function)
 
     Returns:
         Processed text with enhancements for DOCX generation
     """
-    return enhanced_processor.preprocess_text(text)
+    if not memoize or preprocess_memo.max_bytes <= 0:
+        with metrics.timed("preprocess.total"):
+            return enhanced_processor.preprocess_text(text)
+
+    digest = hashlib.sha256(text.encode('utf-8', 'surrogatepass')).hexdigest()
+    key = (enhanced_processor.config_fingerprint, digest)
+    result = preprocess_memo.get(key)
+    if result is None:
+        with metrics.timed("preprocess.total"):
+            result = enhanced_processor.preprocess_text(text)
+        preprocess_memo.put(key, result)
+    return result
@@ -0,0 +1,113 @@
+"""
+Bounded executor for CPU/subprocess-heavy conversion work, so the event loop
+stays free for /health, the homepage and other in-flight requests
+"""
+
+import asyncio
+import contextlib
+import functools
+import logging
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, Callable, Optional
+
+from . import metrics
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class PoolSaturatedError(Exception):
+    """Raised when every worker is busy and the wait queue is full"""
+
+
+class ConversionPool:
+    """
+    Runs blocking callables on a thread or process pool with a hard bound on
+    running + queued jobs. Jobs beyond that bound are rejected immediately
+    instead of piling up behind a slow document.
+    """
+
+    def __init__(self, workers: int, queue_limit: int, kind: str = "thread"):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unsupported executor kind: '{kind}'. Use 'thread' or 'process'.")
+        self.workers = max(1, workers)
+        self.queue_limit = max(0, queue_limit)
+        self.kind = kind
+        self._executor: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._in_flight = 0
+
+    @property
+    def capacity(self) -> int:
+        """Maximum number of running plus waiting jobs"""
+        return self.workers + self.queue_limit
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="convert")
+            logger.info(f"Started {self.kind} conversion pool with {self.workers} workers, queue limit {self.queue_limit}")
+        return self._executor
+
+    @contextlib.asynccontextmanager
+    async def slot(self, wait: bool = False):
+        """
+        Hold one of the pool's slots, for work that has to run outside the
+        executor (e.g. on state that lives in this process) but must still
+        count against the pool's capacity.
+
+        Raises:
+            PoolSaturatedError: If the pool is full and `wait` is False
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.capacity)
+        if self._slots.locked() and not wait:
+            metrics.increment("conversion_pool.rejected")
+            raise PoolSaturatedError(f"Conversion pool is saturated ({self.capacity} jobs in flight)")
+
+        await self._slots.acquire()
+        self._in_flight += 1
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+            self._slots.release()
+
+    async def run(self, fn: Callable, *args, wait: bool = False, **kwargs) -> Any:
+        """
+        Run `fn(*args, **kwargs)` on the pool and await its result.
+
+        Args:
+            fn: Picklable callable when the pool is process based
+            wait: Wait for a free slot instead of failing when saturated
+
+        Raises:
+            PoolSaturatedError: If the pool is full and `wait` is False
+        """
+        async with self.slot(wait):
+            loop = asyncio.get_running_loop()
+            with metrics.timed("conversion_pool.job"):
+                return await loop.run_in_executor(self._get_executor(), functools.partial(fn, *args, **kwargs))
+
+    def stats(self) -> dict:
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "queue_limit": self.queue_limit,
+            "in_flight": self._in_flight,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Global pool used by the API endpoints
+conversion_pool = ConversionPool(
+    workers=settings.CONVERT_WORKERS,
+    queue_limit=settings.CONVERT_QUEUE_LIMIT,
+    kind=settings.CONVERT_EXECUTOR,
+)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Benchmark end-to-end Pandoc conversion latency with the RTL properties added
+by the Lua filter (RTL_MODE=filter) and by post-processing word/document.xml
+(RTL_MODE=postprocess).
+
+The native DOCX writer and the pandoc server are disabled so every run starts
+Pandoc. Requires pandoc and python-docx.
+
+Usage: python3 benchmark_rtl_modes.py [runs] [sections ...]
+"""
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app import converter
+from app.utils.text_processor import preprocess_farsi_text
+
+SECTION = """## بخش {i}
+
+این یک پاراگراف آزمایشی با متن فارسی و کلمه Facebook API است که برای سنجش کارایی استفاده می‌شود.
+
+- مورد اول با `config.yaml`
+- مورد دوم
+
+```python
+print("section {i}")
+```
+
+| ستون ۱ | ستون ۲ |
+|--------|--------|
+| سلول   | ۲      |
+"""
+
+
+def build_markdown(sections: int) -> str:
+    return preprocess_farsi_text("\n".join(SECTION.format(i=i) for i in range(sections)))
+
+
+def measure(mode: str, markdown_text: str, runs: int):
+    converter.RTL_MODE = mode
+    durations = []
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        data = converter.render_markdown_bytes(markdown_text, "docx")
+        durations.append(time.perf_counter() - start_time)
+    return statistics.median(durations), min(durations), len(data)
+
+
+def main():
+    args = [int(arg) for arg in sys.argv[1:]]
+    runs = args[0] if args else 5
+    sizes = args[1:] or [10, 100, 1000]
+
+    converter.NATIVE_DOCX_ENABLED = False
+    converter.PANDOC_SERVER_ENABLED = False
+    if converter.get_reference_docx() is None:
+        sys.exit("python-docx is required to build the reference document")
+
+    print(f"{'sections':>8} {'md KB':>7} {'filter med s':>13} {'filter min s':>13} "
+          f"{'postproc med s':>15} {'postproc min s':>15} {'speedup':>8}")
+    for sections in sizes:
+        markdown_text = build_markdown(sections)
+        filter_median, filter_min, _ = measure("filter", markdown_text, runs)
+        post_median, post_min, _ = measure("postprocess", markdown_text, runs)
+        print(f"{sections:>8} {len(markdown_text.encode('utf-8')) / 1024:>7.0f} {filter_median:>13.3f} "
+              f"{filter_min:>13.3f} {post_median:>15.3f} {post_min:>15.3f} {post_median / filter_median:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks on ~1 MB of mixed Farsi/English text:
+- LTR term wrapping: one re.sub per term (the previous implementation) vs the
+  combined pattern
+- Script run detection: per-character re.match vs segment_script_runs
+- preprocess_text: separate whole-document passes vs the fused pipeline
+
+Usage: python3 benchmark_text_processor.py [size_mb]
+"""
+import logging
+import os
+import re
+import sys
+import time
+import unicodedata
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app.utils.text_processor import EnhancedFarsiTextProcessor, FARSI_CHAR_CLASS, segment_script_runs
+
+SAMPLE_LINES = [
+    "## راهنمای اتصال Instagram به n8n",
+    "برای دریافت Access Token باید وارد Dashboard حساب Facebook شوید و App ID را کپی کنید.",
+    "این یک پاراگراف فارسی بدون هیچ کلمه انگلیسی است که فقط برای پر کردن متن استفاده می‌شود.",
+    "نسخه v2.1 از Graph API خروجی JSON برمی‌گرداند، فایل config.yaml را ویرایش کنید.",
+    "برای پشتیبانی با support@example.com تماس بگیرید یا به https://github.com/example/repo مراجعه کنید.",
+    "- مرحله سوم: تنظیمات Business Account را در بخش Settings باز کنید",
+    "برای نصب دستور `pip install pypandoc` را اجرا کنید و \"نتیجه\" را ببینید.",
+    "```",
+    "print('hello, world')",
+    "```",
+    "",
+]
+
+
+def build_text(size_mb: float) -> str:
+    block = "\n".join(SAMPLE_LINES) + "\n"
+    repeat = int(size_mb * 1024 * 1024 / len(block.encode("utf-8"))) + 1
+    return block * repeat
+
+
+def wrap_per_term(processor: EnhancedFarsiTextProcessor, text: str) -> str:
+    for term_pattern in processor.ltr_terms:
+        text = re.sub(
+            term_pattern,
+            lambda m: f'<span dir="ltr">{m.group(0)}</span>',
+            text,
+            flags=re.IGNORECASE
+        )
+    return text
+
+
+def detect_per_character(text: str) -> list:
+    """The previous detect_language_spans classification loop"""
+    spans = []
+    current_lang = None
+    current_start = 0
+    for i, char in enumerate(text):
+        if re.match(FARSI_CHAR_CLASS, char):
+            char_lang = 'fa'
+        elif re.match(r'[A-Za-z0-9]', char):
+            char_lang = 'en'
+        else:
+            char_lang = current_lang
+        if char_lang != current_lang and current_lang is not None:
+            spans.append((text[current_start:i], current_lang, current_start, i))
+            current_start = i
+        current_lang = char_lang
+    return spans
+
+
+def per_line(fn):
+    return lambda text: [fn(line) for line in text.split("\n")]
+
+
+def measure(fn, text: str, rounds: int = 3) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        start_time = time.perf_counter()
+        fn(text)
+        best = min(best, time.perf_counter() - start_time)
+    return best
+
+
+def main():
+    size_mb = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    processor = EnhancedFarsiTextProcessor()
+    text = build_text(size_mb)
+    mb = len(text.encode("utf-8")) / 1e6
+
+    per_term = measure(lambda t: wrap_per_term(processor, t), text)
+    combined = measure(processor.wrap_ltr_terms, text)
+    print(f"input: {mb:.1f} MB, {len(processor.ltr_terms)} term patterns")
+    print(f"{'per-term re.sub':>18}: {per_term:.3f}s ({mb / per_term:.1f} MB/s)")
+    print(f"{'combined pattern':>18}: {combined:.3f}s ({mb / combined:.1f} MB/s)")
+    print(f"{'speedup':>18}: {per_term / combined:.1f}x")
+
+    per_char = measure(per_line(detect_per_character), text, rounds=1)
+    runs = measure(per_line(segment_script_runs), text)
+    print(f"{'per-char re.match':>18}: {per_char:.3f}s ({mb / per_char:.1f} MB/s)")
+    print(f"{'script runs':>18}: {runs:.3f}s ({mb / runs:.1f} MB/s)")
+    print(f"{'speedup':>18}: {per_char / runs:.1f}x")
+
+    logging.disable(logging.INFO)
+    normalized = unicodedata.normalize('NFKC', text)
+    multipass = measure(processor._preprocess_multipass, normalized, rounds=1)
+    fused = measure(processor._preprocess_fused, normalized, rounds=1)
+    print(f"{'multipass':>18}: {multipass:.3f}s ({mb / multipass:.1f} MB/s)")
+    print(f"{'fused':>18}: {fused:.3f}s ({mb / fused:.1f} MB/s)")
+    print(f"{'speedup':>18}: {multipass / fused:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
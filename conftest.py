@@ -0,0 +1,7 @@
+"""
+pytest configuration: keep the app created by the TestClient tests from
+sending analytics to Google Analytics when .env enables them
+"""
+import os
+
+os.environ["FIREBASE_ANALYTICS_ENABLED"] = "false"
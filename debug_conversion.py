@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 from app.utils.text_processor import preprocess_farsi_text
+from app.converter import get_reference_docx
 import subprocess
 import os
 
@@ -33,7 +34,7 @@ cmd = [
     'pandoc',
     '/tmp/test_processed.md',
     '-o', '/tmp/test_output.docx',
-    '--reference-doc=/app/outputs/reference_farsi.docx',
+    f'--reference-doc={get_reference_docx()}',
     '--metadata=lang:fa',
     '--metadata=dir:rtl',
     '--variable=mainfont:DejaVu Sans'
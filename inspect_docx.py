@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
 from docx import Document
 import os
+from app.converter import reference_docx_path
 
 # Test if we can read our reference document
-ref_path = '/app/outputs/reference_farsi.docx'
+ref_path = str(reference_docx_path())
 if os.path.exists(ref_path):
     print('Reading reference document...')
     doc = Document(ref_path)
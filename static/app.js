@@ -93,24 +93,66 @@
   }
 
 
-  // --- Preview handler (debounced) ---
+  // --- Live preview ---
+  // Edits are sent (debounced) over /api/preview/ws, which renders the same
+  // preprocessed RTL HTML the DOCX is built from; marked.js is the fallback
+  // while the socket is unavailable.
+  const EMPTY_PREVIEW = '<div class="text-gray-400 italic">پیش‌نمایش در اینجا نمایش داده می‌شود...</div>';
   let previewTimer;
+  let previewSocket = null;
+  let previewSeq = 0;
+  let shownSeq = 0;
+
+  function renderLocalPreview() {
+    try {
+      if (prev && typeof marked !== 'undefined') prev.innerHTML = marked.parse(inp.value);
+      else if (prev) prev.innerHTML = '<div class="text-red-500">Marked.js not loaded.</div>';
+    } catch (err) {
+      if (prev) prev.innerHTML = `<div class="text-red-500">خطا در پردازش: ${err.message}</div>`;
+    }
+  }
+
+  function connectPreview() {
+    if (!("WebSocket" in window)) return;
+    const scheme = location.protocol === "https:" ? "wss" : "ws";
+    const socket = new WebSocket(`${scheme}://${location.host}/api/preview/ws`);
+    socket.onopen = () => { previewSocket = socket; };
+    socket.onmessage = (event) => {
+      const message = JSON.parse(event.data);
+      // Answers to older edits may still arrive after a newer one was shown
+      if (!prev || message.seq == null || message.seq < shownSeq) return;
+      if (message.error) {
+        console.warn("[app.js] Preview error:", message.error);
+        return;
+      }
+      shownSeq = message.seq;
+      prev.innerHTML = message.html;
+    };
+    socket.onclose = () => {
+      previewSocket = null;
+      setTimeout(connectPreview, 3000);
+    };
+  }
+
+  function requestPreview() {
+    if (!inp || !inp.value.trim()) {
+      if (prev) prev.innerHTML = EMPTY_PREVIEW;
+      shownSeq = ++previewSeq;
+      return;
+    }
+    if (previewSocket && previewSocket.readyState === WebSocket.OPEN) {
+      previewSocket.send(JSON.stringify({ seq: ++previewSeq, text: inp.value }));
+    } else {
+      renderLocalPreview();
+    }
+  }
+
   if (inp) {
     inp.oninput = () => {
       clearTimeout(previewTimer);
-      previewTimer = setTimeout(()=> {
-        if (!inp.value.trim()) {
-          if (prev) prev.innerHTML = '<div class="text-gray-400 italic">پیش‌نمایش در اینجا نمایش داده می‌شود...</div>';
-          return;
-        }
-        try {
-          if (prev && typeof marked !== 'undefined') prev.innerHTML = marked.parse(inp.value);
-          else if (prev) prev.innerHTML = '<div class="text-red-500">Marked.js not loaded.</div>';
-        } catch (err) {
-          if (prev) prev.innerHTML = `<div class="text-red-500">خطا در پردازش: ${err.message}</div>`;
-        }
-      }, 300);
+      previewTimer = setTimeout(requestPreview, 150);
     };
+    connectPreview();
   }
 
   if (btnPreview) {
@@ -121,12 +163,7 @@
         if (prev) prev.innerHTML = '<div class="text-gray-400 italic">متن خالی است</div>';
         return;
       }
-      try {
-        if (prev && typeof marked !== 'undefined') prev.innerHTML = marked.parse(inp.value);
-        else if (prev) prev.innerHTML = '<div class="text-red-500">Marked.js not loaded.</div>';
-      } catch (err) {
-        if (prev) prev.innerHTML = `<div class="text-red-500">خطا در پردازش: ${err.message}</div>`;
-      }
+      requestPreview();
     };
   }
 
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Checks for the background analytics sender (app/firebase_utils.py)
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import httpx
+
+from app import firebase_utils, metrics
+from app.config import settings
+from app.firebase_utils import AnalyticsQueue, track_event
+from app.main import app, analytics_stub_requests
+
+
+def _stub_settings():
+    """Send analytics to the app's own stub endpoint, in process"""
+    return [
+        mock.patch.object(settings, "ANALYTICS_STUB_ENABLED", True),
+        mock.patch.object(settings, "GA_ENDPOINT", "http://testserver/api/analytics/stub/collect"),
+        mock.patch.object(settings, "GA_MEASUREMENT_ID", "G-TEST"),
+        mock.patch.object(settings, "GA_API_SECRET", "secret"),
+    ]
+
+
+async def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    assert condition()
+
+
+def test_events_are_sent_in_batches_of_25():
+    async def run():
+        queue = AnalyticsQueue(maxsize=100, batch_size=25, flush_interval=0.05, spill_path="/nonexistent/spill", spill_max_bytes=0)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app)) as stub_client:
+            with mock.patch.object(firebase_utils, "client", stub_client):
+                for i in range(60):
+                    queue.put({"name": "conversion_requested", "params": {"i": i}})
+                queue.start()
+                await _wait_for(lambda: sum(len(p["events"]) for p in analytics_stub_requests) == 60)
+                await queue.stop()
+
+    patches = _stub_settings()
+    for patch in patches:
+        patch.start()
+    try:
+        analytics_stub_requests.clear()
+        asyncio.run(run())
+    finally:
+        for patch in patches:
+            patch.stop()
+    assert [len(p["events"]) for p in analytics_stub_requests] == [25, 25, 10]
+    assert [e["params"]["i"] for p in analytics_stub_requests for e in p["events"]] == list(range(60))
+
+
+def test_overflow_is_spilled_and_sent_later():
+    async def run(spill_path):
+        queue = AnalyticsQueue(maxsize=2, batch_size=25, flush_interval=0.01, spill_path=spill_path, spill_max_bytes=10_000)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app)) as stub_client:
+            with mock.patch.object(firebase_utils, "client", stub_client):
+                for i in range(5):
+                    queue.put({"name": "e", "params": {"i": i}})
+                assert os.path.exists(spill_path)
+                queue.start()
+                await _wait_for(lambda: sum(len(p["events"]) for p in analytics_stub_requests) == 5)
+                await queue.stop()
+        assert not os.path.exists(spill_path)
+
+    patches = _stub_settings()
+    for patch in patches:
+        patch.start()
+    try:
+        analytics_stub_requests.clear()
+        spilled = metrics.snapshot()["counters"].get("analytics.spilled", 0)
+        with tempfile.TemporaryDirectory() as directory:
+            asyncio.run(run(os.path.join(directory, "spill.jsonl")))
+        assert metrics.snapshot()["counters"]["analytics.spilled"] == spilled + 3
+    finally:
+        for patch in patches:
+            patch.stop()
+
+    # Without a spill file overflowing events are dropped
+    queue = AnalyticsQueue(maxsize=1, batch_size=25, flush_interval=0.01, spill_path="", spill_max_bytes=0)
+    dropped = metrics.snapshot()["counters"].get("analytics.dropped", 0)
+    queue.put({"name": "a", "params": {}})
+    queue.put({"name": "b", "params": {}})
+    assert metrics.snapshot()["counters"]["analytics.dropped"] == dropped + 1
+
+
+class _SlowClient:
+    """Client whose first `hanging` requests hang until they are cancelled; later ones succeed"""
+
+    is_closed = False
+
+    def __init__(self, hanging: int):
+        self.hanging = hanging
+        self.payloads = []
+
+    async def post(self, url, json):
+        self.payloads.append(json)
+        if len(self.payloads) <= self.hanging:
+            await asyncio.sleep(60)
+        return httpx.Response(204, request=httpx.Request("POST", url))
+
+
+def test_batch_in_flight_at_stop_is_sent_again():
+    async def run(spill_path):
+        queue = AnalyticsQueue(maxsize=10, batch_size=25, flush_interval=0.01, spill_path=spill_path, spill_max_bytes=10_000)
+        slow_client = _SlowClient(hanging=1)
+        with mock.patch.object(firebase_utils, "client", slow_client):
+            for i in range(3):
+                queue.put({"name": "e", "params": {"i": i}})
+            queue.start()
+            await _wait_for(lambda: len(slow_client.payloads) == 1)
+            await queue.stop()
+        return slow_client.payloads
+
+    with tempfile.TemporaryDirectory() as directory:
+        payloads = asyncio.run(run(os.path.join(directory, "spill.jsonl")))
+    # The send cancelled by stop() is flushed again instead of being lost
+    assert len(payloads) == 2
+    assert payloads[1]["events"] == payloads[0]["events"]
+    assert [e["params"]["i"] for e in payloads[1]["events"]] == [0, 1, 2]
+
+
+def test_batch_in_flight_at_stop_is_spilled_when_the_flush_times_out():
+    async def run(spill_path):
+        queue = AnalyticsQueue(maxsize=10, batch_size=25, flush_interval=0.01, spill_path=spill_path, spill_max_bytes=10_000)
+        slow_client = _SlowClient(hanging=2)
+        with mock.patch.object(firebase_utils, "client", slow_client):
+            for i in range(3):
+                queue.put({"name": "e", "params": {"i": i}})
+            queue.start()
+            await _wait_for(lambda: len(slow_client.payloads) == 1)
+            await queue.stop(timeout=0.1)
+
+    with tempfile.TemporaryDirectory() as directory:
+        spill_path = os.path.join(directory, "spill.jsonl")
+        asyncio.run(run(spill_path))
+        with open(spill_path, encoding="utf-8") as f:
+            assert len(f.read().splitlines()) == 3
+
+
+def test_track_event_does_not_wait_for_the_network():
+    async def run():
+        queue = AnalyticsQueue(maxsize=10, batch_size=25, flush_interval=0.01, spill_path="", spill_max_bytes=0)
+        with mock.patch.object(firebase_utils, "analytics_queue", queue), \
+                mock.patch.object(settings, "FIREBASE_ANALYTICS_ENABLED", True), \
+                mock.patch.object(settings, "GA_MEASUREMENT_ID", "G-TEST"), \
+                mock.patch.object(settings, "GA_API_SECRET", "secret"):
+            start = time.perf_counter()
+            await track_event("conversion_requested", {"format": "docx"}, user_ip="1.2.3.4")
+            assert time.perf_counter() - start < 0.05
+        assert queue.stats()["queued"] == 1
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_events_are_sent_in_batches_of_25()
+    test_overflow_is_spilled_and_sent_later()
+    test_batch_in_flight_at_stop_is_sent_again()
+    test_batch_in_flight_at_stop_is_spilled_when_the_flush_times_out()
+    test_track_event_does_not_wait_for_the_network()
+    print("All analytics queue checks passed")
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Checks for the batch conversion endpoint (/api/convert/batch)
+"""
+import io
+import json
+import os
+import sys
+import zipfile
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from fastapi.testclient import TestClient
+
+from app.batch import build_batch
+from app.main import app
+
+
+def test_document_names_are_safe_and_unique():
+    documents = build_batch([
+        {"name": "../report.md", "text": "a"},
+        {"name": "report.md", "text": "b"},
+        {"name": None, "text": "c"},
+    ])
+    assert [d.name for d in documents] == ["report", "report_2", "document_003"]
+
+
+def test_batch_zip_reports_errors_per_document():
+    with TestClient(app) as client:
+        response = client.post("/api/convert/batch", json={
+            "format": "docx",
+            "documents": [
+                {"name": "first", "text": "# سلام\n\nمتن اول با Python."},
+                "## دوم\n\nمتن دوم.",
+                {"name": "empty", "text": "   "},
+            ],
+        })
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/zip"
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        names = set(archive.namelist())
+        manifest = json.loads(archive.read("manifest.json"))
+        assert names == {"first.docx", "document_002.docx", "manifest.json"}
+        with zipfile.ZipFile(io.BytesIO(archive.read("first.docx"))) as docx:
+            assert "word/document.xml" in docx.namelist()
+    assert manifest["succeeded"] == 2 and manifest["failed"] == 1
+    assert [entry["status"] for entry in manifest["documents"]] == ["ok", "ok", "error"]
+    assert manifest["documents"][2]["error"] == "Document is empty"
+
+
+def test_batch_accepts_multipart_uploads():
+    with TestClient(app) as client:
+        response = client.post(
+            "/api/convert/batch",
+            data={"format": "docx", "texts": ["متن ساده"]},
+            files=[("files", ("notes.md", "# یادداشت".encode("utf-8"), "text/markdown"))],
+        )
+        assert response.status_code == 200
+        with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+            assert set(archive.namelist()) == {"notes.docx", "document_002.docx", "manifest.json"}
+
+        too_many = client.post("/api/convert/batch", json={"documents": ["x"] * 1000})
+        assert too_many.status_code == 400
+
+
+if __name__ == "__main__":
+    test_document_names_are_safe_and_unique()
+    test_batch_zip_reports_errors_per_document()
+    test_batch_accepts_multipart_uploads()
+    print("All batch conversion checks passed")
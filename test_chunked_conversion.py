@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Checks for chunked conversion of large documents (app/chunked.py, app/docx_merge.py)
+"""
+import io
+import os
+import re
+import sys
+import zipfile
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app.chunked import split_markdown, convert_in_chunks
+from app.config import settings
+from app.converter import convert_chunk
+from app.docx_merge import merge_docx
+
+SECTION = """# فصل {i}
+
+متن فصل {i} با Python و یک فهرست:
+
+- مورد اول
+- مورد دوم
+
+```
+# not a heading {i}
+```
+
+| ستون | مقدار |
+|------|-------|
+| {i}  | ۲     |
+"""
+
+
+def _document_xml(docx: bytes) -> str:
+    with zipfile.ZipFile(io.BytesIO(docx)) as archive:
+        return archive.read("word/document.xml").decode("utf-8")
+
+
+def _numbering_xml(docx: bytes) -> str:
+    with zipfile.ZipFile(io.BytesIO(docx)) as archive:
+        return archive.read("word/numbering.xml").decode("utf-8")
+
+
+def test_split_at_top_level_headings_outside_code():
+    text = "---\ntitle: کتاب\n---\n\n" + "\n".join(SECTION.format(i=i) for i in range(4))
+    pieces = split_markdown(text, 1)
+    assert len(pieces) == 4
+    assert pieces[0].startswith("---\ntitle: کتاب")
+    assert all(piece.startswith("# فصل") for piece in pieces[1:])
+    assert "\n".join(pieces) == text
+    # Code fences are never split, and small targets group sections together
+    assert all(piece.count("```") == 2 for piece in pieces)
+    assert len(split_markdown(text, len(text.encode("utf-8")) // 2)) == 2
+
+
+def test_cross_references_prevent_splitting():
+    assert split_markdown("# یک\n\nمتن [پیوند][a]\n\n# دو\n\n[a]: https://example.com\n", 1) is None
+    assert split_markdown("# یک\n\nمتن^[یادداشت]\n\n# دو\n", 1) is None
+    assert split_markdown("بدون عنوان\n", 1) is None
+
+
+def test_chunked_conversion_matches_document_order():
+    text = "\n".join(SECTION.format(i=i) for i in range(6))
+    previous = settings.CHUNKED_CONVERSION_MIN_BYTES, settings.CHUNK_TARGET_BYTES
+    settings.CHUNKED_CONVERSION_MIN_BYTES, settings.CHUNK_TARGET_BYTES = 1, 1
+    try:
+        data = convert_in_chunks(text, convert_chunk, "docx")
+    finally:
+        settings.CHUNKED_CONVERSION_MIN_BYTES, settings.CHUNK_TARGET_BYTES = previous
+    assert data is not None
+    document_xml = _document_xml(data)
+    positions = [document_xml.index(f"فصل {i}") for i in range(6)]
+    assert positions == sorted(positions)
+    assert document_xml.count("<w:sectPr") == 1
+    # Each list keeps its own numbering instance, defined once in the merged numbering.xml
+    used = list(dict.fromkeys(re.findall(r'<w:numId w:val="(\d+)"', document_xml)))
+    assert len(used) == 6
+    numbering_xml = _numbering_xml(data)
+    nums = re.findall(r'<w:num w:numId="(\d+)"[^>]*>\s*<w:abstractNumId w:val="(\d+)"', numbering_xml)
+    abstracts = re.findall(r'<w:abstractNum [^>]*w:abstractNumId="(\d+)"', numbering_xml)
+    assert len(nums) == len(dict(nums)) and len(abstracts) == len(set(abstracts))
+    abstract_of = dict(nums)
+    assert all(num_id in abstract_of for num_id in used)
+    # ... each pointing at an abstract definition of its own
+    assert len({abstract_of[num_id] for num_id in used}) == 6
+    assert all(abstract_of[num_id] in abstracts for num_id in used)
+
+
+def test_merge_of_a_single_part_is_a_no_op():
+    data = convert_chunk(0, SECTION.format(i=1), "docx")
+    assert merge_docx([data]) is data
+
+
+if __name__ == "__main__":
+    test_split_at_top_level_headings_outside_code()
+    test_cross_references_prevent_splitting()
+    test_chunked_conversion_matches_document_order()
+    test_merge_of_a_single_part_is_a_no_op()
+    print("All chunked conversion checks passed")
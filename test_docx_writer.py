@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Checks for the native DOCX writer (app/docx_writer.py)
+"""
+import io
+import os
+import re
+import sys
+import zipfile
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app import converter, metrics
+from app.converter import get_reference_docx, run_conversion_in_memory
+from app.docx_writer import UnsupportedMarkdown, render_docx
+
+DOCUMENT = """# گزارش ماهانه
+
+این یک **متن پررنگ** و *کج* با Python است.
+خط دوم همان پاراگراف.
+
+## فهرست کارها
+
+1. طراحی
+2. پیاده‌سازی
+   - بخش اول
+   - بخش دوم
+3. آزمون
+
+متن میانی
+
+1. دوباره از یک
+2. دو
+
+| ستون ۱ | ستون ۲ |
+|:---|---:|
+| الف | **ب** |
+| ج | د |
+"""
+
+
+# Preprocessing keeps bullet lists as they are (numbers get LTR spans)
+PLAIN_DOCUMENT = """# گزارش
+
+پاراگراف با **تأکید** و Python و API.
+
+- مورد اول
+- مورد دوم
+  - زیرمورد
+
+| نام | مقدار |
+|---|---|
+| الف | ۱ |
+"""
+
+
+def _document_xml(data: bytes) -> str:
+    with zipfile.ZipFile(io.BytesIO(data)) as docx:
+        return docx.read("word/document.xml").decode("utf-8")
+
+
+def _paragraph_texts(data: bytes):
+    from docx import Document
+    document = Document(io.BytesIO(data))
+    texts = [paragraph.text for paragraph in document.paragraphs]
+    for table in document.tables:
+        texts.extend(cell.text for row in table.rows for cell in row.cells)
+    return texts
+
+
+def test_rtl_and_pagination_properties_are_written_directly():
+    data = render_docx("---\nlang: fa\ndir: rtl\n---\n\n" + DOCUMENT, str(get_reference_docx()))
+    xml = _document_xml(data)
+    paragraphs = re.findall(r"<w:p>.*?</w:p>", xml)
+    assert paragraphs and all("<w:bidi/>" in p and "<w:keepLines/>" in p for p in paragraphs)
+    assert all("<w:keepNext/>" in p for p in paragraphs if "Heading" in p)
+    assert xml.count("<w:cantSplit/>") == 3 and xml.count("<w:tblHeader/>") == 1
+    # The second numbered list restarts at 1 with its own numbering instance
+    with zipfile.ZipFile(io.BytesIO(data)) as docx:
+        numbering = docx.read("word/numbering.xml").decode("utf-8")
+        assert "docProps/thumbnail.jpeg" not in docx.namelist()
+    assert len(re.findall(r'<w:num w:numId="10\d\d">', numbering)) == 2
+    assert len(set(re.findall(r'<w:numId w:val="(10\d\d)"/>', xml))) == 2
+
+
+def test_unsupported_markdown_is_reported():
+    reference = str(get_reference_docx())
+    for text in ("```\ncode\n```", "> نقل قول", "[پیوند](http://example.com)", "متن `کد`",
+                 "**باز نشده", "پاراگراف\n- فهرست بدون خط خالی", "---\ntitle: عنوان\n---\n\nمتن"):
+        try:
+            render_docx(text, reference)
+        except UnsupportedMarkdown:
+            continue
+        raise AssertionError(f"Rendered unsupported Markdown: {text!r}")
+
+
+def test_conversion_matches_pandoc_text_and_falls_back():
+    rendered = metrics.snapshot()["counters"].get("native_docx.rendered", 0)
+    native = run_conversion_in_memory(PLAIN_DOCUMENT, "docx")
+    assert metrics.snapshot()["counters"]["native_docx.rendered"] == rendered + 1
+    with mock.patch.object(converter, "NATIVE_DOCX_ENABLED", False):
+        pandoc = run_conversion_in_memory(PLAIN_DOCUMENT, "docx")
+    assert _paragraph_texts(native) == _paragraph_texts(pandoc)
+
+    before = metrics.snapshot()["counters"].get("native_docx.fallbacks", 0)
+    data = run_conversion_in_memory("# عنوان\n\n```python\nprint(1)\n```\n", "docx")
+    assert "word/document.xml" in zipfile.ZipFile(io.BytesIO(data)).namelist()
+    assert metrics.snapshot()["counters"]["native_docx.fallbacks"] == before + 1
+
+
+if __name__ == "__main__":
+    test_rtl_and_pagination_properties_are_written_directly()
+    test_unsupported_markdown_is_reported()
+    test_conversion_matches_pandoc_text_and_falls_back()
+    print("All native DOCX writer checks passed")
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Checks for the cleanup of OUT_DIR files (app/expiry.py)
+"""
+import os
+import sys
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from fastapi.testclient import TestClient
+
+from app.config import settings, OUT_DIR
+from app.expiry import Sweeper
+
+
+def test_sweeper_keeps_running_tasks_after_a_failure():
+    calls = []
+
+    def failing():
+        raise OSError("disk gone")
+
+    Sweeper(60, [failing, lambda: calls.append("ran")]).run_once()
+    assert calls == ["ran"]
+
+
+def _output_files():
+    return {os.path.join(root, name) for root, _, names in os.walk(OUT_DIR) for name in names}
+
+
+def test_downloaded_outputs_are_removed_unless_persisted():
+    from app.main import app
+    with mock.patch.object(settings, "IN_MEMORY_CONVERSION", False), \
+            mock.patch.object(settings, "RESULT_CACHE_ENABLED", False):
+        with TestClient(app) as client:
+            before = _output_files()
+            response = client.post("/api/convert", data={"text": "# موقت", "format": "docx"})
+            assert response.status_code == 200
+            assert _output_files() - before == set()
+
+            response = client.post("/api/convert", data={"text": "# ماندگار", "format": "docx", "persist": "true"})
+            assert response.status_code == 200
+            kept = _output_files() - before
+            assert len(kept) == 1 and kept.pop().endswith(".docx")
+
+
+if __name__ == "__main__":
+    test_sweeper_keeps_running_tasks_after_a_failure()
+    test_downloaded_outputs_are_removed_unless_persisted()
+    print("All expiry checks passed")
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Checks for incremental reconversion (app/incremental.py, /api/convert/incremental)
+"""
+import asyncio
+import io
+import os
+import sys
+import zipfile
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from fastapi.testclient import TestClient
+
+from app.incremental import split_blocks
+from app import main
+from app.main import app
+from app.worker_pool import ConversionPool
+
+SECTION = """## بخش {i}
+
+متن بخش {i} با Python.
+
+- مورد اول
+- مورد دوم
+"""
+
+
+def _document(edited: int = None) -> str:
+    sections = [SECTION.format(i=i) for i in range(5)]
+    if edited is not None:
+        sections[edited] = sections[edited].replace("متن بخش", "متن ویرایش‌شده بخش")
+    return "# عنوان\n\n" + "\n".join(sections)
+
+
+def _document_xml(docx: bytes) -> str:
+    with zipfile.ZipFile(io.BytesIO(docx)) as archive:
+        return archive.read("word/document.xml").decode("utf-8")
+
+
+def test_blocks_start_at_every_heading():
+    blocks = split_blocks(_document())
+    assert len(blocks) == 5
+    assert blocks[0].startswith("# عنوان")
+    assert "\n".join(blocks) == _document()
+    assert split_blocks("بدون عنوان\n") == ["بدون عنوان\n"]
+    # Headings without a body of their own stay with the block after them (or before, at the end)
+    assert split_blocks("# الف\n\n## ب\n\nمتن\n\n## پ\n") == ["# الف\n\n## ب\n\nمتن\n\n## پ\n"]
+
+
+def test_resubmission_renders_only_changed_blocks():
+    client = TestClient(app)
+    first = client.post("/api/convert/incremental", data={"text": _document(), "format": "docx"})
+    assert first.status_code == 200
+    session_id = first.headers["X-Session-Id"]
+    assert first.headers["X-Blocks-Rendered"] == first.headers["X-Blocks"] == "5"
+
+    second = client.post(
+        "/api/convert/incremental",
+        data={"text": _document(edited=3), "format": "docx"},
+        headers={"X-Session-Id": session_id},
+    )
+    assert second.status_code == 200
+    assert second.headers["X-Session-Id"] == session_id
+    assert second.headers["X-Blocks-Rendered"] == "1"
+    document_xml = _document_xml(second.content)
+    assert "ویرایش" in document_xml
+    positions = [document_xml.index(f"بخش {i}") for i in range(5)]
+    assert positions == sorted(positions)
+
+    assert client.delete(f"/api/convert/incremental/{session_id}").status_code == 204
+    assert client.delete(f"/api/convert/incremental/{session_id}").status_code == 404
+
+
+def test_invalid_session_id_is_rejected():
+    client = TestClient(app)
+    response = client.post("/api/convert/incremental", data={"text": "# متن", "session": "../x"})
+    assert response.status_code == 400
+
+
+def test_saturated_pool_rejects_with_retry_after():
+    saturated = ConversionPool(workers=1, queue_limit=0)
+    saturated._slots = asyncio.Semaphore(0)
+    with mock.patch.object(main, "conversion_pool", saturated):
+        response = TestClient(app).post("/api/convert/incremental", data={"text": _document(), "format": "docx"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(main.settings.CONVERT_RETRY_AFTER)
+
+
+if __name__ == "__main__":
+    test_blocks_start_at_every_heading()
+    test_resubmission_renders_only_changed_blocks()
+    test_invalid_session_id_is_rejected()
+    test_saturated_pool_rejects_with_retry_after()
+    print("All incremental conversion checks passed")
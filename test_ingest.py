@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Checks for streamed request ingestion (app/ingest.py)
+"""
+import asyncio
+import io
+import os
+import sys
+import zipfile
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from fastapi.testclient import TestClient
+
+from app.ingest import BodySizeLimitMiddleware, parse_urlencoded, utf8_size_exceeds
+from app.main import app, settings
+
+
+def _is_docx(content: bytes) -> bool:
+    with zipfile.ZipFile(io.BytesIO(content)) as docx:
+        return "word/document.xml" in docx.namelist()
+
+
+def test_urlencoded_values_stay_bytes():
+    pairs = parse_urlencoded("text=%D8%B3%D9%84%D8%A7%D9%85+%DB%B1&format=docx&flag".encode("ascii"))
+    assert pairs == [(b"text", "سلام ۱".encode("utf-8")), (b"format", b"docx"), (b"flag", b"")]
+    assert not utf8_size_exceeds("سلام", 8) and utf8_size_exceeds("سلام", 7)
+
+
+def test_raw_markdown_body_and_file_upload_are_converted():
+    with TestClient(app) as client:
+        response = client.post(
+            "/api/convert?format=docx",
+            content="# سلام\n\nمتن خام".encode("utf-8"),
+            headers={"Content-Type": "text/markdown; charset=utf-8"},
+        )
+        assert response.status_code == 200 and _is_docx(response.content)
+
+        response = client.post(
+            "/api/convert",
+            data={"format": "docx"},
+            files={"file": ("note.md", "# فایل\n\nمتن".encode("utf-8"), "text/markdown")},
+        )
+        assert response.status_code == 200 and _is_docx(response.content)
+
+        response = client.post("/api/convert", content=b"{}", headers={"Content-Type": "application/json"})
+        assert response.status_code == 415
+        response = client.post("/api/convert", data={"format": "docx"})
+        assert response.status_code == 422
+
+
+def test_middleware_stops_reading_past_the_limit():
+    received, sent = [], []
+
+    async def app(scope, receive, send):
+        while True:
+            message = await receive()
+            received.append(message)
+            if not message.get("more_body"):
+                break
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    async def receive():
+        # Chunked upload without Content-Length
+        return {"type": "http.request", "body": b"#" * 8192, "more_body": True}
+
+    async def send(message):
+        sent.append(message)
+
+    middleware = BodySizeLimitMiddleware(app, limit_for=lambda scope: 20_000)
+    asyncio.run(middleware({"type": "http", "path": "/api/convert", "headers": []}, receive, send))
+    assert len(received) == 2
+    assert [m.get("status") for m in sent if m["type"] == "http.response.start"] == [413]
+
+
+def test_oversized_bodies_are_rejected_while_reading():
+    with mock.patch.object(settings, "MAX_INPUT_SIZE", 100), TestClient(app) as client:
+        # Declared too large: rejected before the body is read
+        response = client.post("/api/convert", content=b"#" * 70_000, headers={"Content-Type": "text/markdown"})
+        assert response.status_code == 413
+
+        # Within the body limit but over the text limit: exact check on the received bytes
+        response = client.post("/api/convert", content="س".encode("utf-8") * 51, headers={"Content-Type": "text/markdown"})
+        assert response.status_code == 413
+        response = client.post("/api/convert", data={"text": "س" * 51, "format": "docx"})
+        assert response.status_code == 413
+        response = client.post("/api/convert", data={"text": "س" * 50, "format": "docx"})
+        assert response.status_code == 200
+
+
+if __name__ == "__main__":
+    test_urlencoded_values_stay_bytes()
+    test_raw_markdown_body_and_file_upload_are_converted()
+    test_middleware_stops_reading_past_the_limit()
+    test_oversized_bodies_are_rejected_while_reading()
+    print("All ingestion checks passed")
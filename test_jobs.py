@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Checks for the asynchronous job API (app/jobs.py, /api/jobs)
+"""
+import asyncio
+import io
+import os
+import sys
+import tempfile
+import time
+import uuid
+import zipfile
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from fastapi.testclient import TestClient
+
+from app.jobs import JobManager, MemoryJobStore, SqliteJobStore, FAILED
+from app.main import app
+
+
+def test_job_lifecycle_through_the_api():
+    with TestClient(app) as client:
+        response = client.post("/api/jobs", data={"text": "# گزارش\n\nمتن طولانی با Python.", "format": "docx"})
+        assert response.status_code == 202
+        job = response.json()
+        assert job["status"] in ("queued", "running", "done")
+
+        deadline = time.time() + 30
+        while job["status"] not in ("done", "failed") and time.time() < deadline:
+            time.sleep(0.05)
+            job = client.get(job["status_url"]).json()
+        assert job["status"] == "done", job
+        assert "progress" not in job and job["run_seconds"] is not None
+
+        result = client.get(job["result_url"])
+        assert result.status_code == 200
+        with zipfile.ZipFile(io.BytesIO(result.content)) as docx:
+            assert "word/document.xml" in docx.namelist()
+
+        assert client.get(f"/api/jobs/{uuid.uuid4().hex}").status_code == 404
+        assert client.get("/api/jobs/../../etc/passwd").status_code == 404
+
+
+def test_sqlite_store_is_shared_between_instances():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "jobs.sqlite3")
+        writer, reader = SqliteJobStore(path), SqliteJobStore(path)
+        writer.create({"id": "a" * 32, "status": "queued", "created_at": 100.0})
+        writer.update("a" * 32, status="done", result_size=10)
+        assert reader.get("a" * 32) == {"id": "a" * 32, "status": "done", "created_at": 100.0, "result_size": 10}
+        assert reader.expired(cutoff=200.0) == ["a" * 32]
+        reader.delete("a" * 32)
+        assert writer.get("a" * 32) is None
+
+
+def test_failed_job_reports_its_error():
+    async def run():
+        with tempfile.TemporaryDirectory() as directory:
+            manager = JobManager(MemoryJobStore(), directory, concurrency=1, ttl_seconds=3600, timeout=0)
+            # A block quote needs Pandoc (the native writer does not render it), which times out
+            job = await manager.submit(f"# {uuid.uuid4().hex}\n\n> نقل قول", "docx")
+            await asyncio.gather(*manager._tasks)
+            return manager.describe(await manager.get(job["id"]))
+
+    job = asyncio.run(run())
+    assert job["status"] == FAILED
+    assert "timed out" in job["error"]
+
+
+def test_shutdown_records_cancelled_jobs_as_failed():
+    async def slow_convert(text, fmt, result_path):
+        await asyncio.sleep(60)
+
+    async def run():
+        with tempfile.TemporaryDirectory() as directory:
+            manager = JobManager(MemoryJobStore(), directory, concurrency=1, ttl_seconds=3600, timeout=60)
+            with mock.patch.object(manager, "_convert", slow_convert):
+                running = await manager.submit("# یک", "docx")
+                queued = await manager.submit("# دو", "docx")
+                await asyncio.sleep(0.1)
+                await manager.shutdown()
+            return [await manager.get(job["id"]) for job in (running, queued)]
+
+    for job in asyncio.run(run()):
+        assert job["status"] == FAILED
+        assert "shut down" in job["error"]
+
+
+if __name__ == "__main__":
+    test_job_lifecycle_through_the_api()
+    test_sqlite_store_is_shared_between_instances()
+    test_failed_job_reports_its_error()
+    test_shutdown_records_cancelled_jobs_as_failed()
+    print("All job API checks passed")
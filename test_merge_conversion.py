@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Checks for merging several Markdown documents into one DOCX (/api/convert/merge)
+"""
+import io
+import os
+import sys
+import zipfile
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from fastapi.testclient import TestClient
+
+from app.converter import merge_markdown_sources, PANDOC_DOCX_PAGE_BREAK
+from app.main import app
+
+
+def _document_xml(docx: bytes) -> str:
+    with zipfile.ZipFile(io.BytesIO(docx)) as archive:
+        return archive.read("word/document.xml").decode("utf-8")
+
+
+def test_sources_are_joined_in_order_with_page_breaks():
+    merged = merge_markdown_sources(["# یک", "# دو", "# سه"])
+    assert merged.count(PANDOC_DOCX_PAGE_BREAK) == 2
+    assert merged.index("# یک") < merged.index("# دو") < merged.index("# سه")
+    assert PANDOC_DOCX_PAGE_BREAK not in merge_markdown_sources(["# یک", "# دو"], page_breaks=False)
+
+
+def test_merge_produces_one_document_with_toc():
+    with TestClient(app) as client:
+        response = client.post("/api/convert/merge", json={
+            "documents": ["# فصل اول\n\nمتن اول", {"name": "two", "text": "# فصل دوم\n\nمتن دوم با Python"}],
+            "toc": True,
+        })
+    assert response.status_code == 200
+    document_xml = _document_xml(response.content)
+    assert document_xml.index("فصل اول") < document_xml.index("فصل دوم")
+    assert "TOC" in document_xml and "فهرست مطالب" in document_xml
+    assert document_xml.count('w:type="page"') == 1
+
+
+def test_merge_accepts_a_zip_of_markdown_files():
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as z:
+        z.writestr("chapters/02.md", "# دوم")
+        z.writestr("chapters/01.md", "# اول")
+        z.writestr("images/cover.png", b"not markdown")
+    with TestClient(app) as client:
+        response = client.post(
+            "/api/convert/merge",
+            data={"page_breaks": "false"},
+            files=[("files", ("book.zip", archive.getvalue(), "application/zip"))],
+        )
+        assert response.status_code == 200
+        document_xml = _document_xml(response.content)
+        assert document_xml.index("اول") < document_xml.index("دوم")
+        assert 'w:type="page"' not in document_xml
+
+        broken = client.post("/api/convert/merge", files=[("files", ("book.zip", b"not a zip", "application/zip"))])
+        assert broken.status_code == 400
+
+
+if __name__ == "__main__":
+    test_sources_are_joined_in_order_with_page_breaks()
+    test_merge_produces_one_document_with_toc()
+    test_merge_accepts_a_zip_of_markdown_files()
+    print("All merge conversion checks passed")
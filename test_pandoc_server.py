@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Checks for the pandoc server pool (app/pandoc_server.py), against a fake
+`pandoc server` executable, and for the subprocess fallback of the converter
+"""
+import base64
+import io
+import os
+import stat
+import sys
+import tempfile
+import zipfile
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app import converter, metrics
+from app.pandoc_server import PandocServerError, PandocServerPool
+
+# Answers GET /version and echoes the posted text back, base64-encoded. A text of
+# "crash" kills the server, "fail" reports a conversion error and "sicken" makes
+# later health checks fail.
+FAKE_PANDOC = """#!{python}
+import base64, json, os, sys
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+port = int(sys.argv[sys.argv.index("--port") + 1])
+state = {{"healthy": True}}
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._reply(200 if state["healthy"] else 500, {{"version": "fake"}})
+
+    def do_POST(self):
+        text = json.loads(self.rfile.read(int(self.headers["Content-Length"])))["text"]
+        if text == "crash":
+            os._exit(1)
+        if text == "fail":
+            return self._reply(200, {{"error": "bad input"}})
+        if text == "sicken":
+            state["healthy"] = False
+        self._reply(200, {{"output": base64.b64encode(f"{{port}}:{{text}}".encode()).decode(), "base64": True}})
+
+HTTPServer(("127.0.0.1", port), Handler).serve_forever()
+"""
+
+
+def _fake_pandoc(directory: str) -> str:
+    path = os.path.join(directory, "pandoc")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(FAKE_PANDOC.format(python=sys.executable))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return path
+
+
+def _counter(name: str) -> int:
+    return metrics.snapshot()["counters"].get(name, 0)
+
+
+def test_healthy_server_converts_and_is_reused():
+    with tempfile.TemporaryDirectory() as directory:
+        pool = PandocServerPool(size=1, max_jobs=0, timeout=10, executable=_fake_pandoc(directory))
+        try:
+            first = pool.convert({"text": "one"}).decode()
+            second = pool.convert({"text": "two"}).decode()
+            port = first.split(":")[0]
+            assert first == f"{port}:one" and second == f"{port}:two"
+        finally:
+            pool.shutdown()
+
+
+def test_conversion_errors_keep_the_server():
+    with tempfile.TemporaryDirectory() as directory:
+        pool = PandocServerPool(size=1, max_jobs=0, timeout=10, executable=_fake_pandoc(directory))
+        try:
+            port = pool.convert({"text": "one"}).decode().split(":")[0]
+            try:
+                pool.convert({"text": "fail"})
+                assert False, "a conversion error should raise"
+            except PandocServerError as e:
+                assert "bad input" in str(e)
+            assert pool.convert({"text": "two"}).decode() == f"{port}:two"
+        finally:
+            pool.shutdown()
+
+
+def test_crashed_server_is_restarted_on_next_checkout():
+    with tempfile.TemporaryDirectory() as directory:
+        pool = PandocServerPool(size=1, max_jobs=0, timeout=10, executable=_fake_pandoc(directory))
+        try:
+            port = pool.convert({"text": "one"}).decode().split(":")[0]
+            crashes, restarts = _counter("pandoc_server.crashes"), _counter("pandoc_server.restarts")
+            try:
+                pool.convert({"text": "crash"})
+                assert False, "a crashed server should raise"
+            except PandocServerError:
+                pass
+            # The request that hit the crash may return before the process is reaped
+            server = pool._idle.queue[0]
+            server.process.wait(timeout=5)
+            restarted = pool.convert({"text": "two"}).decode()
+            assert restarted.endswith(":two") and restarted.split(":")[0] != port
+            assert _counter("pandoc_server.restarts") == restarts + 1
+            assert _counter("pandoc_server.crashes") <= crashes + 1
+        finally:
+            pool.shutdown()
+
+
+def test_unhealthy_server_is_restarted():
+    with tempfile.TemporaryDirectory() as directory:
+        pool = PandocServerPool(size=1, max_jobs=0, timeout=10, executable=_fake_pandoc(directory))
+        try:
+            port = pool.convert({"text": "sicken"}).decode().split(":")[0]
+            # Force a health check on the next checkout
+            pool._idle.queue[0].last_checked = 0.0
+            assert pool.convert({"text": "two"}).decode().split(":")[0] != port
+        finally:
+            pool.shutdown()
+
+
+def test_server_is_recycled_after_max_jobs():
+    with tempfile.TemporaryDirectory() as directory:
+        pool = PandocServerPool(size=1, max_jobs=2, timeout=10, executable=_fake_pandoc(directory))
+        try:
+            recycles = _counter("pandoc_server.recycles")
+            ports = [pool.convert({"text": str(i)}).decode().split(":")[0] for i in range(3)]
+            assert ports[0] == ports[1] != ports[2]
+            assert _counter("pandoc_server.recycles") == recycles + 1
+        finally:
+            pool.shutdown()
+
+
+def test_start_failure_backs_off():
+    pool = PandocServerPool(size=1, timeout=10, executable="/nonexistent/pandoc")
+    try:
+        pool.convert({"text": "one"})
+        assert False, "a missing executable should raise"
+    except PandocServerError:
+        pass
+    assert not pool.available()
+    try:
+        pool.convert({"text": "one"})
+        assert False, "the pool should refuse work while backing off"
+    except PandocServerError as e:
+        assert "temporarily unavailable" in str(e)
+
+
+def test_converter_falls_back_to_a_pandoc_subprocess():
+    broken = PandocServerPool(size=1, timeout=10, executable="/nonexistent/pandoc")
+    fallbacks = _counter("pandoc_server.fallbacks")
+    with mock.patch.object(converter, "PANDOC_SERVER_ENABLED", True), \
+            mock.patch.object(converter, "NATIVE_DOCX_ENABLED", False), \
+            mock.patch.object(converter, "pandoc_server_pool", broken):
+        data = converter.render_markdown_bytes("# عنوان\n\nمتن", "docx")
+    assert _counter("pandoc_server.fallbacks") == fallbacks + 1
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert "عنوان" in archive.read("word/document.xml").decode("utf-8")
+
+
+def test_payload_carries_the_reference_document():
+    with tempfile.TemporaryDirectory() as directory:
+        reference_path = Path(directory, "reference.docx")
+        reference_path.write_bytes(b"reference")
+        payload = converter._pandoc_server_payload("# متن", reference_path, toc=True)
+    assert payload["to"] == "docx" and payload["table-of-contents"] is True
+    assert payload["reference-doc"] == "reference.docx"
+    assert base64.b64decode(payload["files"]["reference.docx"]) == b"reference"
+
+
+if __name__ == "__main__":
+    test_healthy_server_converts_and_is_reused()
+    test_conversion_errors_keep_the_server()
+    test_crashed_server_is_restarted_on_next_checkout()
+    test_unhealthy_server_is_restarted()
+    test_server_is_recycled_after_max_jobs()
+    test_start_failure_backs_off()
+    test_converter_falls_back_to_a_pandoc_subprocess()
+    test_payload_carries_the_reference_document()
+    print("All pandoc server checks passed")
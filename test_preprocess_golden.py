@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Golden corpus for preprocess_text: golden/preprocess/<name>.md must produce
+<name>.expected.md byte for byte, on both the fused and the multipass path
+"""
+import glob
+import os
+import sys
+import unicodedata
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app.utils.text_processor import EnhancedFarsiTextProcessor
+
+GOLDEN_DIR = os.path.join(os.path.dirname(__file__), 'golden', 'preprocess')
+
+
+def _corpus():
+    for path in sorted(glob.glob(os.path.join(GOLDEN_DIR, '*.md'))):
+        if path.endswith('.expected.md'):
+            continue
+        with open(path, encoding='utf-8') as f:
+            source = f.read()
+        with open(path[:-len('.md')] + '.expected.md', encoding='utf-8') as f:
+            expected = f.read()
+        yield os.path.basename(path), source, expected
+
+
+def test_preprocess_matches_golden():
+    processor = EnhancedFarsiTextProcessor()
+    for name, source, expected in _corpus():
+        assert processor.preprocess_text(source) == expected, name
+
+
+def test_fused_and_multipass_paths_agree():
+    processor = EnhancedFarsiTextProcessor()
+    fused_documents = 0
+    for name, source, expected in _corpus():
+        text = unicodedata.normalize('NFKC', source)
+        assert processor._preprocess_multipass(text) == expected, name
+        if processor._can_fuse(text):
+            assert processor._preprocess_fused(text) == expected, name
+            fused_documents += 1
+    assert fused_documents >= 4
+
+
+def test_term_across_lines_uses_multipass():
+    processor = EnhancedFarsiTextProcessor()
+    assert not processor._can_fuse("برای گرفتن Access\nToken")
+    assert not processor._can_fuse("متن __PROTECTED_CODE_0__")
+    assert processor._can_fuse("برای گرفتن Access Token")
+
+
+if __name__ == "__main__":
+    test_preprocess_matches_golden()
+    test_fused_and_multipass_paths_agree()
+    test_term_across_lines_uses_multipass()
+    print("All golden preprocessing checks passed")
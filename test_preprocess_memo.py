@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Checks for the preprocessing memo (app/utils/memo.py)
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app import metrics
+from app.utils.memo import ByteBudgetLRU
+from app.utils.text_processor import enhanced_processor, preprocess_farsi_text, preprocess_memo
+
+
+def test_lru_stays_within_byte_budget():
+    memo = ByteBudgetLRU(max_bytes=250, name="test_memo", sizeof=len)
+    memo.put("a", "a" * 100)
+    memo.put("b", "b" * 100)
+    assert memo.get("a") == "a" * 100  # "a" is now the most recently used
+    memo.put("c", "c" * 100)
+    assert memo.get("b") is None
+    assert memo.get("a") is not None and memo.get("c") is not None
+    memo.put("huge", "x" * 1000)  # larger than the whole budget, not stored
+    assert memo.get("huge") is None
+    assert memo.stats() == {"entries": 2, "bytes": 200, "max_bytes": 250}
+
+
+def test_repeated_input_is_served_from_memo():
+    preprocess_memo.clear()
+    text = "# عنوان\n\nاین یک متن با Python و `code` است, آیا?"
+    hits = metrics.snapshot()["counters"].get("preprocess_memo.hits", 0)
+    first = preprocess_farsi_text(text)
+    second = preprocess_farsi_text(text)
+    assert first == second == enhanced_processor.preprocess_text(text)
+    assert metrics.snapshot()["counters"]["preprocess_memo.hits"] == hits + 1
+    assert preprocess_memo.stats()["entries"] == 1
+
+
+def test_term_changes_invalidate_memo():
+    preprocess_memo.clear()
+    text = "استفاده از Zanzibar در متن"
+    before = preprocess_farsi_text(text)
+    original_terms = enhanced_processor.ltr_terms
+    try:
+        enhanced_processor.add_ltr_terms(["Zanzibar"])
+        after = preprocess_farsi_text(text)
+        assert after != before
+        assert '<span dir="ltr">Zanzibar</span>' in after
+    finally:
+        enhanced_processor.ltr_terms = original_terms
+    assert preprocess_farsi_text(text) == before
+
+
+if __name__ == "__main__":
+    test_lru_stays_within_byte_budget()
+    test_repeated_input_is_served_from_memo()
+    test_term_changes_invalidate_memo()
+    print("All preprocessing memo checks passed")
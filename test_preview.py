@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Checks for the live HTML preview (app/preview.py, /api/preview, /api/preview/ws)
+"""
+import os
+import sys
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from app import main, metrics
+from app.main import app, rate_limiter
+from app.preview import PREVIEW_BLOCK_MARKER, PreviewRenderer, _pandoc_html
+from app.rate_limiter import MemoryRateLimitBackend
+
+BLOCKS = [
+    "# عنوان\n\n## مقدمه\n\nمتن مقدمه با Python و `code`.\n",
+    "## جدول\n\n| ستون | مقدار |\n|------|-------|\n| یک   | ۲     |\n",
+    "## فهرست\n\n- مورد اول\n- مورد دوم\n",
+    "## پایان\n\nمتن پایانی.\n",
+]
+DOCUMENT = "\n".join(BLOCKS)
+
+
+def _counter(name: str) -> int:
+    return metrics.snapshot()["counters"].get(name, 0)
+
+
+def test_preview_is_rtl_html_of_the_preprocessed_text():
+    client = TestClient(app)
+    response = client.post("/api/preview", data={"text": DOCUMENT})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/html")
+    html = response.text
+    assert html.startswith('<div dir="rtl" lang="fa">')
+    assert '<span dir="ltr">Python</span>' in html
+    assert "<table" in html
+    assert PREVIEW_BLOCK_MARKER not in html
+    positions = [html.index(heading) for heading in ("مقدمه", "جدول", "فهرست", "پایان")]
+    assert positions == sorted(positions)
+
+
+def test_only_changed_blocks_are_rendered_again():
+    renderer = PreviewRenderer(cache_bytes=1024 * 1024, concurrency=1)
+    first = renderer.render(DOCUMENT)
+    assert first["blocks"] == first["rendered"] == 4
+    second = renderer.render(DOCUMENT.replace("متن پایانی", "متن ویرایش‌شده"))
+    assert second["rendered"] == 1
+    assert "ویرایش" in second["html"]
+    # Blocks rendered together in one Pandoc run come out the same as blocks rendered alone
+    fresh = PreviewRenderer(cache_bytes=1024 * 1024, concurrency=1)
+    assert fresh.render(DOCUMENT.replace("متن پایانی", "متن ویرایش‌شده"))["html"] == second["html"]
+
+
+def test_swallowed_marker_falls_back_to_rendering_blocks_one_by_one():
+    def swallowing(markdown_text, timeout):
+        # What Pandoc does when a block leaves an element open over the next marker
+        return _pandoc_html(markdown_text, timeout).replace(PREVIEW_BLOCK_MARKER, "", 1)
+
+    expected = "\n".join(PreviewRenderer._render_blocks([block], 30)[0] for block in BLOCKS)
+    fallbacks = _counter("preview.marker_fallbacks")
+    renderer = PreviewRenderer(cache_bytes=1024 * 1024, concurrency=1)
+    with mock.patch("app.preview._pandoc_html", side_effect=swallowing):
+        result = renderer.render(DOCUMENT)
+    assert _counter("preview.marker_fallbacks") == fallbacks + 1
+    assert result["rendered"] == 4
+    assert result["html"] == f'<div dir="rtl" lang="fa">\n{expected}\n</div>'
+    # The blocks rendered one by one are cached like any others
+    assert renderer.render(DOCUMENT)["rendered"] == 0
+
+
+def test_blocks_are_reused_across_requests():
+    client = TestClient(app)
+    renderer = PreviewRenderer(cache_bytes=1024 * 1024, concurrency=1)
+    with mock.patch.object(main, "preview_renderer", renderer):
+        first = client.post("/api/preview", data={"text": DOCUMENT})
+        second = client.post("/api/preview", data={"text": DOCUMENT})
+        edited = client.post("/api/preview", data={"text": DOCUMENT.replace("مورد دوم", "مورد سوم")})
+    assert first.headers["x-blocks"] == first.headers["x-blocks-rendered"] == "4"
+    assert second.headers["x-blocks-rendered"] == "0"
+    assert second.text == first.text
+    assert edited.headers["x-blocks-rendered"] == "1"
+    assert "مورد سوم" in edited.text
+
+
+def test_socket_coalesces_edits():
+    client = TestClient(app)
+    with client.websocket_connect("/api/preview/ws") as websocket:
+        websocket.send_json({"seq": 1, "text": "# یک"})
+        websocket.send_json({"seq": 2, "text": DOCUMENT})
+        message = websocket.receive_json()
+        assert message["seq"] == 2
+        assert 'dir="rtl"' in message["html"]
+        websocket.send_text("not json")
+        assert "error" in websocket.receive_json()
+
+
+def test_socket_renders_count_against_the_rate_limit():
+    client = TestClient(app)
+    # One check for the connection and one for the render leave nothing for a second render
+    with mock.patch.object(rate_limiter, "limit", 2), mock.patch.object(rate_limiter, "_backend", MemoryRateLimitBackend()):
+        with client.websocket_connect("/api/preview/ws") as websocket:
+            websocket.send_json({"seq": 1, "text": "# یک"})
+            assert websocket.receive_json()["seq"] == 1
+            websocket.send_json({"seq": 2, "text": "# دو"})
+            try:
+                websocket.receive_json()
+                assert False, "the socket should have been closed"
+            except WebSocketDisconnect as e:
+                assert e.code == 1008
+
+
+if __name__ == "__main__":
+    test_preview_is_rtl_html_of_the_preprocessed_text()
+    test_only_changed_blocks_are_rendered_again()
+    test_swallowed_marker_falls_back_to_rendering_blocks_one_by_one()
+    test_blocks_are_reused_across_requests()
+    test_socket_coalesces_edits()
+    test_socket_renders_count_against_the_rate_limit()
+    print("All preview checks passed")
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Checks for the sliding-window rate limiter (app/rate_limiter.py)
+"""
+import os
+import sys
+import tempfile
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from fastapi.testclient import TestClient
+
+from app import rate_limiter as rate_limiter_module
+from app.rate_limiter import (
+    MemoryRateLimitBackend, RateLimiter, SqliteRateLimitBackend, sliding_window_check,
+)
+
+
+def test_previous_window_is_weighted_by_overlap():
+    # 10 requests last window, a quarter of this one elapsed: 7.5 still count
+    assert sliding_window_check(10, 0, 0.25, limit=10) == (True, 1)
+    assert sliding_window_check(10, 2, 0.25, limit=10) == (False, 0)
+    assert sliding_window_check(10, 0, 1.0, limit=10) == (True, 9)
+
+
+def test_memory_backend_limits_and_evicts_idle_keys():
+    backend = MemoryRateLimitBackend()
+    limiter = RateLimiter(limit=3, window=60, backend=backend)
+    with mock.patch.object(rate_limiter_module.time, "time", return_value=6000.0):
+        results = [limiter.check("1.2.3.4") for _ in range(4)]
+        assert [r.allowed for r in results] == [True, True, True, False]
+        assert [r.remaining for r in results] == [2, 1, 0, 0]
+        assert limiter.check("5.6.7.8").allowed
+    assert len(backend) == 2
+    # Two windows later both keys are idle and get dropped on the next check
+    with mock.patch.object(rate_limiter_module.time, "time", return_value=6000.0 + 180):
+        assert limiter.check("9.9.9.9").allowed
+    assert len(backend) == 1
+
+
+def test_sqlite_backend_is_shared_between_instances():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "ratelimit.sqlite3")
+        first = RateLimiter(limit=2, window=60, backend=SqliteRateLimitBackend(path))
+        second = RateLimiter(limit=2, window=60, backend=SqliteRateLimitBackend(path))
+        with mock.patch.object(rate_limiter_module.time, "time", return_value=6000.0):
+            assert first.check("ip").allowed
+            assert second.check("ip").allowed
+            assert not first.check("ip").allowed
+
+
+def test_responses_carry_rate_limit_headers():
+    from app.main import app, rate_limiter
+    with mock.patch.object(rate_limiter, "limit", 1), mock.patch.object(rate_limiter, "_backend", MemoryRateLimitBackend()):
+        with TestClient(app) as client:
+            response = client.post("/api/convert", data={"text": "# سلام", "format": "docx"})
+            assert response.status_code == 200
+            assert response.headers["X-RateLimit-Limit"] == "1"
+            assert response.headers["X-RateLimit-Remaining"] == "0"
+            limited = client.post("/api/convert", data={"text": "# سلام", "format": "docx"})
+            assert limited.status_code == 429
+            assert int(limited.headers["Retry-After"]) >= 1
+            assert "X-RateLimit-Reset" in limited.headers
+
+
+if __name__ == "__main__":
+    test_previous_window_is_weighted_by_overlap()
+    test_memory_backend_limits_and_evicts_idle_keys()
+    test_sqlite_backend_is_shared_between_instances()
+    test_responses_carry_rate_limit_headers()
+    print("All rate limiter checks passed")
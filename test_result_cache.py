@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Checks for the conversion result cache (app/result_cache.py)
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app.converter import conversion_cache_key
+from app.result_cache import ResultCache
+
+
+def test_lru_eviction_by_size():
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ResultCache(directory, max_bytes=250, ttl_seconds=3600)
+        cache.put("a", "docx", b"a" * 100)
+        cache.put("b", "docx", b"b" * 100)
+        assert cache.get("a", "docx") == b"a" * 100  # "a" is now the most recently used
+        cache.put("c", "docx", b"c" * 100)
+        assert cache.get("b", "docx") is None
+        assert cache.get("a", "docx") is not None and cache.get("c", "docx") is not None
+        assert sorted(os.listdir(directory)) == ["a.docx", "c.docx"]
+        assert cache.stats()["bytes"] == 200
+
+
+def test_entries_expire():
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ResultCache(directory, max_bytes=10_000, ttl_seconds=60)
+        cache.put("old", "docx", b"x")
+        past = time.time() - 120
+        os.utime(os.path.join(directory, "old.docx"), (past, past))
+        # A fresh index (e.g. after a restart) sees the file's age
+        cache = ResultCache(directory, max_bytes=10_000, ttl_seconds=60)
+        assert cache.get_path("old", "docx") is None
+        assert not os.path.exists(os.path.join(directory, "old.docx"))
+
+
+def test_memory_tier_and_shared_directory():
+    with tempfile.TemporaryDirectory() as directory:
+        writer = ResultCache(directory, max_bytes=10_000, ttl_seconds=3600, memory_max_bytes=1_000)
+        reader = ResultCache(directory, max_bytes=10_000, ttl_seconds=3600)
+        reader.get_path("warm", "docx")  # index the (empty) directory first
+        writer.put("k", "docx", b"data")
+        assert writer.stats()["memory_entries"] == 1
+        # Another worker process sharing the directory finds the entry
+        assert reader.get("k", "docx") == b"data"
+        assert reader.stats()["memory_entries"] == 0
+
+
+def test_files_removed_by_another_worker_are_misses():
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ResultCache(directory, max_bytes=10_000, ttl_seconds=3600)
+        cache.put("gone", "docx", b"data")
+        # Another worker process evicts the file this index still lists
+        os.remove(os.path.join(directory, "gone.docx"))
+        assert cache.get_path("gone", "docx") is None
+        assert cache.stats()["entries"] == 0 and cache.stats()["bytes"] == 0
+
+
+def test_key_depends_on_input_and_options():
+    key = conversion_cache_key("# سلام", "docx")
+    assert key == conversion_cache_key("# سلام", "docx")
+    assert key != conversion_cache_key("# سلام!", "docx")
+    assert key != conversion_cache_key("# سلام", "docx", toc=True)
+
+
+if __name__ == "__main__":
+    test_lru_eviction_by_size()
+    test_entries_expire()
+    test_memory_tier_and_shared_directory()
+    test_files_removed_by_another_worker_are_misses()
+    test_key_depends_on_input_and_options()
+    print("All result cache checks passed")
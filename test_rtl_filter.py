@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Checks for the Lua filter RTL mode (RTL_MODE=filter): Pandoc writes the bidi
+paragraphs itself and pagination comes from the reference document styles
+"""
+import io
+import os
+import re
+import sys
+import zipfile
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app import converter
+
+MARKDOWN = """# عنوان
+
+متن فارسی با <span dir="ltr">Python</span>.
+
+- مورد اول
+- مورد دوم
+
+```
+print("hi")
+```
+
+| ستون ۱ | ستون ۲ |
+|--------|--------|
+| سلول   | ۲      |
+"""
+
+
+def _parts(docx: bytes):
+    with zipfile.ZipFile(io.BytesIO(docx)) as archive:
+        return archive.read("word/document.xml").decode("utf-8"), archive.read("word/styles.xml").decode("utf-8")
+
+
+def _style(styles_xml: str, style_id: str) -> str:
+    match = re.search(rf'<w:style [^>]*w:styleId="{style_id}"[\s\S]*?</w:style>', styles_xml)
+    assert match, f"style {style_id} missing"
+    return match.group(0)
+
+
+def _render(mode: str) -> bytes:
+    previous = converter.RTL_MODE, converter.NATIVE_DOCX_ENABLED, converter.PANDOC_SERVER_ENABLED
+    converter.RTL_MODE, converter.NATIVE_DOCX_ENABLED, converter.PANDOC_SERVER_ENABLED = mode, False, False
+    try:
+        return converter.render_markdown_bytes(MARKDOWN, "docx")
+    finally:
+        converter.RTL_MODE, converter.NATIVE_DOCX_ENABLED, converter.PANDOC_SERVER_ENABLED = previous
+
+
+def test_filter_is_passed_only_in_filter_mode():
+    reference_path = converter.get_reference_docx()
+    assert f"--lua-filter={converter.RTL_FILTER_PATH}" in converter._docx_pandoc_args(reference_path, rtl_filter=True)
+    assert not any(arg.startswith("--lua-filter") for arg in converter._docx_pandoc_args(reference_path))
+
+
+def test_filter_mode_emits_bidi_paragraphs():
+    document_xml, styles_xml = _parts(_render("filter"))
+    paragraphs = re.findall(r"<w:p[ >][\s\S]*?</w:p>", document_xml)
+    assert paragraphs
+    assert all(re.search(r"<w:bidi\s*/>", paragraph) for paragraph in paragraphs)
+    # Pagination is left to the styles instead of being written on every paragraph
+    assert not re.search(r"<w:keepLines\s*/>", document_xml)
+    assert re.search(r"<w:keepNext\s*/>", _style(styles_xml, "Heading1"))
+    assert re.search(r"<w:keepNext\s*/>", _style(styles_xml, "SourceCode"))
+    assert re.search(r"<w:keepLines\s*/>", _style(styles_xml, "Normal"))
+    assert re.search(r"<w:cantSplit\s*/>", _style(styles_xml, "Table"))
+
+
+def test_postprocess_mode_still_rewrites_document_xml():
+    document_xml, _ = _parts(_render("postprocess"))
+    paragraphs = re.findall(r"<w:p[ >][\s\S]*?</w:p>", document_xml)
+    assert all(
+        re.search(r"<w:bidi\s*/>", paragraph) and re.search(r"<w:keepLines\s*/>", paragraph)
+        for paragraph in paragraphs
+    )
+    assert re.search(r"<w:cantSplit\s*/>", document_xml)
+
+
+def test_rtl_mode_is_part_of_the_cache_key():
+    previous = converter.RTL_MODE
+    try:
+        converter.RTL_MODE = "filter"
+        filter_key = converter.conversion_cache_key(MARKDOWN, "docx")
+        converter.RTL_MODE = "postprocess"
+        assert converter.conversion_cache_key(MARKDOWN, "docx") != filter_key
+    finally:
+        converter.RTL_MODE = previous
+
+
+if __name__ == "__main__":
+    test_filter_is_passed_only_in_filter_mode()
+    test_filter_mode_emits_bidi_paragraphs()
+    test_postprocess_mode_still_rewrites_document_xml()
+    test_rtl_mode_is_part_of_the_cache_key()
+    print("All RTL filter checks passed")
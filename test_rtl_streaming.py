@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Check that the streaming RTL rewriter (app/ooxml.py) adds the same properties
+as the tree-based implementation in app/converter.py
+"""
+import io
+import os
+import sys
+import zipfile
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app.converter import _rtl_document_xml, apply_rtl_to_docx_bytes
+from app.ooxml import RtlXmlRewriter, UnsupportedDocumentXml, rewrite_rtl_document_xml
+
+W = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+
+SAMPLE_XML = f"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<w:document xmlns:w="{W}" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<w:body>
+<w:p><w:pPr><w:pStyle w:val="Heading1"/></w:pPr><w:r><w:t>عنوان</w:t></w:r></w:p>
+<w:p><w:r><w:t xml:space="preserve">متن &gt; ساده</w:t></w:r></w:p>
+<w:p/>
+<w:p w:rsidR="00AB"><w:pPr/></w:p>
+<w:p><w:pPr><w:pStyle w:val="SourceCode"/><w:bidi w:val="0"/><w:keepNext/></w:pPr></w:p>
+<w:p><w:pPr><w:pStyle w:val="BodyText"/><w:pPrChange w:id="1"><w:pPr><w:pStyle w:val="Heading2"/></w:pPr></w:pPrChange></w:pPr></w:p>
+<w:tbl>
+<w:tr><w:tc><w:p><w:r><w:t>۱</w:t></w:r></w:p></w:tc></w:tr>
+<w:tr><w:trPr><w:jc w:val="right"/></w:trPr><w:tc><w:tbl><w:tr><w:tc><w:p/></w:tc></w:tr></w:tbl><w:p/></w:tc></w:tr>
+<w:tr><w:tblPrEx><w:tblW w:w="0"/></w:tblPrEx><w:tc><w:p/></w:tc></w:tr>
+<w:tr><w:trPr><w:cantSplit/></w:trPr><w:tc><w:p/></w:tc></w:tr>
+</w:tbl>
+<w:sectPr/>
+</w:body>
+</w:document>
+""".encode("utf-8")
+
+
+def _properties(xml_bytes):
+    """Per paragraph / row: the set of direct property children"""
+    root = ET.fromstring(xml_bytes)
+    ns = {'w': W}
+    paragraphs = []
+    for paragraph in root.iter(f'{{{W}}}p'):
+        pPr = paragraph.find('w:pPr', ns)
+        paragraphs.append(sorted(child.tag for child in pPr) if pPr is not None else None)
+    rows = []
+    for row in root.iter(f'{{{W}}}tr'):
+        trPr = row.find('w:trPr', ns)
+        rows.append(sorted(child.tag for child in trPr) if trPr is not None else None)
+    return paragraphs, rows
+
+
+def test_streaming_matches_tree():
+    assert _properties(rewrite_rtl_document_xml(SAMPLE_XML)) == _properties(_rtl_document_xml(SAMPLE_XML))
+
+
+def test_streaming_is_chunk_size_independent():
+    expected = rewrite_rtl_document_xml(SAMPLE_XML)
+    for chunk_size in (1, 7, 64):
+        rewriter = RtlXmlRewriter()
+        output = b"".join(
+            rewriter.feed(SAMPLE_XML[i:i + chunk_size]) for i in range(0, len(SAMPLE_XML), chunk_size)
+        ) + rewriter.close()
+        assert output == expected, f"chunk size {chunk_size}"
+
+
+def test_unbound_prefix_is_rejected():
+    xml = b'<document xmlns="' + W.encode() + b'"><body><p/></body></document>'
+    try:
+        rewrite_rtl_document_xml(xml)
+    except UnsupportedDocumentXml:
+        return
+    raise AssertionError("expected UnsupportedDocumentXml")
+
+
+def test_untouched_members_are_copied_raw():
+    source = io.BytesIO()
+    with zipfile.ZipFile(source, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('[Content_Types].xml', '<Types/>')
+        zf.writestr('word/styles.xml', '<w:styles xmlns:w="' + W + '"/>' * 50)
+        zf.writestr(zipfile.ZipInfo('word/media/image1.png'), os.urandom(4096))
+        zf.writestr('word/document.xml', SAMPLE_XML)
+    output = apply_rtl_to_docx_bytes(source.getvalue())
+
+    with zipfile.ZipFile(io.BytesIO(source.getvalue())) as before, zipfile.ZipFile(io.BytesIO(output)) as after:
+        assert after.testzip() is None
+        assert after.namelist() == before.namelist()
+        for info in before.infolist():
+            new_info = after.getinfo(info.filename)
+            assert after.read(info.filename) == before.read(info.filename) or info.filename == 'word/document.xml'
+            if info.filename != 'word/document.xml':
+                assert (new_info.compress_type, new_info.compress_size, new_info.CRC) == \
+                    (info.compress_type, info.compress_size, info.CRC)
+
+
+if __name__ == "__main__":
+    test_streaming_matches_tree()
+    test_streaming_is_chunk_size_independent()
+    test_unbound_prefix_is_rejected()
+    test_untouched_members_are_copied_raw()
+    print("All streaming RTL rewrite checks passed")
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Equivalence check: segment_script_runs must return exactly the spans of the
+previous per-character detect_language_spans implementation
+"""
+import os
+import random
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app.utils.text_processor import EnhancedFarsiTextProcessor, FARSI_CHAR_CLASS, segment_script_runs
+
+
+def legacy_detect_language_spans(text):
+    """Copy of the per-character implementation this replaced"""
+    spans = []
+    current_lang = None
+    current_start = 0
+
+    i = 0
+    while i < len(text):
+        char = text[i]
+
+        if re.match(FARSI_CHAR_CLASS, char):
+            char_lang = 'fa'
+        elif re.match(r'[A-Za-z0-9]', char):
+            char_lang = 'en'
+        else:
+            char_lang = current_lang
+
+        if char_lang != current_lang and current_lang is not None:
+            span_text = text[current_start:i]
+            if span_text.strip():
+                spans.append((span_text, current_lang, current_start, i))
+            current_start = i
+
+        current_lang = char_lang
+        i += 1
+
+    if current_start < len(text):
+        span_text = text[current_start:]
+        if span_text.strip():
+            spans.append((span_text, current_lang or 'fa', current_start, len(text)))
+
+    return spans
+
+
+SAMPLES = [
+    "",
+    "   ",
+    "...!",
+    "سلام",
+    "Hello",
+    "  سلام دنیا Hello world، این API است.",
+    "(Facebook) و «Instagram» - v2.1 نسخه ۱۲۳ 456",
+    "- مرحله سوم: تنظیمات Business Account را باز کنید",
+    "ك ی ي ە abc ٠١٢ ۰۱۲ ﻻ",
+    "https://example.com/path?q=سلام&x=1",
+]
+
+# Farsi letters, other Arabic-block characters, ASCII, digits and neutrals
+ALPHABET = "سلامپچژگیكيە٠۱ﻻabcXYZ019 \t.,،؛!?()«»-_/‌"
+
+
+def test_samples_match_legacy():
+    for text in SAMPLES:
+        assert segment_script_runs(text) == legacy_detect_language_spans(text), text
+
+
+def test_random_text_matches_legacy():
+    rng = random.Random(1234)
+    for _ in range(2000):
+        text = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 40)))
+        assert segment_script_runs(text) == legacy_detect_language_spans(text), repr(text)
+
+
+def test_processor_uses_segmentation():
+    processor = EnhancedFarsiTextProcessor()
+    for text in SAMPLES:
+        assert processor.detect_language_spans(text) == legacy_detect_language_spans(text)
+
+
+if __name__ == "__main__":
+    test_samples_match_legacy()
+    test_random_text_matches_legacy()
+    test_processor_uses_segmentation()
+    print("All script run checks passed")
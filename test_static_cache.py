@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Checks for the in-memory static bundle (app/static_cache.py)
+"""
+import gzip
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from fastapi.testclient import TestClient
+
+from app.main import app, static_bundle
+from app.static_cache import StaticBundle
+
+
+def test_homepage_links_to_hashed_assets():
+    with tempfile.TemporaryDirectory() as directory:
+        Path(directory, "index.html").write_text('<link href="/static/site.css"><img src="/static/missing.png">')
+        Path(directory, "site.css").write_text("body { color: red; }\n" * 50)
+        bundle = StaticBundle(Path(directory))
+        css = bundle.get("site.css")
+        html = bundle.homepage().content.decode()
+        assert f'/static/{css.hashed_name}' in html and "/static/missing.png" in html
+        assert bundle.get(css.hashed_name) is css and bundle.is_hashed(css.hashed_name)
+        assert gzip.decompress(css.gzip) == css.content
+
+
+def test_reload_picks_up_changed_files():
+    with tempfile.TemporaryDirectory() as directory:
+        page = Path(directory, "index.html")
+        page.write_text("one")
+        cached, reloading = StaticBundle(Path(directory)), StaticBundle(Path(directory), reload=True)
+        assert cached.homepage().content == reloading.homepage().content == b"one"
+        page.write_text("two")
+        os.utime(page, (time.time() + 5, time.time() + 5))
+        assert cached.homepage().content == b"one"
+        assert reloading.homepage().content == b"two"
+
+
+def test_responses_are_compressed_and_validated():
+    with TestClient(app) as client:
+        page = client.get("/", headers={"Accept-Encoding": "gzip"})
+        assert page.status_code == 200
+        assert page.headers["content-encoding"] == "gzip" and page.headers["cache-control"] == "public, no-cache"
+        assert client.get("/", headers={"If-None-Match": page.headers["etag"]}).status_code == 304
+        # Each content-coding is its own representation with its own strong ETag
+        identity = client.get("/", headers={"Accept-Encoding": "identity"})
+        assert identity.headers["etag"] != page.headers["etag"] and page.headers["etag"].endswith('-gz"')
+        revalidated = client.get("/", headers={"Accept-Encoding": "gzip", "If-None-Match": identity.headers["etag"]})
+        assert revalidated.status_code == 304 and revalidated.headers["etag"] == page.headers["etag"]
+        head = client.head("/", headers={"Accept-Encoding": "gzip"})
+        assert head.content == b"" and head.headers["content-length"] == page.headers["content-length"] != "0"
+
+        plain = client.get("/static/app.js")
+        assert "immutable" not in plain.headers["cache-control"]
+        hashed = client.get(f"/static/{static_bundle.get('app.js').hashed_name}")
+        assert hashed.content == plain.content
+        assert hashed.headers["cache-control"] == "public, max-age=31536000, immutable"
+        assert client.get("/static/../app/main.py").status_code == 404
+
+
+if __name__ == "__main__":
+    test_homepage_links_to_hashed_assets()
+    test_reload_picks_up_changed_files()
+    test_responses_are_compressed_and_validated()
+    print("All static cache checks passed")
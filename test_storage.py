@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Checks for the sharded OUT_DIR layout (app/storage.py)
+"""
+import calendar
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app.storage import drop_expired_shards, migrate_flat_outputs, output_path
+
+UID = "ab" + "0" * 30
+NOON = calendar.timegm((2026, 1, 2, 12, 30, 0, 0, 0, 0))
+
+
+def test_paths_are_sharded_by_hour_and_prefix():
+    with tempfile.TemporaryDirectory() as root:
+        path = output_path(UID, "docx", created=NOON, root=root)
+        assert path == os.path.join(root, "2026010212", "ab", f"{UID}.docx")
+        assert os.path.isdir(os.path.dirname(path))
+        assert not os.path.exists(os.path.dirname(output_path("cd" + UID[2:], "md", root=root, create=False)))
+
+
+def test_expired_hours_are_dropped_whole():
+    with tempfile.TemporaryDirectory() as root:
+        for created in (NOON - 3 * 3600, NOON - 3600, NOON):
+            open(output_path(UID, "docx", created=created, root=root), "wb").close()
+        os.makedirs(os.path.join(root, "not-a-shard"))
+        # Files of 09:xx are at least 2.5h old at 12:30; the 11:xx shard may hold newer ones
+        assert drop_expired_shards(2 * 3600, root=root, now=NOON) == 1
+        assert sorted(os.listdir(root)) == ["2026010211", "2026010212", "not-a-shard"]
+
+
+def test_flat_outputs_are_migrated_by_mtime():
+    with tempfile.TemporaryDirectory() as directory:
+        root = os.path.join(directory, "shards")
+        for name in (f"{UID}.md", f"{UID}.docx", "reference_farsi-123.docx", "notes.txt"):
+            with open(os.path.join(directory, name), "w") as f:
+                f.write("x")
+        os.utime(os.path.join(directory, f"{UID}.docx"), (NOON, NOON))
+        assert migrate_flat_outputs(directory, root=root) == 2
+        assert sorted(os.listdir(directory)) == ["notes.txt", "reference_farsi-123.docx", "shards"]
+        assert os.path.exists(os.path.join(root, "2026010212", "ab", f"{UID}.docx"))
+
+
+if __name__ == "__main__":
+    test_paths_are_sharded_by_hour_and_prefix()
+    test_expired_hours_are_dropped_whole()
+    test_flat_outputs_are_migrated_by_mtime()
+    print("All storage layout checks passed")
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Checks for the LTR term matcher in app/utils/text_processor.py
+"""
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app.utils.text_processor import EnhancedFarsiTextProcessor
+
+MIXED_TEXT = (
+    "برای دریافت Access Token وارد Dashboard حساب facebook شوید و App ID را کپی کنید.\n"
+    "نسخه v2.1 از Graph API خروجی JSON دارد، فایل config.yaml و HTTPS و HTTP.\n"
+    "تنظیمات Business Account در Settings و App   Secret و نسخه 1.2.3"
+)
+
+
+def _wrap_per_term(processor, text):
+    """The previous implementation: one re.sub per term"""
+    for term_pattern in processor.ltr_terms:
+        text = re.sub(term_pattern, lambda m: f'<span dir="ltr">{m.group(0)}</span>', text, flags=re.IGNORECASE)
+    return text
+
+
+def test_combined_matches_per_term():
+    processor = EnhancedFarsiTextProcessor()
+    assert processor.wrap_ltr_terms(MIXED_TEXT) == _wrap_per_term(processor, MIXED_TEXT)
+
+
+def test_urls_and_emails_are_wrapped_whole():
+    processor = EnhancedFarsiTextProcessor()
+    text = "به https://api.github.com/repos مراجعه کنید یا به admin@google.com ایمیل بزنید"
+    assert processor.wrap_ltr_terms(text) == (
+        'به <span dir="ltr">https://api.github.com/repos</span> مراجعه کنید یا به '
+        '<span dir="ltr">admin@google.com</span> ایمیل بزنید'
+    )
+
+
+def test_terms_are_configurable():
+    processor = EnhancedFarsiTextProcessor()
+    assert processor.wrap_ltr_terms("با Kubernetes کار کنید") == "با Kubernetes کار کنید"
+    processor.add_ltr_terms(["Kubernetes", "Docker Compose"])
+    assert processor.wrap_ltr_terms("با kubernetes و Docker  Compose کار کنید") == (
+        'با <span dir="ltr">kubernetes</span> و <span dir="ltr">Docker  Compose</span> کار کنید'
+    )
+    processor.ltr_terms = [r'#\w+']
+    assert processor.wrap_ltr_terms("API و #tag") == 'API و <span dir="ltr">#tag</span>'
+    processor.ltr_terms = []
+    assert processor.wrap_ltr_terms("API") == "API"
+
+
+if __name__ == "__main__":
+    test_combined_matches_per_term()
+    test_urls_and_emails_are_wrapped_whole()
+    test_terms_are_configurable()
+    print("All text processor checks passed")